@@ -1,129 +1,709 @@
+import os
+import time
+from collections import Counter
 from sqlalchemy import text
 from pgvector import Vector
-from db import get_db
-from embeddings import embed
+from cache import LRUCache
+import embeddings
+from db import get_db, count_embedded_logs, fetch_embedding_matrix, iter_embedding_chunks, vector_index_info, vector_to_numpy
+from db import quantized_expression, VECTOR_INDEX_RESCORE
+from embedding_cache import embed_batch_cached, embed_cached
+from rollups import ERROR_LEVELS
+import metrics
+import templates
+import vector_store
 from datetime import datetime
 from typing import Optional
 
+# Filtered searches the planner expects to match at most this many rows are
+# ranked exactly over the filtered rows instead of going through the ANN index
+SEARCH_EXACT_MAX_ROWS = int(os.getenv("SEARCH_EXACT_MAX_ROWS", "20000"))
+# When filters leave fewer than top_k ANN results, retry with ef_search/probes
+# multiplied by SEARCH_WIDEN_FACTOR, at most SEARCH_MAX_WIDENINGS times
+SEARCH_WIDEN_FACTOR = int(os.getenv("SEARCH_WIDEN_FACTOR", "4"))
+SEARCH_MAX_WIDENINGS = int(os.getenv("SEARCH_MAX_WIDENINGS", "2"))
+_HNSW_EF_SEARCH_DEFAULT = 40  # pgvector's default
+_HNSW_EF_SEARCH_MAX = 1000
 
-def find_similar_logs(
-    query: str,
-    top_k: int = 5,
-    level: Optional[str] = None,
-    service: Optional[str] = None,
-    start_time: Optional[datetime] = None,
-    end_time: Optional[datetime] = None,
-):
-    """Find similar logs with optional structured filters."""
-    db = get_db()
-    embedding = embed(query)
+_index_method = LRUCache(1, ttl=60)
 
-    where_clauses = []
-    params = {"embedding": Vector(embedding), "limit": top_k}
 
+def _filter_sql(level, service, start_time, end_time, params: dict, prefix: str = "") -> str:
+    """WHERE clause for the structured filters; bound values are added to params."""
+    where_clauses = []
     if level:
-        where_clauses.append("level = :level")
+        where_clauses.append(f"{prefix}level = :level")
         params["level"] = level
     if service:
-        where_clauses.append("service = :service")
+        where_clauses.append(f"{prefix}service = :service")
         params["service"] = service
     if start_time:
-        where_clauses.append("timestamp >= :start_time")
+        where_clauses.append(f"{prefix}timestamp >= :start_time")
         params["start_time"] = start_time
     if end_time:
-        where_clauses.append("timestamp <= :end_time")
+        where_clauses.append(f"{prefix}timestamp <= :end_time")
         params["end_time"] = end_time
+    return " AND ".join(where_clauses) if where_clauses else "1=1"
 
-    where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
 
-    results = db.execute(
-        text(f"""
+def _set_search_knobs(db, ef_search: Optional[int], probes: Optional[int]):
+    # SET LOCAL scopes the knobs to this transaction (values can't be bound)
+    if ef_search:
+        db.execute(text(f"SET LOCAL hnsw.ef_search = {int(ef_search)}"))
+    if probes:
+        db.execute(text(f"SET LOCAL ivfflat.probes = {int(probes)}"))
+
+
+def _ann_index(db) -> Optional[tuple]:
+    """(method, quantization, dim) of the ANN index on logs.embedding (cached briefly; index builds are rare)."""
+    found = _index_method.get("logs")
+    if found is None:
+        found = vector_index_info(db) or ()
+        _index_method.set("logs", found)
+    return found or None
+
+
+def _estimate_rows(db, where_sql: str, params: dict) -> int:
+    """Planner's row estimate for the filters (plans only, nothing is executed)."""
+    plan = db.execute(text(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM logs l WHERE {where_sql}"), params).scalar()
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def choose_search_plan(db, where_sql: str, params: dict, top_k: int) -> dict:
+    """Pick exact_scan, ann, exact_prefilter or ann_postfilter for a (possibly filtered) search.
+    With a quantized index the ANN plans shortlist rescore * top_k rows and rerank on float32."""
+    found = _ann_index(db)
+    if found is None:
+        return {"strategy": "exact_scan", "index": None}
+    method, quantization, dim = found
+    if where_sql == "1=1":
+        plan = {"strategy": "ann", "index": method}
+    else:
+        estimated = _estimate_rows(db, where_sql, params)
+        strategy = "exact_prefilter" if estimated <= max(SEARCH_EXACT_MAX_ROWS, top_k) else "ann_postfilter"
+        plan = {"strategy": strategy, "index": method, "estimated_rows": estimated}
+    if quantization != "none" and plan["strategy"] != "exact_prefilter":
+        plan.update(quantization=quantization, dim=dim, rescore=VECTOR_INDEX_RESCORE)
+    return plan
+
+
+def _shortlist_order(column: str, query: str, plan: dict) -> str:
+    """ORDER BY expression that matches the quantized index on logs.embedding."""
+    operator = "<~>" if plan["quantization"] == "binary" else "<=>"
+    return (
+        f"{quantized_expression(column, plan['quantization'], plan['dim'])} {operator} "
+        f"{quantized_expression(query, plan['quantization'], plan['dim'])}"
+    )
+
+
+def _search_sql(where_sql: str, exact: bool, plan: Optional[dict] = None) -> str:
+    if not exact and plan and plan.get("quantization"):
+        # The index only sees the compressed vectors; rerank its shortlist exactly
+        return f"""
+        WITH shortlist AS MATERIALIZED (
+            SELECT id, message, level, service, timestamp, embedding
+            FROM logs
+            WHERE {where_sql}
+            ORDER BY {_shortlist_order("embedding", "CAST(:embedding AS vector)", plan)}
+            LIMIT :shortlist
+        )
+        SELECT id, message, level, service, timestamp,
+               embedding <=> :embedding AS distance
+        FROM shortlist
+        ORDER BY distance
+        LIMIT :limit
+        """
+    if exact:
+        # MATERIALIZED keeps the planner from pushing the ORDER BY into the ANN
+        # index; the filters run first on the B-tree indexes
+        return f"""
+        WITH candidates AS MATERIALIZED (
+            SELECT id, message, level, service, timestamp, embedding
+            FROM logs
+            WHERE {where_sql}
+        )
+        SELECT id, message, level, service, timestamp,
+               embedding <=> :embedding AS distance
+        FROM candidates
+        ORDER BY embedding <=> :embedding
+        LIMIT :limit
+        """
+    return f"""
         SELECT id, message, level, service, timestamp,
                embedding <=> :embedding AS distance
         FROM logs
         WHERE {where_sql}
         ORDER BY embedding <=> :embedding
         LIMIT :limit
-        """),
-        params,
-    )
+        """
 
-    rows = [dict(r._mapping) for r in results]
-    db.close()
+
+def _store_search(db, vectors, top_k: int, level, service, start_time, end_time) -> list:
+    """Rank with the in-process vector store, then fetch the winning rows by id.
+    Returns one list of row dicts (with distance) per query vector."""
+    results = vector_store.search(vectors, top_k, level, service, start_time, end_time)
+    ids = sorted({int(i) for ids, _ in results for i in ids})
+    found = {}
+    if ids:
+        found = {
+            r.id: dict(r._mapping)
+            for r in db.execute(
+                text("SELECT id, message, level, service, timestamp FROM logs WHERE id = ANY(:ids)"),
+                {"ids": ids},
+            )
+        }
+    return [
+        [{**found[i], "distance": float(d)} for i, d in zip(ids_.tolist(), distances) if i in found]
+        for ids_, distances in results
+    ]
+
+
+def search_similar_logs(
+    query: str,
+    top_k: int = 5,
+    level: Optional[str] = None,
+    service: Optional[str] = None,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+):
+    """find_similar_logs that also returns the search plan it used: (rows, plan)."""
+    db = get_db()
+    plan = None
+    try:
+        embedding = embed_cached(templates.normalize(query))
+        started = time.perf_counter()
+        if vector_store.serves(start_time):
+            plan = vector_store.search_plan()
+            rows = _store_search(db, [embedding], top_k, level, service, start_time, end_time)[0]
+            return rows, plan
+        rows, plan = sql_search(db, embedding, top_k, level, service, start_time, end_time, ef_search, probes)
+        return rows, plan
+    finally:
+        db.close()
+        if plan is not None:
+            _observe_search(started, plan)
+
+
+def sql_search(
+    db,
+    embedding,
+    top_k: int = 5,
+    level: Optional[str] = None,
+    service: Optional[str] = None,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    rescore: Optional[int] = None,
+):
+    """Nearest logs to an embedding in Postgres: (rows, plan) as in search_similar_logs.
+
+    rescore overrides VECTOR_INDEX_RESCORE for quantized indexes.
+    """
+    params = {"embedding": Vector(embedding), "limit": top_k}
+    where_sql = _filter_sql(level, service, start_time, end_time, params)
+    plan = choose_search_plan(db, where_sql, params, top_k)
+
+    if plan["strategy"] == "exact_prefilter":
+        rows = [dict(r._mapping) for r in db.execute(text(_search_sql(where_sql, exact=True)), params)]
+        return rows, plan
+
+    if plan.get("quantization"):
+        plan["rescore"] = rescore or plan["rescore"]
+        params["shortlist"] = plan["rescore"] * top_k
+        if plan["index"] == "hnsw":
+            # HNSW returns at most ef_search rows, so it has to cover the shortlist
+            ef_search = min(max(ef_search or _HNSW_EF_SEARCH_DEFAULT, params["shortlist"]), _HNSW_EF_SEARCH_MAX)
+    widenings = 0
+    while True:
+        _set_search_knobs(db, ef_search, probes)
+        rows = [dict(r._mapping) for r in db.execute(text(_search_sql(where_sql, exact=False, plan=plan)), params)]
+        if len(rows) >= top_k or plan["strategy"] != "ann_postfilter":
+            break
+        if widenings == SEARCH_MAX_WIDENINGS:
+            # The estimate was off or the filters are selective in vector space
+            # too; answer exactly rather than return fewer than top_k rows
+            rows = [dict(r._mapping) for r in db.execute(text(_search_sql(where_sql, exact=True)), params)]
+            plan["strategy"] = "exact_fallback"
+            break
+        widenings += 1
+        if plan["index"] == "hnsw":
+            ef_search = min((ef_search or _HNSW_EF_SEARCH_DEFAULT) * SEARCH_WIDEN_FACTOR, _HNSW_EF_SEARCH_MAX)
+        else:
+            probes = (probes or 1) * SEARCH_WIDEN_FACTOR
+    if plan["index"]:
+        plan.update(widenings=widenings, ef_search=ef_search, probes=probes)
+    return rows, plan
+
+
+def _observe_search(started: float, plan: dict):
+    """Search time after the query embedding, by the strategy that answered."""
+    elapsed = time.perf_counter() - started
+    metrics.SEARCH_SECONDS.observe(elapsed, strategy=plan["strategy"])
+    metrics.record("search", elapsed)
+
+
+def find_similar_logs(
+    query: str,
+    top_k: int = 5,
+    level: Optional[str] = None,
+    service: Optional[str] = None,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+):
+    """Find similar logs with optional structured filters.
+    ef_search (HNSW) and probes (IVFFlat) tune recall for this query only."""
+    rows, _ = search_similar_logs(query, top_k, level, service, start_time, end_time, ef_search, probes)
     return rows
 
 
-def cluster_failure_patterns(n_clusters: int = 5, level: Optional[str] = None):
-    """Cluster logs into failure patterns using embedding similarity."""
-    import numpy as np
-    from sklearn.cluster import KMeans
+def find_similar_logs_batch(
+    queries: list[str],
+    top_k: int = 5,
+    level: Optional[str] = None,
+    service: Optional[str] = None,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+):
+    """Search for many queries in one embedding batch and one statement. Returns (matches, logs, plan).
+    matches[i] lists {"id", "distance"} for queries[i]; logs holds each matched log once, best first."""
+    unique = list(dict.fromkeys(queries))
+    vectors = embed_batch_cached([templates.normalize(q) for q in unique])
+    # Vectors go over as text literals and are cast server-side to vector[]
+    literals = ["[" + ",".join(repr(float(x)) for x in vec) + "]" for vec in vectors]
 
     db = get_db()
-    where = "WHERE level = :level" if level else ""
-    params = {"level": level} if level else {}
+    started = time.perf_counter()
+    try:
+        if vector_store.serves(start_time):
+            plan = vector_store.search_plan()
+            rows = [
+                {"idx": i + 1, **row}
+                for i, found in enumerate(_store_search(db, vectors, top_k, level, service, start_time, end_time))
+                for row in found
+            ]
+            _observe_search(started, plan)
+            return _merge_batch(queries, unique, rows) + (plan,)
+        _set_search_knobs(db, ef_search, probes)
+        params = {"embeddings": literals, "limit": top_k}
+        where_sql = _filter_sql(level, service, start_time, end_time, params, prefix="l.")
+        plan = choose_search_plan(db, where_sql, params, top_k)
+        if plan["strategy"] == "exact_prefilter":
+            candidates = f"""
+            WITH candidates AS MATERIALIZED (
+                SELECT l.id, l.message, l.level, l.service, l.timestamp, l.embedding
+                FROM logs l
+                WHERE {where_sql}
+            )"""
+            source, where_sql = "candidates l", "1=1"
+        else:
+            candidates, source = "", "logs l"
+        if plan.get("quantization"):
+            # Shortlist on the quantized index, rerank on the float32 embedding
+            params["shortlist"] = plan["rescore"] * top_k
+            if plan["index"] == "hnsw":
+                _set_search_knobs(db, min(max(ef_search or _HNSW_EF_SEARCH_DEFAULT, params["shortlist"]),
+                                          _HNSW_EF_SEARCH_MAX), None)
+            nearest = f"""
+                SELECT s.id, s.message, s.level, s.service, s.timestamp,
+                       s.embedding <=> q.embedding AS distance
+                FROM (
+                    SELECT l.id, l.message, l.level, l.service, l.timestamp, l.embedding
+                    FROM {source}
+                    WHERE {where_sql}
+                    ORDER BY {_shortlist_order("l.embedding", "q.embedding", plan)}
+                    LIMIT :shortlist
+                ) s
+                ORDER BY distance
+                LIMIT :limit"""
+        else:
+            nearest = f"""
+                SELECT l.id, l.message, l.level, l.service, l.timestamp,
+                       l.embedding <=> q.embedding AS distance
+                FROM {source}
+                WHERE {where_sql}
+                ORDER BY l.embedding <=> q.embedding
+                LIMIT :limit"""
+        rows = [dict(r._mapping) for r in db.execute(
+            text(f"""{candidates}
+            SELECT q.idx, m.id, m.message, m.level, m.service, m.timestamp, m.distance
+            FROM unnest(CAST(:embeddings AS vector[])) WITH ORDINALITY AS q(embedding, idx)
+            CROSS JOIN LATERAL ({nearest}
+            ) m
+            ORDER BY q.idx, m.distance
+            """),
+            params,
+        )]
+        if plan["strategy"] == "ann_postfilter":
+            # Queries whose neighbours the filters mostly removed are searched
+            # again one by one, with sql_search's widening and exact fallback
+            found = Counter(r["idx"] for r in rows)
+            short = [idx for idx in range(1, len(unique) + 1) if found[idx] < top_k]
+            for idx in short:
+                single, _ = sql_search(
+                    db, vectors[idx - 1], top_k, level, service, start_time, end_time, ef_search, probes,
+                )
+                rows = [r for r in rows if r["idx"] != idx] + [{"idx": idx, **r} for r in single]
+            plan["reruns"] = len(short)
+    finally:
+        db.close()
+    _observe_search(started, plan)
+    return _merge_batch(queries, unique, rows) + (plan,)
 
-    rows = db.execute(
-        text(f"""
-        SELECT id, message, level, service, timestamp,
-               embedding::text AS embedding_str
-        FROM logs {where}
-        """),
-        params,
-    ).fetchall()
 
-    db.close()
+def _merge_batch(queries: list[str], unique: list[str], rows: list) -> tuple:
+    """(matches, logs) for find_similar_logs_batch from rows tagged with a 1-based query idx."""
+    by_query = {}
+    logs = {}
+    for d in rows:
+        d = dict(d)
+        idx = d.pop("idx") - 1
+        by_query.setdefault(idx, []).append({"id": d["id"], "distance": d["distance"]})
+        seen = logs.get(d["id"])
+        if seen is None:
+            logs[d["id"]] = {**d, "matched_queries": 1}
+        else:
+            seen["matched_queries"] += 1
+            seen["distance"] = min(seen["distance"], d["distance"])
 
-    if len(rows) < n_clusters:
-        n_clusters = max(1, len(rows))
+    position = {q: i for i, q in enumerate(unique)}
+    matches = [by_query.get(position[q], []) for q in queries]
+    ranked = sorted(logs.values(), key=lambda d: (-d["matched_queries"], d["distance"]))
+    return matches, ranked
 
-    if not rows:
-        return []
 
-    embeddings = []
-    for r in rows:
-        vec_str = r.embedding_str.strip("[]")
-        embeddings.append([float(x) for x in vec_str.split(",")])
-    X = np.array(embeddings)
+CLUSTER_ALGORITHMS = ("kmeans", "minibatch", "streaming", "templates")
+CLUSTER_SAMPLES_PER_CLUSTER = 5
+
+
+def _make_clusterer(n_clusters: int, algorithm: str, batch_size: int):
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+
+    if algorithm == "kmeans":
+        return KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+    return MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=3, batch_size=batch_size)
+
+
+def fit_clusters(
+    X,
+    n_clusters: int,
+    algorithm: str = "kmeans",
+    sample_size: Optional[int] = None,
+    pca_components: Optional[int] = None,
+    batch_size: int = 1024,
+):
+    """Cluster an in-memory matrix. Returns (labels, model, pca).
+    With sample_size the model is fit on a random subset and every row assigned with predict()."""
+    import numpy as np
+    from sklearn.decomposition import PCA
+
+    fit_rows = X
+    if sample_size:
+        # Never fit on fewer rows than clusters
+        sample_size = max(sample_size, n_clusters)
+    sampled = bool(sample_size) and len(X) > sample_size
+    if sampled:
+        rng = np.random.default_rng(42)
+        fit_rows = X[rng.choice(len(X), size=sample_size, replace=False)]
+
+    pca = None
+    if pca_components and pca_components < X.shape[1]:
+        pca = PCA(n_components=min(pca_components, len(fit_rows)), random_state=42).fit(fit_rows)
+        fit_rows = pca.transform(fit_rows)
+
+    metrics.CLUSTER_FIT_ROWS.observe(len(fit_rows), algorithm=algorithm)
+    with metrics.timed(metrics.CLUSTER_FIT_SECONDS, "cluster", algorithm=algorithm):
+        model = _make_clusterer(n_clusters, algorithm, batch_size).fit(fit_rows)
+    if not sampled:
+        return model.labels_, model, pca
+    labels = np.empty(len(X), dtype=np.int32)
+    step = max(batch_size, 10000)
+    for i in range(0, len(X), step):
+        part = X[i:i + step]
+        labels[i:i + step] = model.predict(pca.transform(part) if pca is not None else part)
+    return labels, model, pca
+
+
+def partial_fit_chunks(
+    chunks,
+    n_clusters: int,
+    pca_components: Optional[int] = None,
+    batch_size: int = 1024,
+):
+    """Fit MiniBatchKMeans with partial_fit over an iterable of (ids, X) chunks.
+
+    Returns (model, pca); model is None when fewer than n_clusters rows arrived.
+    """
+    import numpy as np
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.decomposition import PCA
+
+    # partial_fit needs at least n_clusters rows in its first call
+    batch_size = max(batch_size, n_clusters)
+    model = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=batch_size)
+    pca = None
+    pending = []
+    for _, X in chunks:
+        if pca_components and pca is None and pca_components < X.shape[1]:
+            # Fit the projection on the first chunk only; later chunks reuse it
+            pca = PCA(n_components=min(pca_components, len(X)), random_state=42).fit(X)
+        Xr = pca.transform(X) if pca is not None else X
+        if pending is not None:
+            pending.append(Xr)
+            if sum(len(p) for p in pending) < n_clusters:
+                continue
+            Xr = np.vstack(pending)
+            pending = None
+        for i in range(0, len(Xr), batch_size):
+            model.partial_fit(Xr[i:i + batch_size])
+    return (None if pending is not None else model), pca
+
+
+def fit_clusters_streaming(
+    chunks,
+    n_clusters: int,
+    pca_components: Optional[int] = None,
+    batch_size: int = 1024,
+):
+    """Two-pass mini-batch k-means over chunks(), a callable returning fresh (ids, X) iterators.
+    Returns (sizes, sample_ids, model, pca)."""
+    import numpy as np
+
+    with metrics.timed(metrics.CLUSTER_FIT_SECONDS, "cluster", algorithm="streaming"):
+        model, pca = partial_fit_chunks(chunks(), n_clusters, pca_components, batch_size)
+    sizes = np.zeros(n_clusters, dtype=np.int64)
+    sample_ids = {}
+    if model is None:
+        return sizes, sample_ids, None, pca
+    for ids, X in chunks():
+        labels = model.predict(pca.transform(X) if pca is not None else X)
+        sizes += np.bincount(labels, minlength=n_clusters)
+        for i in np.unique(labels):
+            kept = sample_ids.setdefault(int(i), [])
+            if len(kept) < CLUSTER_SAMPLES_PER_CLUSTER:
+                kept.extend(ids[labels == i][:CLUSTER_SAMPLES_PER_CLUSTER - len(kept)].tolist())
+    return sizes, sample_ids, model, pca
+
+
+def cluster_failure_patterns(
+    n_clusters: int = 5,
+    level: Optional[str] = None,
+    algorithm: str = "kmeans",
+    sample_size: Optional[int] = None,
+    pca_components: Optional[int] = None,
+    batch_size: int = 1024,
+):
+    """Cluster logs into failure patterns using embedding similarity.
+    algorithm is one of kmeans, minibatch, streaming or templates."""
+    import numpy as np
+
+    if algorithm not in CLUSTER_ALGORITHMS:
+        raise ValueError(f"Unknown clustering algorithm {algorithm!r}; expected one of {CLUSTER_ALGORITHMS}")
+
+    if algorithm == "templates":
+        return cluster_templates(n_clusters, level=level)
+
+    where = "level = :level" if level else "1=1"
+    params = {"level": level} if level else {}
+
+    if algorithm == "streaming":
+        n_rows = count_embedded_logs(where, params)
+        if not n_rows:
+            return []
+        n_clusters = max(1, min(n_clusters, n_rows))
+        sizes, sample_ids, _, _ = fit_clusters_streaming(
+            lambda: iter_embedding_chunks(where, params),
+            n_clusters,
+            pca_components=pca_components,
+            batch_size=batch_size,
+        )
+    else:
+        ids, X = fetch_embedding_matrix(where, params)
 
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-    labels = kmeans.fit_predict(X)
+        if len(ids) < n_clusters:
+            n_clusters = max(1, len(ids))
+
+        if not len(ids):
+            return []
+
+        labels, _, _ = fit_clusters(X, n_clusters, algorithm, sample_size, pca_components, batch_size)
+        sizes = np.bincount(labels, minlength=n_clusters)
+        sample_ids = {
+            i: ids[labels == i][:CLUSTER_SAMPLES_PER_CLUSTER].tolist()
+            for i in range(n_clusters) if sizes[i]
+        }
+
+    # Only the few sample rows shown per cluster need their metadata
+    samples = _fetch_logs_by_id([j for js in sample_ids.values() for j in js])
 
     clusters = []
-    for i in range(n_clusters):
-        indices = [j for j, l in enumerate(labels) if l == i]
-        if not indices:
-            continue
-        cluster_logs = []
-        for j in indices:
-            d = dict(rows[j]._mapping)
-            d.pop("embedding_str", None)
-            cluster_logs.append(d)
-        centroid = kmeans.cluster_centers_[i]
+    for i, cluster_ids in sorted(sample_ids.items()):
         clusters.append({
             "cluster_id": i,
-            "size": len(indices),
-            "logs": cluster_logs[:5],
+            "size": int(sizes[i]),
+            "logs": [samples[j] for j in cluster_ids if j in samples],
         })
 
     return clusters
 
 
-def correlate_with_deployments(service: str):
+def cluster_templates(n_clusters: int = 5, level: Optional[str] = None):
+    """Cluster log templates, each weighted by how many logs it covers.
+    Cost depends on the number of distinct templates, not on the number of logs."""
+    import numpy as np
+    from sklearn.cluster import KMeans
+
+    # Stored counts cover every level; a level filter recounts from logs
+    counts_sql = (
+        "SELECT template_id AS id, count(*) AS n FROM logs WHERE level = :level GROUP BY template_id"
+        if level else "SELECT id, count AS n FROM log_templates"
+    )
     db = get_db()
+    try:
+        rows = db.execute(
+            text(f"""
+            SELECT t.id, t.template, t.embedding, c.n
+            FROM log_templates t JOIN ({counts_sql}) c ON c.id = t.id
+            WHERE c.n > 0 AND t.embedding IS NOT NULL AND vector_dims(t.embedding) = :dim
+            """),
+            {"level": level, "dim": embeddings.EMBEDDING_DIM},
+        ).fetchall()
+    finally:
+        db.close()
+    if not rows:
+        return []
 
-    results = db.execute(
-        text("""
-        SELECT d.service, d.version, d.deployed_at,
-               l.message, l.timestamp, l.level
-        FROM deployments d
-        JOIN logs l ON l.service = d.service
-        WHERE d.service = :service AND l.timestamp >= d.deployed_at
-        ORDER BY l.timestamp DESC
-        LIMIT 20
-        """),
-        {"service": service},
+    X = np.stack([vector_to_numpy(r.embedding) for r in rows])
+    weights = np.array([r.n for r in rows], dtype=np.float64)
+    n_clusters = max(1, min(n_clusters, len(rows)))
+    metrics.CLUSTER_FIT_ROWS.observe(len(X), algorithm="templates")
+    with metrics.timed(metrics.CLUSTER_FIT_SECONDS, "cluster", algorithm="templates"):
+        labels = KMeans(n_clusters=n_clusters, random_state=42, n_init=10).fit(X, sample_weight=weights).labels_
+
+    members = {}
+    for r, label in sorted(zip(rows, labels), key=lambda p: -p[0].n):
+        members.setdefault(int(label), []).append(r)
+    latest = _latest_log_per_template(
+        [r.id for group in members.values() for r in group[:CLUSTER_SAMPLES_PER_CLUSTER]], level,
     )
+    return [
+        {
+            "cluster_id": i,
+            "size": int(sum(r.n for r in group)),
+            "templates": [{"template_id": r.id, "template": r.template, "count": int(r.n)} for r in group],
+            "logs": [latest[r.id] for r in group[:CLUSTER_SAMPLES_PER_CLUSTER] if r.id in latest],
+        }
+        for i, group in sorted(members.items())
+    ]
+
 
-    rows = [dict(r._mapping) for r in results]
+def _latest_log_per_template(template_ids: list, level: Optional[str] = None) -> dict:
+    if not template_ids:
+        return {}
+    level_sql = "AND level = :level" if level else ""
+    db = get_db()
+    rows = db.execute(
+        text(f"""
+        SELECT t.id AS template_id, l.id, l.message, l.level, l.service, l.timestamp
+        FROM unnest(CAST(:ids AS int[])) AS t(id)
+        CROSS JOIN LATERAL (
+            SELECT id, message, level, service, timestamp FROM logs
+            WHERE template_id = t.id {level_sql}
+            ORDER BY timestamp DESC LIMIT 1
+        ) l
+        """),
+        {"ids": template_ids, "level": level},
+    ).fetchall()
+    db.close()
+    return {r.template_id: {k: v for k, v in r._mapping.items() if k != "template_id"} for r in rows}
+
+
+def _fetch_logs_by_id(ids: list) -> dict:
+    if not ids:
+        return {}
+    db = get_db()
+    rows = db.execute(
+        text("""
+        SELECT id, message, level, service, timestamp
+        FROM logs WHERE id = ANY(:ids)
+        """),
+        {"ids": ids},
+    ).fetchall()
     db.close()
-    return rows
\ No newline at end of file
+    return {r.id: dict(r._mapping) for r in rows}
+
+
+def correlate_with_deployments(service: str, window_minutes: int = 30, limit: int = 20):
+    """Rank a service's recent deployments by the Poisson z-score of the error spike after them.
+    Returns (ranked deployments, logs after the top one); counts come from the rollups."""
+    db = get_db()
+    try:
+        ranked = db.execute(
+            text("""
+            WITH recent AS (
+                SELECT id, service, version, deployed_at,
+                       date_trunc('minute', deployed_at) AS pivot
+                FROM deployments
+                WHERE service = :service
+                ORDER BY deployed_at DESC
+                LIMIT :limit
+            )
+            SELECT d.id, d.service, d.version, d.deployed_at,
+                   b.errors AS errors_before, b.total AS total_before,
+                   a.errors AS errors_after, a.total AS total_after
+            FROM recent d
+            CROSS JOIN LATERAL (
+                SELECT coalesce(sum(count) FILTER (WHERE level = ANY(:error_levels)), 0)::bigint AS errors,
+                       coalesce(sum(count), 0)::bigint AS total
+                FROM log_counts_minute
+                WHERE service = d.service
+                  AND minute >= d.pivot - make_interval(mins => :window) AND minute < d.pivot
+            ) b
+            CROSS JOIN LATERAL (
+                -- The deployment's own minute counts as after
+                SELECT coalesce(sum(count) FILTER (WHERE level = ANY(:error_levels)), 0)::bigint AS errors,
+                       coalesce(sum(count), 0)::bigint AS total
+                FROM log_counts_minute
+                WHERE service = d.service
+                  AND minute >= d.pivot AND minute < d.pivot + make_interval(mins => :window)
+            ) a
+            """),
+            {"service": service, "limit": limit, "window": window_minutes, "error_levels": list(ERROR_LEVELS)},
+        ).fetchall()
+
+        deployments = []
+        for r in ranked:
+            d = dict(r._mapping)
+            expected = d["errors_before"]
+            d["spike_score"] = round((d["errors_after"] - expected) / max(expected, 1) ** 0.5, 3)
+            d["error_rate_before"] = round(d["errors_before"] / d["total_before"], 4) if d["total_before"] else None
+            d["error_rate_after"] = round(d["errors_after"] / d["total_after"], 4) if d["total_after"] else None
+            deployments.append(d)
+        deployments.sort(key=lambda d: (d["spike_score"], d["deployed_at"]), reverse=True)
+
+        logs = []
+        if deployments:
+            top = deployments[0]
+            logs = [
+                {**dict(r._mapping), "version": top["version"], "deployed_at": top["deployed_at"]}
+                for r in db.execute(
+                    text("""
+                    SELECT service, message, timestamp, level
+                    FROM logs
+                    WHERE service = :service
+                      AND timestamp >= :start AND timestamp < :start + make_interval(mins => :window)
+                    ORDER BY timestamp DESC
+                    LIMIT 20
+                    """),
+                    {"service": service, "start": top["deployed_at"], "window": window_minutes},
+                )
+            ]
+        return deployments, logs
+    finally:
+        db.close()
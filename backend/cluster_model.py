@@ -0,0 +1,307 @@
+"""Persisted, versioned cluster model: refits in the workers, incremental assignment at ingest.
+/cluster answers with a GROUP BY over logs.cluster_id instead of re-clustering."""
+import logging
+import os
+import threading
+import time
+from typing import Optional
+import numpy as np
+from sqlalchemy import text
+from pgvector import Vector
+from psycopg2.extras import execute_values
+from analyzer import partial_fit_chunks
+from db import engine, get_db, iter_embedding_chunks, vector_to_numpy
+import result_cache
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_MODEL_K = int(os.getenv("CLUSTER_MODEL_K", "5"))
+CLUSTER_MODEL_PCA = int(os.getenv("CLUSTER_MODEL_PCA", "0")) or None
+# Seconds between scheduled refits; 0 disables the scheduler (drift still triggers)
+CLUSTER_REFIT_INTERVAL = int(os.getenv("CLUSTER_REFIT_INTERVAL", "0"))
+CLUSTER_DRIFT_RATIO = float(os.getenv("CLUSTER_DRIFT_RATIO", "1.25"))
+CLUSTER_DRIFT_MIN_ROWS = int(os.getenv("CLUSTER_DRIFT_MIN_ROWS", "5000"))
+# How often ingest re-checks which model version is active
+CLUSTER_MODEL_POLL = float(os.getenv("CLUSTER_MODEL_POLL", "30"))
+
+_lock = threading.Lock()
+_refit_lock = threading.Lock()
+_refit_requested = threading.Event()
+_active = {"version": None, "centroids": None, "mean_distance": None, "checked_at": 0.0}
+_drift = {"rows": 0, "distance_sum": 0.0}
+_scheduler = None
+
+
+def _load_active(force: bool = False):
+    """Refresh the cached active centroids when the poll interval has passed."""
+    now = time.monotonic()
+    with _lock:
+        if not force and now - _active["checked_at"] < CLUSTER_MODEL_POLL:
+            return _active["version"], _active["centroids"]
+        _active["checked_at"] = now
+        cached_version = _active["version"]
+    with engine.connect() as conn:
+        row = conn.execute(text(
+            "SELECT version, mean_distance FROM cluster_models WHERE active ORDER BY version DESC LIMIT 1"
+        )).first()
+        if row is None:
+            version, centroids, mean_distance = None, None, None
+        elif row.version == cached_version:
+            return cached_version, _active["centroids"]
+        else:
+            rows = conn.execute(
+                text("SELECT cluster_id, centroid FROM cluster_centroids WHERE version = :v ORDER BY cluster_id"),
+                {"v": row.version},
+            ).fetchall()
+            version, mean_distance = row.version, row.mean_distance
+            centroids = np.vstack([vector_to_numpy(r.centroid) for r in rows])
+    with _lock:
+        _active.update(version=version, centroids=centroids, mean_distance=mean_distance)
+        _drift.update(rows=0, distance_sum=0.0)
+    return version, centroids
+
+
+def nearest_centroids(X: np.ndarray, centroids: np.ndarray):
+    """Index of and Euclidean distance to the nearest centroid for each row of X."""
+    # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2, without materializing x - c
+    d2 = (X * X).sum(axis=1)[:, None] - 2.0 * X @ centroids.T + (centroids * centroids).sum(axis=1)[None, :]
+    labels = d2.argmin(axis=1)
+    return labels, np.sqrt(np.maximum(d2[np.arange(len(X)), labels], 0.0))
+
+
+def assign(vectors) -> tuple[Optional[int], Optional[np.ndarray]]:
+    """Assign freshly embedded vectors to the active model. Returns (version, labels).
+
+    Also feeds the drift monitor; returns (None, None) when no model is active.
+    """
+    version, centroids = _load_active()
+    if version is None or not len(vectors):
+        return None, None
+    X = np.asarray(vectors, dtype=np.float32)
+    if X.shape[1] != centroids.shape[1]:
+        return None, None
+    labels, distances = nearest_centroids(X, centroids)
+    with _lock:
+        _drift["rows"] += len(distances)
+        _drift["distance_sum"] += float(distances.sum())
+        drifted = (
+            _active["mean_distance"]
+            and _drift["rows"] >= CLUSTER_DRIFT_MIN_ROWS
+            and _drift["distance_sum"] / _drift["rows"] > CLUSTER_DRIFT_RATIO * _active["mean_distance"]
+        )
+    if drifted:
+        _refit_requested.set()
+    return version, labels
+
+
+def _write_assignments(version: int, ids: np.ndarray, labels: np.ndarray):
+    db = get_db()
+    try:
+        cursor = db.connection().connection.cursor()
+        execute_values(
+            cursor,
+            "UPDATE logs SET cluster_id = v.cluster_id, cluster_version = v.version "
+            "FROM (VALUES %s) AS v(id, cluster_id, version) WHERE logs.id = v.id",
+            [(int(i), int(c), version) for i, c in zip(ids, labels)],
+            page_size=1000,
+        )
+        cursor.close()
+        db.commit()
+    finally:
+        db.close()
+
+
+_REFIT_LOCK_KEY = "hashtext('cluster_refit')"
+
+
+def refit(n_clusters: Optional[int] = None, pca_components: Optional[int] = None, batch_size: int = 1024) -> dict:
+    """Fit a new model version over all embedded logs, reassign every row, activate it."""
+    if not _refit_lock.acquire(blocking=False):
+        return {"status": "already_running"}
+    # Held on its own autocommit session for the whole refit, across processes and replicas
+    lock_conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    try:
+        if not lock_conn.execute(text(f"SELECT pg_try_advisory_lock({_REFIT_LOCK_KEY})")).scalar():
+            return {"status": "already_running"}
+        try:
+            return _refit(n_clusters, pca_components, batch_size)
+        finally:
+            lock_conn.execute(text(f"SELECT pg_advisory_unlock({_REFIT_LOCK_KEY})"))
+    finally:
+        lock_conn.close()
+        _refit_lock.release()
+
+
+def _refit(n_clusters: Optional[int], pca_components: Optional[int], batch_size: int) -> dict:
+    _refit_requested.clear()
+    n_clusters = n_clusters or CLUSTER_MODEL_K
+    started = time.monotonic()
+    model, pca = partial_fit_chunks(
+        iter_embedding_chunks(), n_clusters, pca_components or CLUSTER_MODEL_PCA, batch_size
+    )
+    if model is None:
+        return {"status": "not_enough_rows", "n_clusters": n_clusters}
+    # Persist centroids in embedding space so ingest can assign without the PCA
+    centroids = model.cluster_centers_
+    if pca is not None:
+        centroids = pca.inverse_transform(centroids)
+    centroids = centroids.astype(np.float32)
+
+    with engine.begin() as conn:
+        version = conn.execute(
+            text("""
+            INSERT INTO cluster_models (algorithm, n_clusters, pca_components)
+            VALUES ('minibatch', :k, :pca) RETURNING version
+            """),
+            {"k": n_clusters, "pca": pca.n_components_ if pca is not None else None},
+        ).scalar()
+        for i, c in enumerate(centroids):
+            conn.execute(
+                text("INSERT INTO cluster_centroids (version, cluster_id, centroid) VALUES (:v, :i, :c)"),
+                {"v": version, "i": i, "c": Vector(c)},
+            )
+
+    sizes = np.zeros(n_clusters, dtype=np.int64)
+    distance_sum = 0.0
+    for ids, X in iter_embedding_chunks():
+        labels, distances = nearest_centroids(X, centroids)
+        _write_assignments(version, ids, labels)
+        sizes += np.bincount(labels, minlength=n_clusters)
+        distance_sum += float(distances.sum())
+    n_samples = int(sizes.sum())
+
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE cluster_models SET active = false WHERE active"))
+        conn.execute(
+            text("""
+            UPDATE cluster_models
+            SET active = true, n_samples = :n, mean_distance = :d, fit_seconds = :s
+            WHERE version = :v
+            """),
+            {"v": version, "n": n_samples, "d": distance_sum / max(n_samples, 1),
+             "s": time.monotonic() - started},
+        )
+        for i, size in enumerate(sizes):
+            conn.execute(
+                text("UPDATE cluster_centroids SET size = :n WHERE version = :v AND cluster_id = :i"),
+                {"v": version, "i": i, "n": int(size)},
+            )
+        # Rows ingested during the reassignment were labelled by the previous model
+        conn.execute(
+            text("""
+            UPDATE logs SET cluster_version = :v, cluster_id = (
+                SELECT c.cluster_id FROM cluster_centroids c
+                WHERE c.version = :v
+                ORDER BY c.centroid <-> logs.embedding
+                LIMIT 1
+            )
+            WHERE embedding IS NOT NULL AND cluster_version IS DISTINCT FROM :v
+            """),
+            {"v": version},
+        )
+    _load_active(force=True)
+    result_cache.notify_all()
+    return {"status": "fitted", "version": version, "n_clusters": n_clusters, "n_samples": n_samples}
+
+
+def stored_clusters(n_clusters: int, level: Optional[str] = None) -> Optional[dict]:
+    """Cluster sizes and sample logs from stored assignments, or None when no
+    active model has n_clusters clusters (the caller then clusters on the fly)."""
+    with engine.connect() as conn:
+        model = conn.execute(text(
+            "SELECT version, algorithm, n_clusters FROM cluster_models WHERE active ORDER BY version DESC LIMIT 1"
+        )).first()
+        if model is None or model.n_clusters != n_clusters:
+            return None
+        level_sql = "AND level = :level" if level else ""
+        params = {"v": model.version, "level": level}
+        sizes = conn.execute(
+            text(f"""
+            SELECT cluster_id, count(*) AS size FROM logs
+            WHERE cluster_version = :v {level_sql}
+            GROUP BY cluster_id
+            """),
+            params,
+        ).fetchall()
+        samples = conn.execute(
+            text(f"""
+            SELECT c.cluster_id, l.id, l.message, l.level, l.service, l.timestamp
+            FROM cluster_centroids c
+            CROSS JOIN LATERAL (
+                SELECT id, message, level, service, timestamp FROM logs
+                WHERE cluster_version = c.version AND cluster_id = c.cluster_id {level_sql}
+                ORDER BY id
+                LIMIT 5
+            ) l
+            WHERE c.version = :v
+            ORDER BY c.cluster_id, l.id
+            """),
+            params,
+        ).fetchall()
+
+    logs = {}
+    for r in samples:
+        d = dict(r._mapping)
+        logs.setdefault(d.pop("cluster_id"), []).append(d)
+    clusters = [
+        {"cluster_id": r.cluster_id, "size": r.size, "logs": logs.get(r.cluster_id, [])}
+        for r in sorted(sizes, key=lambda r: r.cluster_id)
+    ]
+    return {"clusters": clusters, "model_version": model.version, "algorithm": model.algorithm}
+
+
+def model_status() -> dict:
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT version, algorithm, n_clusters, pca_components, n_samples,
+                   mean_distance, fit_seconds, active, created_at
+            FROM cluster_models ORDER BY version DESC LIMIT 5
+        """)).fetchall()
+    with _lock:
+        drift_rows = _drift["rows"]
+        recent = _drift["distance_sum"] / drift_rows if drift_rows else None
+    return {
+        "models": [dict(r._mapping) for r in rows],
+        "drift": {
+            "rows_since_fit": drift_rows,
+            "recent_mean_distance": recent,
+            "fit_mean_distance": _active["mean_distance"],
+            "threshold_ratio": CLUSTER_DRIFT_RATIO,
+            "refit_pending": _refit_requested.is_set(),
+        },
+        "refit_running": refit_running(),
+    }
+
+
+def refit_running() -> bool:
+    """Whether any process holds the refit advisory lock."""
+    with engine.connect() as conn:
+        return conn.execute(text(f"""
+            SELECT EXISTS (
+                SELECT 1 FROM pg_locks
+                WHERE locktype = 'advisory' AND objsubid = 1
+                  AND ((classid::bigint << 32) | objid::bigint) = {_REFIT_LOCK_KEY}::bigint
+            )
+        """)).scalar()
+
+
+def _run_scheduler():
+    last = time.monotonic()
+    while True:
+        timeout = CLUSTER_REFIT_INTERVAL - (time.monotonic() - last) if CLUSTER_REFIT_INTERVAL else None
+        triggered = _refit_requested.wait(timeout=max(timeout, 0) if timeout is not None else None)
+        try:
+            result = refit()
+            logger.info("Cluster refit (%s): %s", "drift" if triggered else "schedule", result)
+        except Exception:
+            logger.exception("Cluster refit failed")
+            _refit_requested.clear()
+        last = time.monotonic()
+
+
+def start_scheduler():
+    """Start the background refit thread (once per worker process)."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = threading.Thread(target=_run_scheduler, name="cluster-refit", daemon=True)
+        _scheduler.start()
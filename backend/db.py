@@ -1,11 +1,20 @@
+import logging
 import os
+import time
+import numpy as np
 from sqlalchemy import create_engine, text, event
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 from pgvector.psycopg2 import register_vector
 
 load_dotenv()
 
+import embeddings  # noqa: E402  (reads embedding env vars, so load .env first)
+import metrics  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv(
     "DATABASE_URL",
     "postgresql://postgres:postgres@db:5432/logs"
@@ -13,31 +22,237 @@ DATABASE_URL = os.getenv(
 
 # Use Supabase connection pooler (port 6543) to avoid Railway IPv6 connectivity issues.
 # Direct connection (port 5432) often fails with "Network unreachable" from Railway.
-engine = create_engine(DATABASE_URL)
+# Sized for the I/O thread pool in executors.py: request threads that cannot get
+# a connection queue here (up to pool_timeout) instead of opening unbounded ones.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+)
 
 
 @event.listens_for(engine, "connect")
 def _register_vector(dbapi_connection, connection_record):
     register_vector(dbapi_connection, arrays=True)
+
+
+_STATEMENTS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"}
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _observe_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"]
+    keyword = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    kind = keyword if keyword in _STATEMENTS else "OTHER"
+    metrics.DB_SECONDS.observe(elapsed, statement=kind)
+    if cursor.rowcount > 0:
+        metrics.DB_ROWS.inc(cursor.rowcount, statement=kind)
+    metrics.record("db", elapsed)
+
+
 SessionLocal = sessionmaker(bind=engine)
 
+# ANN index on logs.embedding. VECTOR_INDEX_METHOD=hnsw|ivfflat makes init_db
+# create it when missing; /admin/index builds or rebuilds it on demand.
+VECTOR_INDEX_METHOD = os.getenv("VECTOR_INDEX_METHOD", "").lower()
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+# Empty means rows/1000 (sqrt(rows) above 1M rows), as pgvector recommends
+IVFFLAT_LISTS = os.getenv("IVFFLAT_LISTS", "")
+INDEX_MAINTENANCE_WORK_MEM = os.getenv("INDEX_MAINTENANCE_WORK_MEM", "")
+# Index a compressed copy of logs.embedding: "halfvec" (float16, half the index
+# size) or "binary" (one bit per dimension, 1/32), as an expression index so the
+# table keeps full-precision vectors. Searches shortlist VECTOR_INDEX_RESCORE *
+# top_k rows through the index and rerank them on the float32 column.
+# Needs pgvector >= 0.7 (the pgvector/pgvector:pg16 image ships it).
+VECTOR_INDEX_QUANTIZATION = os.getenv("VECTOR_INDEX_QUANTIZATION", "none").lower()
+VECTOR_INDEX_RESCORE = int(os.getenv("VECTOR_INDEX_RESCORE", "10"))
+
+# Native range partitioning of logs on timestamp: "day", "week" or empty for a
+# plain table. Only applies when init_db creates logs; an existing table is
+# converted with partitions.convert_to_partitioned().
+LOGS_PARTITION_INTERVAL = os.getenv("LOGS_PARTITION_INTERVAL", "").lower()
+
+# Rows per round trip when streaming vectors out of Postgres
+EMBEDDING_FETCH_CHUNK = int(os.getenv("EMBEDDING_FETCH_CHUNK", "10000"))
+
+VECTOR_INDEXES = {
+    "hnsw": "logs_embedding_hnsw_idx",
+    "ivfflat": "logs_embedding_ivfflat_idx",
+}
+INDEX_QUANTIZATIONS = ("none", "halfvec", "binary")
+# Widest column each index quantization can cover (vector, halfvec, bit)
+INDEX_MAX_DIMS = {"none": embeddings.MAX_INDEX_DIM, "halfvec": 4000, "binary": 64000}
+
 def get_db():
     return SessionLocal()
 
+def embedding_column_dim(conn, table: str = "logs", column: str = "embedding") -> int | None:
+    """Declared dimension of a vector column (pgvector stores it as the typmod)."""
+    dim = conn.execute(
+        text("""
+        SELECT atttypmod FROM pg_attribute
+        WHERE attrelid = to_regclass(:table) AND attname = :column AND NOT attisdropped
+        """),
+        {"table": table, "column": column},
+    ).scalar()
+    return dim if dim and dim > 0 else None
+
+def logs_is_partitioned(conn) -> bool:
+    return conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('logs')")).scalar() == "p"
+
+def logs_partitions(conn) -> list:
+    """Leaf partitions of logs as (name, bound expression) rows, oldest first."""
+    return conn.execute(text("""
+        SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'logs'::regclass
+        ORDER BY c.relname
+    """)).fetchall()
+
+def vector_to_numpy(value) -> np.ndarray:
+    """float32 array from a fetched vector (pgvector returns ndarray or Vector by version)."""
+    if hasattr(value, "to_numpy"):
+        value = value.to_numpy()
+    return np.asarray(value, dtype=np.float32)
+
+
+def decode_vectors(payloads: list) -> np.ndarray:
+    """Decode vector_send() payloads (uint16 dim, uint16 unused, dim big-endian float32s)
+    into an (n, dim) float32 matrix with one frombuffer call."""
+    dim = int(np.frombuffer(payloads[0], dtype=">u2", count=1)[0])
+    raw = np.frombuffer(b"".join(payloads), dtype=">f4").reshape(len(payloads), dim + 1)
+    return raw[:, 1:].astype(np.float32)
+
+
+def iter_embedding_chunks(where_sql: str = "1=1", params: dict | None = None, chunk_size: int | None = None):
+    """Stream (ids, vectors) chunks of logs matching where_sql, ordered by id.
+    Uses a server-side cursor and pgvector's binary send format."""
+    chunk_size = chunk_size or EMBEDDING_FETCH_CHUNK
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(
+            text(f"""
+            SELECT id, vector_send(embedding) AS payload
+            FROM logs
+            WHERE embedding IS NOT NULL AND ({where_sql})
+            ORDER BY id
+            """),
+            params or {},
+        )
+        for part in result.partitions(chunk_size):
+            ids = np.fromiter((r.id for r in part), dtype=np.int64, count=len(part))
+            yield ids, decode_vectors([bytes(r.payload) for r in part])
+
+
+def count_embedded_logs(where_sql: str = "1=1", params: dict | None = None) -> int:
+    with engine.connect() as conn:
+        return conn.execute(
+            text(f"SELECT count(*) FROM logs WHERE embedding IS NOT NULL AND ({where_sql})"),
+            params or {},
+        ).scalar()
+
+
+def fetch_embedding_matrix(where_sql: str = "1=1", params: dict | None = None, chunk_size: int | None = None):
+    """Load matching vectors into a preallocated float32 matrix. Returns (ids, X)."""
+    n = count_embedded_logs(where_sql, params)
+    ids = np.empty(n, dtype=np.int64)
+    X = None
+    filled = 0
+    for chunk_ids, vectors in iter_embedding_chunks(where_sql, params, chunk_size):
+        if X is None:
+            X = np.empty((n, vectors.shape[1]), dtype=np.float32)
+        # Rows ingested after the count are left for the next run
+        take = min(len(chunk_ids), n - filled)
+        ids[filled:filled + take] = chunk_ids[:take]
+        X[filled:filled + take] = vectors[:take]
+        filled += take
+        if filled >= n:
+            break
+    if X is None:
+        return ids[:0], np.empty((0, 0), dtype=np.float32)
+    return ids[:filled], X[:filled]
+
+
 def init_db():
     with engine.connect() as conn:
+        # The API and the worker service both run this at startup
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('init_db'))"))
         conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
 
+        dim = embeddings.model_dim()
+        if LOGS_PARTITION_INTERVAL:
+            if LOGS_PARTITION_INTERVAL not in ("day", "week"):
+                raise ValueError(f"LOGS_PARTITION_INTERVAL must be 'day' or 'week', not {LOGS_PARTITION_INTERVAL!r}")
+            # The partition key has to be part of the primary key; partitions
+            # themselves are created on demand (see partitions.py)
+            conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS logs (
+                id SERIAL,
+                timestamp TIMESTAMP NOT NULL,
+                level TEXT,
+                service TEXT,
+                message TEXT,
+                embedding vector({dim}),
+                PRIMARY KEY (id, timestamp)
+            ) PARTITION BY RANGE (timestamp);
+            """))
+            if not logs_is_partitioned(conn):
+                logger.warning(
+                    "LOGS_PARTITION_INTERVAL=%s but logs is a plain table; run "
+                    "POST /admin/partitions/convert to partition it.", LOGS_PARTITION_INTERVAL,
+                )
+        else:
+            conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS logs (
+                id SERIAL PRIMARY KEY,
+                timestamp TIMESTAMP,
+                level TEXT,
+                service TEXT,
+                message TEXT,
+                embedding vector({dim})
+            );
+            """))
+
+        # Registry of the embedding space (provider/model/dim) logs.embedding holds
         conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS logs (
-            id SERIAL PRIMARY KEY,
-            timestamp TIMESTAMP,
-            level TEXT,
-            service TEXT,
-            message TEXT,
-            embedding vector(1536)
+        CREATE TABLE IF NOT EXISTS embedding_spaces (
+            name TEXT PRIMARY KEY,
+            provider TEXT,
+            model TEXT,
+            dim INT,
+            active BOOLEAN DEFAULT false,
+            created_at TIMESTAMP DEFAULT now()
         );
         """))
+        if not conn.execute(text("SELECT 1 FROM embedding_spaces WHERE active")).scalar():
+            provider, model = embeddings.configured_provider()
+            stored_dim = embedding_column_dim(conn)
+            # Pre-registry tables always held 1536-dim vectors (local ones zero-padded)
+            conn.execute(
+                text("""
+                INSERT INTO embedding_spaces (name, provider, model, dim, active)
+                VALUES (:name, :provider, :model, :dim, true)
+                ON CONFLICT (name) DO UPDATE SET dim = EXCLUDED.dim, active = true
+                """),
+                {"name": f"{provider}:{model}", "provider": provider, "model": model, "dim": stored_dim},
+            )
+
+        stored_dim = embedding_column_dim(conn)
+        if stored_dim and stored_dim != dim:
+            logger.warning(
+                "logs.embedding is vector(%s) but the active model produces %s dims; vectors "
+                "are padded/truncated until POST /admin/embeddings/migrate is run.",
+                stored_dim, dim,
+            )
+        embeddings.set_schema_dim(stored_dim or dim)
 
         conn.execute(text("""
         CREATE TABLE IF NOT EXISTS deployments (
@@ -47,5 +262,375 @@ def init_db():
             deployed_at TIMESTAMP
         );
         """))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS deployments_service_deployed_idx ON deployments (service, deployed_at);"
+        ))
+        _create_unique_index(
+            conn, "deployments_dedup_idx", "deployments (service, version, deployed_at)",
+        )
+
+        # Per-minute and per-hour counts maintained at ingest (see rollups.py)
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS log_counts_minute (
+            service TEXT,
+            level TEXT,
+            minute TIMESTAMP,
+            count BIGINT NOT NULL,
+            PRIMARY KEY (service, level, minute)
+        );
+        """))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS log_counts_minute_service_minute_idx ON log_counts_minute (service, minute);"
+        ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS log_counts_minute_minute_idx ON log_counts_minute (minute);"))
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS log_counts_hour (
+            service TEXT,
+            level TEXT,
+            hour TIMESTAMP,
+            count BIGINT NOT NULL,
+            PRIMARY KEY (service, level, hour)
+        );
+        """))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS log_counts_hour_service_hour_idx ON log_counts_hour (service, hour);"
+        ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS log_counts_hour_hour_idx ON log_counts_hour (hour);"))
+
+        # Content-addressed embedding cache (see embedding_cache.py); the
+        # column is dimension-less so every provider/model can share it.
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            key TEXT PRIMARY KEY,
+            provider TEXT,
+            model TEXT,
+            embedding vector,
+            created_at TIMESTAMP DEFAULT now()
+        );
+        """))
+
+        # Versioned cluster model (see cluster_model.py) and per-log assignments
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS cluster_models (
+            version SERIAL PRIMARY KEY,
+            algorithm TEXT,
+            n_clusters INT,
+            pca_components INT,
+            n_samples BIGINT,
+            mean_distance DOUBLE PRECISION,
+            fit_seconds DOUBLE PRECISION,
+            active BOOLEAN DEFAULT false,
+            created_at TIMESTAMP DEFAULT now()
+        );
+        """))
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS cluster_centroids (
+            version INT REFERENCES cluster_models(version) ON DELETE CASCADE,
+            cluster_id INT,
+            centroid vector,
+            size BIGINT,
+            PRIMARY KEY (version, cluster_id)
+        );
+        """))
+        # Durable queue of ingest and re-embed jobs (see worker.py)
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS ingest_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            payload JSONB NOT NULL,
+            checkpoint JSONB,
+            rows BIGINT NOT NULL DEFAULT 0,
+            attempts INT NOT NULL DEFAULT 0,
+            max_attempts INT NOT NULL DEFAULT 3,
+            worker TEXT,
+            error TEXT,
+            run_after TIMESTAMP NOT NULL DEFAULT now(),
+            created_at TIMESTAMP NOT NULL DEFAULT now(),
+            started_at TIMESTAMP,
+            heartbeat_at TIMESTAMP,
+            finished_at TIMESTAMP
+        );
+        """))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ingest_jobs_claim_idx ON ingest_jobs (status, run_after, id);"
+        ))
+        # Uploaded bodies in line-aligned parts; kept in Postgres so any worker can read them
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS ingest_upload_parts (
+            upload_id BIGINT NOT NULL REFERENCES ingest_jobs (id) ON DELETE CASCADE,
+            part INT NOT NULL,
+            data BYTEA NOT NULL,
+            PRIMARY KEY (upload_id, part)
+        );
+        """))
+        # Byte ranges of files already ingested, keyed by a content fingerprint
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS ingest_manifest (
+            fingerprint TEXT,
+            start_offset BIGINT,
+            end_offset BIGINT,
+            source TEXT,
+            size BIGINT,
+            rows BIGINT,
+            inserted BIGINT,
+            ingested_at TIMESTAMP DEFAULT now(),
+            PRIMARY KEY (fingerprint, start_offset, end_offset)
+        );
+        """))
+        conn.execute(text("ALTER TABLE logs ADD COLUMN IF NOT EXISTS cluster_id INT;"))
+        conn.execute(text("ALTER TABLE logs ADD COLUMN IF NOT EXISTS cluster_version INT;"))
+        # Drain templates (see templates.py); logs reference them with their params
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS log_templates (
+            id SERIAL PRIMARY KEY,
+            template TEXT NOT NULL,
+            token_count INT,
+            count BIGINT NOT NULL DEFAULT 0,
+            embedding vector,
+            first_seen TIMESTAMP,
+            last_seen TIMESTAMP
+        );
+        """))
+        conn.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS log_templates_template_idx ON log_templates (md5(template));"
+        ))
+        # Bumped on every insert or text change, so miners in other processes know to reload
+        conn.execute(text("CREATE SEQUENCE IF NOT EXISTS log_templates_revision_seq;"))
+        conn.execute(text(
+            "ALTER TABLE log_templates ADD COLUMN IF NOT EXISTS revision BIGINT NOT NULL "
+            "DEFAULT nextval('log_templates_revision_seq');"
+        ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS log_templates_revision_idx ON log_templates (revision);"))
+        conn.execute(text("ALTER TABLE logs ADD COLUMN IF NOT EXISTS template_id INT;"))
+        conn.execute(text("ALTER TABLE logs ADD COLUMN IF NOT EXISTS params TEXT[];"))
+        # Dedup key (timestamp, service, level, message_hash); see create_logs_indexes
+        conn.execute(text(
+            "ALTER TABLE logs ADD COLUMN IF NOT EXISTS message_hash TEXT GENERATED ALWAYS AS (md5(message)) STORED;"
+        ))
+        create_logs_indexes(conn)
+
+        conn.commit()
+
+    if VECTOR_INDEX_METHOD:
+        build_vector_index(VECTOR_INDEX_METHOD)
+
+
+def create_logs_indexes(conn):
+    """B-tree indexes on logs (the ANN index is managed by build_vector_index)."""
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS logs_cluster_idx ON logs (cluster_version, cluster_id, id);"
+    ))
+    # Structured filters of find_similar_logs: service and/or level plus a time range
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS logs_service_level_ts_idx ON logs (service, level, timestamp);"
+    ))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS logs_level_ts_idx ON logs (level, timestamp);"))
+    # Deployment correlation reads a service's logs inside a time window
+    conn.execute(text("CREATE INDEX IF NOT EXISTS logs_service_ts_idx ON logs (service, timestamp);"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS logs_timestamp_idx ON logs (timestamp);"))
+    # Latest log of a template, per-template counts within a service or level
+    conn.execute(text("CREATE INDEX IF NOT EXISTS logs_template_ts_idx ON logs (template_id, timestamp);"))
+    # Makes re-ingesting a file a no-op (INSERT ... ON CONFLICT DO NOTHING). It
+    # includes timestamp, so it is also valid on a partitioned logs table.
+    _create_unique_index(conn, "logs_dedup_idx", "logs (timestamp, service, level, message_hash)")
+
+
+def _create_unique_index(conn, name: str, target: str) -> bool:
+    """Create a unique index unless existing duplicates prevent it (logged, not raised)."""
+    try:
+        with conn.begin_nested():
+            conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {target};"))
+        return True
+    except IntegrityError:
+        logger.warning(
+            "%s has duplicate rows, so %s was not created; run POST /admin/dedupe to remove them.",
+            target.split(" ")[0], name,
+        )
+        return False
+
+
+def vector_index_method(conn) -> str | None:
+    """Access method (hnsw/ivfflat) of the ANN index on logs.embedding, if any."""
+    found = vector_index_info(conn)
+    return found[0] if found else None
 
-        conn.commit()
\ No newline at end of file
+
+def vector_index_info(conn) -> tuple | None:
+    """(method, quantization, dim) of the valid ANN index on logs.embedding, if any."""
+    row = conn.execute(text("""
+        SELECT am.amname AS method, pg_get_indexdef(i.indexrelid) AS definition FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_am am ON am.oid = c.relam
+        WHERE i.indrelid = 'logs'::regclass AND i.indisvalid AND am.amname IN ('hnsw', 'ivfflat')
+        LIMIT 1
+    """)).first()
+    if row is None:
+        return None
+    return row.method, index_quantization(row.definition), embedding_column_dim(conn)
+
+
+def index_quantization(definition: str) -> str:
+    """Quantization of an ANN index, from its definition."""
+    if "binary_quantize" in definition:
+        return "binary"
+    if "halfvec" in definition:
+        return "halfvec"
+    return "none"
+
+
+def quantized_expression(column: str, quantization: str, dim: int) -> str:
+    """SQL for the compressed form of a vector expression, matching the index expression."""
+    if quantization == "halfvec":
+        return f"({column})::halfvec({dim})"
+    if quantization == "binary":
+        return f"binary_quantize({column})::bit({dim})"
+    return column
+
+
+def _index_using(method: str, quantization: str, dim: int | None, options: str) -> str:
+    if quantization == "none":
+        return f"USING {method} (embedding vector_cosine_ops) WITH ({options})"
+    if not dim:
+        raise ValueError("logs.embedding has no declared dimension, which quantized indexes need")
+    ops = "halfvec_cosine_ops" if quantization == "halfvec" else "bit_hamming_ops"
+    return f"USING {method} (({quantized_expression('embedding', quantization, dim)}) {ops}) WITH ({options})"
+
+
+def pgvector_version(conn) -> tuple:
+    version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar() or "0"
+    return tuple(int(part) for part in version.split(".") if part.isdigit())
+
+
+def _default_ivfflat_lists(conn) -> int:
+    # Per partition when logs is partitioned, since each partition gets its own index
+    rows = conn.execute(text("""
+        SELECT sum(greatest(c.reltuples, 0))::bigint / count(*)
+        FROM pg_partition_tree('logs') t JOIN pg_class c ON c.oid = t.relid
+        WHERE t.isleaf
+    """)).scalar() or 0
+    if rows > 1_000_000:
+        return int(rows ** 0.5)
+    return max(10, int(rows / 1000))
+
+
+def check_vector_index(method: str, quantization: str | None = None) -> str:
+    """Raise ValueError unless the index can be built on logs.embedding. Returns the quantization."""
+    if method not in VECTOR_INDEXES:
+        raise ValueError(f"Unknown vector index method {method!r}; expected one of {sorted(VECTOR_INDEXES)}")
+    quantization = (quantization or VECTOR_INDEX_QUANTIZATION or "none").lower()
+    if quantization not in INDEX_QUANTIZATIONS:
+        raise ValueError(f"Unknown index quantization {quantization!r}; expected one of {list(INDEX_QUANTIZATIONS)}")
+    with engine.connect() as conn:
+        dim = embedding_column_dim(conn)
+    if dim and dim > INDEX_MAX_DIMS[quantization]:
+        raise ValueError(
+            f"logs.embedding has {dim} dimensions; {method} with quantization {quantization} supports at most "
+            f"{INDEX_MAX_DIMS[quantization]}. Use a narrower EMBEDDING_DIM or another quantization"
+        )
+    return quantization
+
+
+def build_vector_index(
+    method: str = "hnsw",
+    m: int | None = None,
+    ef_construction: int | None = None,
+    lists: int | None = None,
+    rebuild: bool = False,
+    quantization: str | None = None,
+) -> dict:
+    """Build (or rebuild) the cosine ANN index on logs.embedding, CONCURRENTLY and swapped in.
+    Only one managed ANN index is kept; partitions each get their own, attached to the parent."""
+    quantization = check_vector_index(method, quantization)
+    name = VECTOR_INDEXES[method]
+    building = f"{name}_new"
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        existing = conn.execute(
+            text("SELECT indexdef FROM pg_indexes WHERE tablename = 'logs' AND indexname = :name"),
+            {"name": name},
+        ).scalar()
+        if existing is not None and not rebuild and index_quantization(existing) == quantization:
+            return {"status": "exists", "index": name, "quantization": quantization}
+        if quantization != "none" and pgvector_version(conn) < (0, 7):
+            raise ValueError(
+                f"{quantization} indexes need pgvector 0.7 or later; run ALTER EXTENSION vector UPDATE "
+                "after upgrading the extension"
+            )
+
+        if method == "hnsw":
+            options = f"m = {int(m or HNSW_M)}, ef_construction = {int(ef_construction or HNSW_EF_CONSTRUCTION)}"
+        else:
+            lists = lists or (int(IVFFLAT_LISTS) if IVFFLAT_LISTS else _default_ivfflat_lists(conn))
+            options = f"lists = {int(lists)}"
+
+        partitioned = logs_is_partitioned(conn)
+        using = _index_using(method, quantization, embedding_column_dim(conn), options)
+        if INDEX_MAINTENANCE_WORK_MEM:
+            conn.execute(text("SELECT set_config('maintenance_work_mem', :v, false)"), {"v": INDEX_MAINTENANCE_WORK_MEM})
+        try:
+            if partitioned:
+                children = _build_partitioned_index(conn, building, method, using)
+            else:
+                # A failed concurrent build leaves an INVALID index behind; clear it first
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {building}"))
+                conn.execute(text(f"CREATE INDEX CONCURRENTLY {building} ON logs {using}"))
+        finally:
+            if INDEX_MAINTENANCE_WORK_MEM:
+                conn.execute(text("RESET maintenance_work_mem"))
+        # Partitioned indexes cannot be dropped concurrently; the drop itself is quick
+        drop = "DROP INDEX IF EXISTS" if partitioned else "DROP INDEX CONCURRENTLY IF EXISTS"
+        conn.execute(text(f"{drop} {name}"))
+        conn.execute(text(f"ALTER INDEX {building} RENAME TO {name}"))
+        if partitioned:
+            for child in children:
+                conn.execute(text(f"ALTER INDEX {child} RENAME TO {child[:-len('_new')]}_idx"))
+        for other_method, other in VECTOR_INDEXES.items():
+            if other_method != method:
+                conn.execute(text(f"{drop} {other}"))
+
+    return {"status": "built", "index": name, "options": options, "quantization": quantization}
+
+
+def _build_partitioned_index(conn, building: str, method: str, using: str) -> list:
+    """Build the ANN index partition by partition under an initially invalid parent.
+
+    Returns the names of the per-partition indexes, which still carry a _new suffix.
+    """
+    conn.execute(text(f"DROP INDEX IF EXISTS {building}"))
+    conn.execute(text(f"CREATE INDEX {building} ON ONLY logs {using}"))
+    children = []
+    for partition in logs_partitions(conn):
+        child = f"{partition.name}_{method}_new"
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {child}"))
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY {child} ON {partition.name} {using}"))
+        conn.execute(text(f"ALTER INDEX {building} ATTACH PARTITION {child}"))
+        children.append(child)
+    return children
+
+
+def vector_index_status() -> dict:
+    """Managed ANN indexes on logs plus progress of any index build in flight."""
+    with engine.connect() as conn:
+        indexes = conn.execute(text("""
+            SELECT i.indexrelid::regclass::text AS name,
+                   am.amname AS method,
+                   i.indisvalid AS valid,
+                   (SELECT pg_size_pretty(sum(pg_relation_size(t.relid)))
+                    FROM pg_partition_tree(i.indexrelid) t) AS size,
+                   pg_get_indexdef(i.indexrelid) AS definition
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_am am ON am.oid = c.relam
+            WHERE i.indrelid = 'logs'::regclass AND am.amname IN ('hnsw', 'ivfflat')
+        """)).fetchall()
+        progress = conn.execute(text("""
+            SELECT index_relid::regclass::text AS name, phase,
+                   blocks_done, blocks_total, tuples_done, tuples_total
+            FROM pg_stat_progress_create_index
+            WHERE relid IN (SELECT relid FROM pg_partition_tree('logs'))
+        """)).fetchall()
+    return {
+        "indexes": [dict(r._mapping) for r in indexes],
+        "in_progress": [dict(r._mapping) for r in progress],
+    }
@@ -0,0 +1,129 @@
+"""Embedding cache keyed by sha256(provider, model, normalized message): an in-process LRU,
+then the `embedding_cache` table; only messages missing from both reach a provider."""
+import hashlib
+import os
+import threading
+import numpy as np
+from sqlalchemy import text
+from pgvector import Vector
+from psycopg2.extras import execute_values
+from cache import LRUCache
+from db import get_db, vector_to_numpy
+from embeddings import active_provider, embed_batch_raw, fit_to_schema
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "50000"))
+# Set EMBEDDING_CACHE_DB=0 to keep the cache in-process only
+EMBEDDING_CACHE_DB = os.getenv("EMBEDDING_CACHE_DB", "1") != "0"
+
+_memory = LRUCache(EMBEDDING_CACHE_SIZE)
+_counters = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+_counters_lock = threading.Lock()
+
+
+def normalize(message: str) -> str:
+    """Collapse whitespace so trivially different copies of a message share a key."""
+    return " ".join(message.split())
+
+
+def cache_key(provider: str, model: str, message: str) -> str:
+    return hashlib.sha256(f"{provider}\x00{model}\x00{normalize(message)}".encode()).hexdigest()
+
+
+def _count(**deltas):
+    with _counters_lock:
+        for name, n in deltas.items():
+            _counters[name] += n
+
+
+def _load_from_db(keys: list) -> dict:
+    db = get_db()
+    try:
+        rows = db.execute(
+            text("SELECT key, embedding FROM embedding_cache WHERE key = ANY(:keys)"),
+            {"keys": keys},
+        ).fetchall()
+    finally:
+        db.close()
+    return {r.key: vector_to_numpy(r.embedding) for r in rows}
+
+
+def _store_in_db(entries: list):
+    db = get_db()
+    try:
+        cursor = db.connection().connection.cursor()
+        execute_values(
+            cursor,
+            "INSERT INTO embedding_cache (key, provider, model, embedding) VALUES %s "
+            "ON CONFLICT (key) DO NOTHING",
+            [(k, provider, model, Vector(vec)) for k, provider, model, vec in entries],
+            page_size=len(entries),
+        )
+        cursor.close()
+        db.commit()
+    finally:
+        db.close()
+
+
+def embed_batch_cached(texts: list[str], dim: int | None = None) -> list:
+    """Drop-in replacement for embeddings.embed_batch that consults the cache tiers.
+
+    Vectors are fitted to the logs.embedding dimension, or to dim when given.
+    """
+    provider, model = active_provider()
+    keys = [cache_key(provider, model, t) for t in texts]
+    found = {}
+    pending = {}
+    for k, t in zip(keys, texts):
+        if k in found or k in pending:
+            continue
+        vec = _memory.get(k)
+        if vec is not None:
+            found[k] = vec
+        else:
+            pending[k] = t
+    _count(memory_hits=len(found))
+
+    if pending and EMBEDDING_CACHE_DB:
+        from_db = _load_from_db(list(pending))
+        for k, vec in from_db.items():
+            _memory.set(k, vec)
+            found[k] = vec
+            del pending[k]
+        _count(db_hits=len(from_db))
+
+    if pending:
+        _count(misses=len(pending))
+        computed = embed_batch_raw(list(pending.values()))
+        to_store = []
+        for (k, t), (vec, actual_provider, actual_model) in zip(pending.items(), computed):
+            arr = np.asarray(vec, dtype=np.float32)
+            found[k] = arr
+            # A fallback provider's vector is cached under its own key, so the
+            # preferred provider is retried for this message once it recovers.
+            store_key = k
+            if (actual_provider, actual_model) != (provider, model):
+                store_key = cache_key(actual_provider, actual_model, t)
+            _memory.set(store_key, arr)
+            to_store.append((store_key, actual_provider, actual_model, arr))
+        if EMBEDDING_CACHE_DB:
+            _store_in_db(to_store)
+
+    return [fit_to_schema(found[k].tolist(), dim) for k in keys]
+
+
+def embed_cached(message: str) -> list:
+    return embed_batch_cached([message])[0]
+
+
+def stats() -> dict:
+    with _counters_lock:
+        counters = dict(_counters)
+    lookups = sum(counters.values())
+    hits = counters["memory_hits"] + counters["db_hits"]
+    return {
+        **counters,
+        "hit_rate": round(hits / lookups, 4) if lookups else None,
+        "memory_size": len(_memory),
+        "memory_maxsize": _memory.maxsize,
+        "db_tier": EMBEDDING_CACHE_DB,
+    }
@@ -0,0 +1,187 @@
+"""Embedding space registry and migration of logs.embedding between models.
+`embedding_spaces` records which provider/model the column holds at its native dimension."""
+import os
+from sqlalchemy import text
+from pgvector import Vector
+from psycopg2.extras import execute_values
+import embeddings
+from db import engine, get_db, embedding_column_dim, build_vector_index, vector_index_info
+from db import VECTOR_INDEX_METHOD
+from embedding_cache import embed_batch_cached
+import result_cache
+import templates
+
+REEMBED_BATCH_SIZE = 500
+# A migration re-runs the backfill for rows ingested meanwhile (up to
+# MIGRATE_CATCHUP_PASSES times) until at most MIGRATE_LOCKED_ROWS are left
+# to embed while logs is locked for the column swap
+MIGRATE_CATCHUP_PASSES = int(os.getenv("MIGRATE_CATCHUP_PASSES", "5"))
+MIGRATE_LOCKED_ROWS = int(os.getenv("MIGRATE_LOCKED_ROWS", "1000"))
+# Truncation needs no provider calls, so it copies this many times more rows per batch
+TRUNCATE_BATCH_FACTOR = 20
+_NEXT_COLUMN = "embedding_next"
+# Logs with a template are embedded as their template, like at ingest
+_EMBED_TEXT = "coalesce(t.template, l.message)" if templates.LOG_TEMPLATES else "l.message"
+_TEMPLATE_JOIN = "LEFT JOIN log_templates t ON t.id = l.template_id" if templates.LOG_TEMPLATES else ""
+
+
+def current_space() -> dict:
+    """Registered space of logs.embedding next to the space the config asks for."""
+    provider, model = embeddings.configured_provider()
+    with engine.connect() as conn:
+        row = conn.execute(text("SELECT name, provider, model, dim FROM embedding_spaces WHERE active")).first()
+        stored_dim = embedding_column_dim(conn)
+    target_dim = embeddings.model_dim(provider, model)
+    return {
+        "stored": dict(row._mapping) if row else None,
+        "stored_dim": stored_dim,
+        "target": {"name": f"{provider}:{model}", "provider": provider, "model": model, "dim": target_dim},
+        "needs_migration": row is None or (row.provider, row.model) != (provider, model) or stored_dim != target_dim,
+    }
+
+
+def _write_vectors(cursor, column: str, dim: int, rows: list, vectors: list):
+    """Set column for rows (with an .id) in one UPDATE ... FROM (VALUES ...)."""
+    execute_values(
+        cursor,
+        f"UPDATE logs SET {column} = v.embedding FROM (VALUES %s) AS v(id, embedding) WHERE logs.id = v.id",
+        [(r.id, Vector(vec)) for r, vec in zip(rows, vectors)],
+        template=f"(%s, %s::vector({dim}))",
+        page_size=len(rows),
+    )
+    cursor.close()
+
+
+def backfill_embeddings(
+    column: str,
+    dim: int,
+    start_id: int = 0,
+    end_id: int | None = None,
+    only_missing: bool = False,
+    batch_size: int = REEMBED_BATCH_SIZE,
+    on_batch=None,
+) -> int:
+    """Re-embed logs with start_id < id <= end_id into column in committed batches. Returns the last id.
+    on_batch(last_id, rows) runs after each commit so callers can checkpoint."""
+    last_id = start_id
+    db = get_db()
+    try:
+        while True:
+            where = ["l.id > :last_id"]
+            if end_id is not None:
+                where.append("l.id <= :end_id")
+            if only_missing:
+                where.append(f"l.{column} IS NULL")
+            rows = db.execute(
+                text(f"""
+                SELECT l.id, {_EMBED_TEXT} AS message FROM logs l {_TEMPLATE_JOIN}
+                WHERE {' AND '.join(where)} ORDER BY l.id LIMIT :limit
+                """),
+                {"last_id": last_id, "end_id": end_id, "limit": batch_size},
+            ).fetchall()
+            if not rows:
+                return last_id
+            vectors = embed_batch_cached([r.message for r in rows], dim=dim)
+            _write_vectors(db.connection().connection.cursor(), column, dim, rows, vectors)
+            db.commit()
+            last_id = rows[-1].id
+            if on_batch:
+                on_batch(last_id, len(rows))
+    finally:
+        db.close()
+
+
+def _truncate_embeddings(dim: int, batch_size: int, conn=None):
+    """Copy the first dim values of embedding into the side column, batch by batch (or all at once on conn)."""
+    update = f"""
+        UPDATE logs SET {_NEXT_COLUMN} = ((logs.embedding::real[])[1:{dim}])::vector({dim})
+        FROM (
+            SELECT id FROM logs WHERE id > :last_id AND {_NEXT_COLUMN} IS NULL AND embedding IS NOT NULL
+            ORDER BY id {"" if conn is not None else "LIMIT :limit"}
+        ) b
+        WHERE logs.id = b.id
+        RETURNING logs.id
+    """
+    if conn is not None:
+        conn.execute(text(update), {"last_id": 0})
+        return
+    last_id = 0
+    while True:
+        with engine.begin() as c:
+            ids = c.execute(text(update), {"last_id": last_id, "limit": batch_size}).scalars().all()
+        if not ids:
+            return
+        last_id = max(ids)
+
+
+def migrate_embedding_space(batch_size: int = REEMBED_BATCH_SIZE) -> dict:
+    """Move logs.embedding to the active model's space at its native dimension.
+    Rows are backfilled into a side column in batches and swapped in under a short exclusive lock."""
+    state = current_space()
+    target = state["target"]
+    dim = target["dim"]
+    if not state["needs_migration"]:
+        return {"status": "up_to_date", "space": target}
+
+    stored = state["stored"]
+    same_model = stored is not None and (stored["provider"], stored["model"]) == (target["provider"], target["model"])
+    with engine.connect() as conn:
+        index = vector_index_info(conn)
+    if same_model and state["stored_dim"] and state["stored_dim"] > dim:
+        # Padding is all zeros, so the prefix is the exact original vector
+        method, missing_sql = "truncate", f"{_NEXT_COLUMN} IS NULL AND embedding IS NOT NULL"
+
+        def fill():
+            _truncate_embeddings(dim, batch_size * TRUNCATE_BATCH_FACTOR)
+    else:
+        method, missing_sql = "reembed", f"{_NEXT_COLUMN} IS NULL"
+
+        def fill():
+            backfill_embeddings(_NEXT_COLUMN, dim, only_missing=True, batch_size=batch_size)
+
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE logs ADD COLUMN IF NOT EXISTS {_NEXT_COLUMN} vector({dim})"))
+    fill()
+    # Catch up with rows ingested during the backfill without holding the lock
+    for _ in range(MIGRATE_CATCHUP_PASSES):
+        with engine.connect() as conn:
+            missing = conn.execute(text(f"SELECT count(*) FROM logs WHERE {missing_sql}")).scalar()
+        if missing <= MIGRATE_LOCKED_ROWS:
+            break
+        fill()
+    with engine.begin() as conn:
+        conn.execute(text("LOCK TABLE logs IN ACCESS EXCLUSIVE MODE"))
+        # Only the rows ingested since the last pass are left
+        if method == "truncate":
+            _truncate_embeddings(dim, batch_size, conn=conn)
+        else:
+            remaining = conn.execute(
+                text(f"SELECT l.id, {_EMBED_TEXT} AS message FROM logs l {_TEMPLATE_JOIN} WHERE l.{_NEXT_COLUMN} IS NULL")
+            ).fetchall()
+            for lo in range(0, len(remaining), batch_size):
+                rows = remaining[lo:lo + batch_size]
+                vectors = embed_batch_cached([r.message for r in rows], dim=dim)
+                _write_vectors(conn.connection.cursor(), _NEXT_COLUMN, dim, rows, vectors)
+        conn.execute(text("ALTER TABLE logs DROP COLUMN embedding"))
+        conn.execute(text(f"ALTER TABLE logs RENAME COLUMN {_NEXT_COLUMN} TO embedding"))
+
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE embedding_spaces SET active = false"))
+        conn.execute(
+            text("""
+            INSERT INTO embedding_spaces (name, provider, model, dim, active)
+            VALUES (:name, :provider, :model, :dim, true)
+            ON CONFLICT (name) DO UPDATE SET dim = EXCLUDED.dim, active = true
+            """),
+            target,
+        )
+    embeddings.set_schema_dim(dim)
+    templates.refresh_embeddings()
+    result_cache.notify_all()
+
+    # The dropped column took its ANN index with it
+    if VECTOR_INDEX_METHOD:
+        build_vector_index(VECTOR_INDEX_METHOD)
+    elif index:
+        build_vector_index(index[0], quantization=index[1])
+    return {"status": "migrated", "method": method, "space": target}
@@ -1,8 +1,30 @@
 import os
+import time
 import requests
+import metrics
+import providers
 
-# Schema expects 1536-dim vectors; local model produces 384, so we pad
-EMBEDDING_DIM = 1536
+# Max inputs sent per provider request (OpenAI accepts up to 2048 per call)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "128"))
+# Start the next provider when the current one has not answered within this
+# many milliseconds (0 = strictly sequential fallback)
+EMBEDDING_HEDGE_MS = float(os.getenv("EMBEDDING_HEDGE_MS", "0"))
+
+TRITON_EMBEDDING_MODEL = "text-embedding-3-large"
+LOCAL_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# Native output dimension per model; unknown models fall back to 1536
+MODEL_DIMS = {
+    "all-MiniLM-L6-v2": 384,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+# Widest vector pgvector's HNSW and IVFFlat indexes accept
+MAX_INDEX_DIM = 2000
+# Models that return shortened vectors on request (the API's `dimensions`);
+# wider ones are stored at MAX_INDEX_DIM so logs.embedding stays indexable
+SHORTENABLE_MODELS = {"text-embedding-3-small", "text-embedding-3-large"}
 
 _local_model = None
 
@@ -11,7 +33,7 @@ def _get_local_model():
     global _local_model
     if _local_model is None:
         from sentence_transformers import SentenceTransformer
-        _local_model = SentenceTransformer("all-MiniLM-L6-v2")
+        _local_model = SentenceTransformer(LOCAL_EMBEDDING_MODEL)
     return _local_model
 
 def _pad_to_dim(vec: list, target_dim: int) -> list:
@@ -20,52 +42,127 @@ def _pad_to_dim(vec: list, target_dim: int) -> list:
         return vec[:target_dim]
     return vec + [0.0] * (target_dim - len(vec))
 
-def _embed_openai(text: str) -> tuple[list | None, str | None]:
-    """Use OpenAI-compatible API for embeddings (OpenAI, Triton, etc.). Returns (embedding, error_msg)."""
+def _openai_model() -> str:
+    return os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+
+def _triton_configured() -> bool:
+    return bool(os.getenv("TRITON_API_KEY") and os.getenv("TRITON_API_URL"))
+
+def _openai_configured() -> bool:
+    return bool(os.getenv("OPENAI_API_KEY") or os.getenv("TRITON_API_KEY"))
+
+def configured_provider() -> tuple[str, str]:
+    """(provider, model) preferred by the configuration, ignoring provider health."""
+    if _triton_configured():
+        return "triton", TRITON_EMBEDDING_MODEL
+    if _openai_configured():
+        return "openai", _openai_model()
+    return "local", LOCAL_EMBEDDING_MODEL
+
+def active_provider() -> tuple[str, str]:
+    """(provider, model) that will be tried first right now, skipping open circuit breakers."""
+    if _triton_configured() and not providers.health("triton").is_open():
+        return "triton", TRITON_EMBEDDING_MODEL
+    if _openai_configured() and not providers.health("openai").is_open():
+        return "openai", _openai_model()
+    return "local", LOCAL_EMBEDDING_MODEL
+
+def model_dim(provider: str | None = None, model: str | None = None) -> int:
+    """Vector dimension the schema should use for a provider/model (default: the active one)."""
+    if os.getenv("EMBEDDING_DIM"):
+        return int(os.getenv("EMBEDDING_DIM"))
+    if provider is None:
+        provider, model = configured_provider()
+    if provider == "triton":
+        # Triton deployments have always been served with the 1536-dim schema
+        return 1536
+    if model in SHORTENABLE_MODELS:
+        return min(MODEL_DIMS[model], MAX_INDEX_DIM)
+    return MODEL_DIMS.get(model, 1536)
+
+# Dimension of logs.embedding. Follows the active model; init_db pins it to the
+# existing column until embedding_spaces.migrate_embedding_space() runs.
+EMBEDDING_DIM = model_dim()
+
+def set_schema_dim(dim: int):
+    global EMBEDDING_DIM
+    EMBEDDING_DIM = dim
+
+def _sorted_embeddings(data: list) -> list:
+    """Order an embeddings response by input index (providers may reorder items)."""
+    return [d["embedding"] for d in sorted(data, key=lambda d: d.get("index", 0))]
+
+def _embed_triton(texts: list[str]) -> tuple[list | None, str | None]:
+    """Embed a batch via the Triton endpoint in one request. Returns (embeddings, error_msg)."""
+    api_url = os.getenv("TRITON_API_URL")
+    api_key = os.getenv("TRITON_API_KEY")
+    if not (api_key and api_url):
+        return None, None
+    payload = {"model": TRITON_EMBEDDING_MODEL, "input": texts}
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    try:
+        with providers.limit("triton"):
+            res = providers.http_session().post(api_url, json=payload, headers=headers, timeout=providers.timeout())
+        if res.status_code == 200:
+            return _sorted_embeddings(res.json()["data"]), None
+        return None, f"Triton API returned {res.status_code}: {res.text[:200]}"
+    except (requests.RequestException, KeyError) as e:
+        return None, str(e)
+
+def _embed_openai(texts: list[str]) -> tuple[list | None, str | None]:
+    """Use OpenAI-compatible API for embeddings (OpenAI, Triton, etc.). Returns (embeddings, error_msg)."""
     api_key = os.getenv("OPENAI_API_KEY") or os.getenv("TRITON_API_KEY")
     base_url = (os.getenv("OPENAI_API_BASE") or os.getenv("TRITON_API_URL") or "https://api.openai.com/v1").rstrip("/")
     if base_url.endswith("/embeddings"):
         base_url = base_url[: -len("/embeddings")]
     if not api_key:
         return None, None
-    model = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+    model = _openai_model()
+    options = {}
+    if model in SHORTENABLE_MODELS and model_dim("openai", model) < MODEL_DIMS[model]:
+        # Only sent when shortening, for OpenAI-compatible servers without the parameter
+        options["dimensions"] = model_dim("openai", model)
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=api_key, base_url=base_url)
-        r = client.embeddings.create(model=model, input=text)
-        return r.data[0].embedding, None
+        client = providers.openai_client(api_key, base_url)
+        with providers.limit("openai"):
+            r = client.embeddings.create(model=model, input=texts, **options)
+        return [d.embedding for d in sorted(r.data, key=lambda d: d.index)], None
     except Exception as e:
         return None, str(e)
 
-def embed(text: str):
-    api_url = os.getenv("TRITON_API_URL")
-    api_key = os.getenv("TRITON_API_KEY")
-    last_error: str | None = None
-
-    # 1. Try Triton API when configured (no sk- requirement; Triton keys may vary)
-    if api_key and api_url:
-        payload = {"model": "text-embedding-3-large", "input": text}
-        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-        try:
-            res = requests.post(api_url, json=payload, headers=headers, timeout=30)
-            if res.status_code == 200:
-                return res.json()["data"][0]["embedding"]
-            last_error = f"Triton API returned {res.status_code}: {res.text[:200]}"
-        except (requests.RequestException, KeyError) as e:
-            last_error = str(e)
-
-    # 2. Try OpenAI-compatible client (works with Triton base URL)
-    vec, err = _embed_openai(text)
-    if vec is not None:
-        return vec
-    if err:
-        last_error = err
+def _embed_local(texts: list[str]) -> list:
+    """Encode with sentence-transformers; raises ImportError when not installed."""
+    model = _get_local_model()
+    with providers.limit("local"):
+        vecs = model.encode(texts, batch_size=EMBEDDING_BATCH_SIZE, convert_to_numpy=True)
+    return [v.tolist() for v in vecs]
+
+def fit_to_schema(vec: list, dim: int | None = None) -> list:
+    """Fit a vector to logs.embedding (or to dim); a no-op unless a fallback provider
+    answered from a different embedding space or the schema has not been migrated yet."""
+    dim = dim or EMBEDDING_DIM
+    if len(vec) != dim:
+        return _pad_to_dim(vec, dim)
+    return vec
+
+def _embed_chunk(texts: list[str]) -> tuple[list, str, str]:
+    """Embed one provider-sized chunk through the circuit breakers. Returns (raw embeddings, provider, model)."""
+    attempts = []
+    # 1. Triton API when configured (no sk- requirement; Triton keys may vary)
+    if _triton_configured():
+        attempts.append(("triton", lambda: _embed_triton(texts)))
+    # 2. OpenAI-compatible client (works with Triton base URL)
+    if _openai_configured():
+        attempts.append(("openai", lambda: _embed_openai(texts)))
+    vecs, provider, last_error = providers.first_success(attempts, EMBEDDING_HEDGE_MS / 1000)
+    if provider == "triton":
+        return vecs, "triton", TRITON_EMBEDDING_MODEL
+    if provider == "openai":
+        return vecs, "openai", _openai_model()
 
     # 3. Fallback to sentence-transformers (only if installed; not in Railway slim build)
     try:
-        model = _get_local_model()
-        vec = model.encode(text, convert_to_numpy=True).tolist()
-        return _pad_to_dim(vec, EMBEDDING_DIM)
+        return _embed_local(texts), "local", LOCAL_EMBEDDING_MODEL
     except ImportError:
         cfg = (
             f"TRITON_API_KEY={'set' if os.getenv('TRITON_API_KEY') else 'unset'}, "
@@ -79,4 +176,24 @@ def embed(text: str):
         if last_error:
             msg += f" Last API error: {last_error}. "
         msg += f" Env check: {cfg}."
-        raise RuntimeError(msg)
\ No newline at end of file
+        raise RuntimeError(msg)
+
+def embed_batch_raw(texts: list[str]) -> list[tuple[list, str, str]]:
+    """Embed many texts, up to EMBEDDING_BATCH_SIZE per provider call.
+    Returns one (raw embedding, provider, model) per input, since a fallback may answer part of a batch."""
+    out = []
+    for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        started = time.perf_counter()
+        vecs, provider, model = _embed_chunk(list(texts[i:i + EMBEDDING_BATCH_SIZE]))
+        elapsed = time.perf_counter() - started
+        metrics.EMBED_SECONDS.observe(elapsed, provider=provider)
+        metrics.EMBED_TEXTS.inc(len(vecs), provider=provider)
+        metrics.record("embed", elapsed)
+        out.extend((v, provider, model) for v in vecs)
+    return out
+
+def embed_batch(texts: list[str]) -> list:
+    return [fit_to_schema(v) for v, _, _ in embed_batch_raw(texts)]
+
+def embed(text: str):
+    return embed_batch([text])[0]
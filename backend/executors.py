@@ -0,0 +1,33 @@
+"""Thread pools that keep blocking work off the event loop.
+I/O (Postgres, HTTP providers) and CPU-heavy work (KMeans, PCA) use separate pools."""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from starlette.concurrency import run_in_threadpool
+
+IO_THREADS = int(os.getenv("IO_THREADS", "40"))
+CPU_WORKERS = int(os.getenv("CPU_WORKERS") or os.cpu_count() or 2)
+
+_cpu_pool = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
+
+
+def configure_io_threads():
+    """Size the shared AnyIO thread limiter; must be called from the event loop."""
+    import anyio.to_thread
+
+    anyio.to_thread.current_default_thread_limiter().total_tokens = IO_THREADS
+
+
+async def run_io(fn, *args, **kwargs):
+    """Run a blocking I/O call (DB query, provider request) on the I/O thread pool."""
+    return await run_in_threadpool(fn, *args, **kwargs)
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """Run CPU-bound work on the dedicated compute pool."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_cpu_pool, partial(ctx.run, fn, *args, **kwargs))
@@ -1,13 +1,38 @@
+import hashlib
+import io
 import json
 import os
+import queue
+import threading
+import time
+import zlib
 from datetime import datetime
 from sqlalchemy import text
 from pgvector import Vector
-from db import get_db
-from embeddings import embed
+from psycopg2.extras import execute_values
+from db import engine, get_db, create_logs_indexes
+from embedding_cache import embed_batch_cached
+from cluster_model import assign
+from partitions import ensure_partitions
+import metrics
+import rollups
+import result_cache
+import templates
+import vector_store
 
 _BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Rows parsed, embedded and committed per batch. Memory is bounded by roughly
+# (2 * INGEST_QUEUE_DEPTH + 3) batches in flight across the three stages.
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "500"))
+INGEST_QUEUE_DEPTH = int(os.getenv("INGEST_QUEUE_DEPTH", "2"))
+# Uploaded bodies (PUT /ingest/jobs/{id}) are stored in Postgres in parts of about this size
+UPLOAD_PART_BYTES = int(os.getenv("UPLOAD_PART_BYTES", str(8 * 1024 * 1024)))
+# Bytes read from each end of a file for its manifest fingerprint
+MANIFEST_SAMPLE_BYTES = int(os.getenv("MANIFEST_SAMPLE_BYTES", "65536"))
+
+_END = object()
+
 
 def _resolve_path(path: str) -> str:
     """Resolve path relative to backend directory for cross-environment compatibility."""
@@ -16,46 +41,424 @@ def _resolve_path(path: str) -> str:
     return os.path.join(_BASE_DIR, path)
 
 
-def ingest_deployments(file_path: str):
+def ingest_deployments(file_path: str) -> dict:
+    """Load a JSON list of deployments; ones already stored are skipped."""
     db = get_db()
     path = _resolve_path(file_path)
     with open(path, "r") as f:
         deployments = json.load(f)
+    inserted = 0
+    services = set()
     for d in deployments:
-        db.execute(
+        n = db.execute(
             text("""
             INSERT INTO deployments (service, version, deployed_at)
             VALUES (:service, :version, :deployed_at)
+            ON CONFLICT DO NOTHING
             """),
             {
                 "service": d["service"],
                 "version": d["version"],
                 "deployed_at": datetime.fromisoformat(d["deployed_at"]),
             },
-        )
+        ).rowcount
+        if n:
+            services.add(d["service"])
+        inserted += n
+    result_cache.notify_deployments(db, services)
     db.commit()
     db.close()
+    return {"rows": len(deployments), "inserted": inserted}
 
 
-def ingest_logs(file_path: str):
-    db = get_db()
-    path = _resolve_path(file_path)
+def remove_duplicates() -> dict:
+    """Delete duplicate logs and deployments (keeping the oldest id), add the unique indexes
+    that keep them out, and rebuild the rollups and template counts."""
+    with engine.begin() as conn:
+        logs = conn.execute(text("""
+            DELETE FROM logs a USING logs b
+            WHERE a.timestamp = b.timestamp AND a.service = b.service AND a.level = b.level
+              AND a.message_hash = b.message_hash AND a.id > b.id
+        """)).rowcount
+        deployments = conn.execute(text("""
+            DELETE FROM deployments a USING deployments b
+            WHERE a.service = b.service AND a.version = b.version
+              AND a.deployed_at = b.deployed_at AND a.id > b.id
+        """)).rowcount
+        create_logs_indexes(conn)
+        conn.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS deployments_dedup_idx ON deployments (service, version, deployed_at);"
+        ))
+    if logs:
+        rollups.rebuild()
+        templates.rebuild_counts()
+    if logs or deployments:
+        result_cache.notify_all()
+    return {"logs_deleted": logs, "deployments_deleted": deployments}
+
+
+def file_fingerprint(path: str) -> str:
+    """Constant-cost content fingerprint: the size plus the first and last MANIFEST_SAMPLE_BYTES."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        digest.update(str(size).encode())
+        f.seek(0)
+        digest.update(f.read(MANIFEST_SAMPLE_BYTES))
+        f.seek(max(size - MANIFEST_SAMPLE_BYTES, 0))
+        digest.update(f.read(MANIFEST_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+def ingested_ranges(fingerprint: str) -> set:
+    """(start, end) byte ranges of the fingerprinted file recorded in the manifest."""
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("SELECT start_offset, end_offset FROM ingest_manifest WHERE fingerprint = :fingerprint"),
+            {"fingerprint": fingerprint},
+        ).fetchall()
+    return {(r.start_offset, r.end_offset) for r in rows}
+
+
+def record_manifest(conn, fingerprint: str, source: str, start: int, end: int, size: int, result: dict):
+    conn.execute(
+        text("""
+        INSERT INTO ingest_manifest (fingerprint, start_offset, end_offset, source, size, rows, inserted)
+        VALUES (:fingerprint, :start, :end, :source, :size, :rows, :inserted)
+        ON CONFLICT (fingerprint, start_offset, end_offset) DO NOTHING
+        """),
+        {"fingerprint": fingerprint, "start": start, "end": end, "source": source, "size": size,
+         "rows": result["rows"], "inserted": result["inserted"]},
+    )
+
+
+def _iter_file_lines(path: str):
     with open(path, "r") as f:
-        for line in f:
-            log = json.loads(line)
-
-            embedding = embed(log["message"])
-
-            db.execute(text("""
-                INSERT INTO logs (timestamp, level, service, message, embedding)
-                VALUES (:timestamp, :level, :service, :message, :embedding)
-            """), {
-                "timestamp": datetime.fromisoformat(log["timestamp"]),
-                "level": log["level"],
-                "service": log["service"],
-                "message": log["message"],
-                "embedding": Vector(embedding)
-            })
+        yield from f
 
-    db.commit()
-    db.close()
\ No newline at end of file
+
+def _parse_line(line) -> dict | None:
+    line = line.strip()
+    if not line:
+        return None
+    log = json.loads(line)
+    return {
+        "timestamp": datetime.fromisoformat(log["timestamp"]),
+        "level": log["level"],
+        "service": log["service"],
+        "message": log["message"],
+    }
+
+
+def _iter_chunks(lines, chunk_size: int):
+    """Parse JSONL lines into lists of at most chunk_size log dicts."""
+    chunk = []
+    for line in lines:
+        row = _parse_line(line)
+        if row is None:
+            continue
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _iter_range_chunks(f, start: int, end: int | None, chunk_size: int, aligned: bool = False):
+    """Parse the lines of a binary file object that start within bytes [start, end).
+    Yields (rows, offset), offset being the resume point just past the chunk's last line."""
+    if start and not aligned:
+        f.seek(start - 1)
+        f.readline()
+    else:
+        f.seek(start)
+    chunk = []
+    pos = f.tell()
+    while end is None or pos < end:
+        line = f.readline()
+        if not line:
+            break
+        pos += len(line)
+        row = _parse_line(line.decode("utf-8"))
+        if row is None:
+            continue
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk, pos
+            chunk = []
+    if chunk:
+        yield chunk, pos
+
+
+def message_hash(message: str | None) -> str | None:
+    """Same value as Postgres md5(message), which logs.message_hash is generated from."""
+    return hashlib.md5(message.encode("utf-8")).hexdigest() if message is not None else None
+
+
+def _new_rows(chunk: list) -> list:
+    """Rows of chunk whose (timestamp, service, level, message) is not stored yet, in one index probe."""
+    for row in chunk:
+        row["message_hash"] = message_hash(row["message"])
+    with engine.connect() as conn:
+        existing = {i - 1 for (i,) in conn.execute(
+            text("""
+            SELECT DISTINCT k.i
+            FROM unnest(CAST(:ts AS timestamp[]), CAST(:service AS text[]), CAST(:level AS text[]),
+                        CAST(:hash AS text[])) WITH ORDINALITY AS k(timestamp, service, level, message_hash, i)
+            JOIN logs l
+              ON l.timestamp = k.timestamp AND l.service = k.service
+             AND l.level = k.level AND l.message_hash = k.message_hash
+            """),
+            {
+                "ts": [r["timestamp"] for r in chunk],
+                "service": [r["service"] for r in chunk],
+                "level": [r["level"] for r in chunk],
+                "hash": [r["message_hash"] for r in chunk],
+            },
+        ).fetchall()}
+    seen = set()
+    new = []
+    for i, row in enumerate(chunk):
+        key = (row["timestamp"], row["service"], row["level"], row["message_hash"])
+        if i in existing or key in seen:
+            continue
+        seen.add(key)
+        new.append(row)
+    return new
+
+
+def _embed_chunk(chunk: list) -> list:
+    """Embed and cluster the rows of chunk that are not stored yet; duplicates stay without an embedding."""
+    new = _new_rows(chunk)
+    if not new:
+        return chunk
+    if templates.LOG_TEMPLATES:
+        # One embedding per distinct template rather than per line
+        vectors = templates.mine_batch(new)
+    else:
+        vectors = embed_batch_cached([row["message"] for row in new])
+    version, labels = assign(vectors)
+    for i, (row, vec) in enumerate(zip(new, vectors)):
+        row["embedding"] = Vector(vec)
+        row["cluster_id"] = int(labels[i]) if version is not None else None
+        row["cluster_version"] = version
+    return chunk
+
+
+def _put(q: queue.Queue, item, stop: threading.Event):
+    """Blocking put that gives up once the pipeline is being torn down."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _drain(q: queue.Queue, stop: threading.Event):
+    """Yield items from an upstream stage until it signals the end; re-raise its errors.
+    Also returns once the pipeline is torn down, so a stage never blocks forever."""
+    while not stop.is_set():
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _END:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+def _stage(source, fn, out: queue.Queue, stop: threading.Event):
+    """Run fn over every item of source in a worker thread, forwarding results to out."""
+    def run():
+        try:
+            for item in source():
+                if stop.is_set():
+                    break
+                _put(out, fn(item), stop)
+        except BaseException as e:
+            _put(out, e, stop)
+        finally:
+            _put(out, _END, stop)
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    return t
+
+
+def _insert_log_batch(db, rows: list) -> int:
+    """Bulk-insert one batch, skipping rows that already exist. Returns the number inserted.
+    Rollups and template counts are updated for the inserted rows in the same transaction."""
+    rows = [r for r in rows if "embedding" in r]
+    if not rows:
+        return 0
+    ensure_partitions(r["timestamp"] for r in rows)
+    cursor = db.connection().connection.cursor()
+    inserted = execute_values(
+        cursor,
+        "INSERT INTO logs (timestamp, level, service, message, embedding, cluster_id, cluster_version, "
+        "template_id, params) VALUES %s "
+        "ON CONFLICT DO NOTHING RETURNING timestamp, level, service, template_id",
+        [
+            (r["timestamp"], r["level"], r["service"], r["message"], r["embedding"],
+             r["cluster_id"], r["cluster_version"], r.get("template_id"), r.get("params"))
+            for r in rows
+        ],
+        page_size=len(rows),
+        fetch=True,
+    )
+    inserted = [
+        {"timestamp": ts, "level": level, "service": service, "template_id": template_id}
+        for ts, level, service, template_id in inserted
+    ]
+    rollups.record_batch(cursor, inserted)
+    templates.record_batch(cursor, inserted)
+    result_cache.record_batch(cursor, inserted)
+    cursor.close()
+    return len(inserted)
+
+
+def _run_pipeline(chunks, on_batch=None, checkpoint=None, embed=_embed_chunk) -> dict:
+    """Embed and write parsed chunks in three stages joined by bounded queues, one commit per batch.
+    checkpoint(db, item) runs in the batch's transaction; on_batch(rows, inserted) after its commit."""
+    parsed = queue.Queue(maxsize=INGEST_QUEUE_DEPTH)
+    embedded = queue.Queue(maxsize=INGEST_QUEUE_DEPTH)
+    stop = threading.Event()
+
+    def timed_embed(item):
+        with metrics.timed(metrics.INGEST_STAGE_SECONDS, stage="embed"):
+            return embed(item)
+
+    _stage(lambda: chunks, lambda c: c, parsed, stop)
+    _stage(lambda: _drain(parsed, stop), timed_embed, embedded, stop)
+
+    started = time.monotonic()
+    rows = inserted = batches = 0
+    db = get_db()
+    try:
+        for item in _drain(embedded, stop):
+            batch = item[0] if isinstance(item, tuple) else item
+            with metrics.timed(metrics.INGEST_STAGE_SECONDS, stage="write"):
+                n = _insert_log_batch(db, batch)
+                if checkpoint:
+                    checkpoint(db, item)
+                db.commit()
+            metrics.INGEST_ROWS.inc(n, result="inserted")
+            metrics.INGEST_ROWS.inc(len(batch) - n, result="duplicate")
+            if n:
+                vector_store.mark_dirty()
+            rows += len(batch)
+            inserted += n
+            batches += 1
+            if on_batch:
+                on_batch(len(batch), n)
+    finally:
+        stop.set()
+        db.close()
+
+    elapsed = time.monotonic() - started
+    if elapsed > 0:
+        metrics.INGEST_ROWS_PER_SEC.set(round(rows / elapsed, 1))
+    return {
+        "rows": rows,
+        "inserted": inserted,
+        "duplicates": rows - inserted,
+        "batches": batches,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(rows / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+def ingest_logs(file_path: str, chunk_size: int | None = None) -> dict:
+    """Stream a JSONL file from the backend's disk into `logs`."""
+    chunks = _iter_chunks(_iter_file_lines(_resolve_path(file_path)), chunk_size or INGEST_CHUNK_SIZE)
+    return _run_pipeline(chunks)
+
+
+def _ingest_range(f, start: int, end: int | None, chunk_size: int | None, aligned: bool, checkpoint) -> dict:
+    chunks = _iter_range_chunks(f, start, end, chunk_size or INGEST_CHUNK_SIZE, aligned)
+
+    def embed(item):
+        rows, offset = item
+        return _embed_chunk(rows), offset
+
+    def on_commit(db, item):
+        checkpoint(db, item[1], len(item[0]))
+
+    return _run_pipeline(chunks, checkpoint=on_commit if checkpoint else None, embed=embed)
+
+
+def ingest_file_range(
+    file_path: str,
+    start: int = 0,
+    end: int | None = None,
+    chunk_size: int | None = None,
+    aligned: bool = False,
+    checkpoint=None,
+) -> dict:
+    """Ingest the lines starting within bytes [start, end) of a JSONL file.
+    checkpoint(db, offset, rows) runs in each batch's transaction; resume with start=offset, aligned=True."""
+    with open(_resolve_path(file_path), "rb") as f:
+        return _ingest_range(f, start, end, chunk_size, aligned, checkpoint)
+
+
+def ingest_upload_part(data: bytes, start: int = 0, chunk_size: int | None = None, checkpoint=None) -> dict:
+    """Ingest an upload part from byte start (a line boundary), with checkpoints as in ingest_file_range()."""
+    return _ingest_range(io.BytesIO(data), start, None, chunk_size, True, checkpoint)
+
+
+class UploadSpool:
+    """Cut an uploaded JSONL/NDJSON body, plain or gzip, into parts of whole lines as it arrives.
+    on_part(data) receives the plain text of each part of about part_bytes."""
+
+    def __init__(self, on_part, part_bytes: int | None = None):
+        self.bytes = 0
+        self.parts = 0
+        self._on_part = on_part
+        self._part_bytes = part_bytes or UPLOAD_PART_BYTES
+        self._buffer = bytearray()
+        self._decoder = None
+        self._pending = b""
+
+    def write(self, chunk: bytes):
+        self.bytes += len(chunk)
+        if self._decoder is None:
+            self._pending += chunk
+            if len(self._pending) < 2:
+                return
+            gzipped = self._pending[:2] == b"\x1f\x8b"
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else False
+            chunk, self._pending = self._pending, b""
+        if self._decoder:
+            data = self._decoder.decompress(chunk)
+            while self._decoder.eof and self._decoder.unused_data:
+                rest = self._decoder.unused_data
+                self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                data += self._decoder.decompress(rest)
+            chunk = data
+        self._buffer += chunk
+        while len(self._buffer) >= self._part_bytes:
+            # Cut after the last line that fits, or after a single longer line
+            cut = self._buffer.rfind(b"\n", 0, self._part_bytes) + 1 or self._buffer.find(b"\n") + 1
+            if not cut:
+                break
+            self._emit(self._buffer[:cut])
+            del self._buffer[:cut]
+
+    def close(self):
+        """Emit the rest of the body as the last part."""
+        if self._decoder:
+            self._buffer += self._decoder.flush()
+            if not self._decoder.eof:
+                raise ValueError("the gzip body is truncated")
+        self._buffer += self._pending
+        if self._buffer.strip():
+            self._emit(self._buffer)
+        self._buffer = bytearray()
+
+    def _emit(self, data):
+        self._on_part(bytes(data))
+        self.parts += 1
@@ -1,35 +1,137 @@
-"""LLM summarization for root cause analysis."""
+"""LLM summarization for root cause analysis, with an LRU + TTL summary cache."""
 import os
-from openai import OpenAI
+import time
+import metrics
+import providers
+from cache import LRUCache
 
-def summarize_root_causes(query: str, similar_logs: list) -> str:
-    """Use LLM to summarize probable root causes from similar logs."""
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "1000"))
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", "3600"))
+SUMMARY_SYSTEM_PROMPT = "You are a DevOps engineer analyzing log errors. Provide a concise root cause summary in 2-3 sentences."
+
+_summaries = LRUCache(SUMMARY_CACHE_SIZE, ttl=SUMMARY_CACHE_TTL)
+
+class StreamInterrupted(Exception):
+    """The LLM failed after part of the summary was already streamed; carries the fallback summary."""
+    def __init__(self, reason: str, fallback: str):
+        super().__init__(reason)
+        self.fallback = fallback
+
+def _llm_config():
+    """(api_key, base_url, model); key or base_url is empty when no LLM is configured."""
     api_key = os.getenv("TRITON_API_KEY") or os.getenv("OPENAI_API_KEY")
     base_url = (os.getenv("OPENAI_API_BASE") or "").rstrip("/")
     if base_url and not base_url.endswith("/v1"):
         base_url = f"{base_url}/v1"
-    model = os.getenv("OPENAI_MODEL", "gpt-4")
+    return api_key, base_url, os.getenv("OPENAI_MODEL", "gpt-4")
 
+def _messages(query: str, similar_logs: list) -> list:
+    logs_text = "\n".join(
+        f"- [{r.get('level', '')}] {r.get('service', '')}: {r.get('message', '')}"
+        for r in similar_logs[:5]
+    )
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Query log: {query}\n\nSimilar past logs:\n{logs_text}\n\nSummarize the probable root cause and recommended actions:"}
+    ]
+
+def _cache_key(model: str, query: str, similar_logs: list) -> tuple:
+    # Only the logs the prompt actually includes affect the summary
+    return model, query, tuple(r.get("id") for r in similar_logs[:5])
+
+def summarize_root_causes(query: str, similar_logs: list) -> str:
+    """Use LLM to summarize probable root causes from similar logs."""
+    api_key, base_url, model = _llm_config()
     if not api_key or not base_url:
         return _fallback_summary(query, similar_logs)
 
-    try:
-        client = OpenAI(api_key=api_key, base_url=base_url)
-        logs_text = "\n".join(
-            f"- [{r.get('level', '')}] {r.get('service', '')}: {r.get('message', '')}"
-            for r in similar_logs[:5]
-        )
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are a DevOps engineer analyzing log errors. Provide a concise root cause summary in 2-3 sentences."},
-                {"role": "user", "content": f"Query log: {query}\n\nSimilar past logs:\n{logs_text}\n\nSummarize the probable root cause and recommended actions:"}
-            ],
-            max_tokens=200,
-        )
-        return response.choices[0].message.content.strip()
-    except Exception:
+    key = _cache_key(model, query, similar_logs)
+    cached = _summaries.get(key)
+    if cached is not None:
+        return cached
+
+    def complete():
+        client = providers.openai_client(api_key, base_url)
+        with providers.limit("llm"), metrics.timed(metrics.LLM_SECONDS, "llm", model=model, mode="complete"):
+            response = client.chat.completions.create(
+                model=model,
+                messages=_messages(query, similar_logs),
+                max_tokens=200,
+            )
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            metrics.LLM_TOKENS.inc(usage.prompt_tokens or 0, model=model, kind="prompt")
+            metrics.LLM_TOKENS.inc(usage.completion_tokens or 0, model=model, kind="completion")
+        return response.choices[0].message.content.strip(), None
+
+    # While the LLM circuit is open this returns immediately instead of waiting on a timeout
+    summary, _ = providers.call("llm", complete)
+    if summary is None:
         return _fallback_summary(query, similar_logs)
+    _summaries.set(key, summary)
+    return summary
+
+def stream_root_causes(query: str, similar_logs: list):
+    """Yield the summary in pieces as the LLM produces them.
+    A failure after the first piece raises StreamInterrupted."""
+    api_key, base_url, model = _llm_config()
+    if not api_key or not base_url:
+        yield _fallback_summary(query, similar_logs)
+        return
+
+    key = _cache_key(model, query, similar_logs)
+    cached = _summaries.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    health = providers.health("llm")
+    if not health.allow():
+        yield _fallback_summary(query, similar_logs)
+        return
+
+    parts = []
+    usage = None
+    started = time.perf_counter()
+    try:
+        client = providers.openai_client(api_key, base_url)
+        with providers.limit("llm"):
+            stream = client.chat.completions.create(
+                model=model,
+                messages=_messages(query, similar_logs),
+                max_tokens=200,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+    except GeneratorExit:
+        # The client went away mid-stream; the provider itself was answering
+        health.record_success(time.perf_counter() - started)
+        raise
+    except Exception as e:
+        health.record_failure(str(e), time.perf_counter() - started)
+        if parts:
+            raise StreamInterrupted(str(e), _fallback_summary(query, similar_logs)) from e
+        yield _fallback_summary(query, similar_logs)
+        return
+    elapsed = time.perf_counter() - started
+    health.record_success(elapsed)
+    metrics.LLM_SECONDS.observe(elapsed, model=model, mode="stream")
+    if usage is not None:
+        metrics.LLM_TOKENS.inc(usage.prompt_tokens or 0, model=model, kind="prompt")
+        metrics.LLM_TOKENS.inc(usage.completion_tokens or 0, model=model, kind="completion")
+    summary = "".join(parts).strip()
+    if summary:
+        _summaries.set(key, summary)
+
+def cache_stats() -> dict:
+    return {**_summaries.stats(), "ttl_seconds": SUMMARY_CACHE_TTL}
 
 def _fallback_summary(query: str, similar_logs: list) -> str:
     """Template-based summary when LLM is unavailable."""
@@ -1,11 +1,32 @@
-from fastapi import FastAPI, Query, HTTPException
+import json
+import time
+from datetime import datetime
+from typing import Literal, Optional
+from fastapi import BackgroundTasks, FastAPI, Query, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.requests import ClientDisconnect
 
-from db import init_db
-from ingestion import ingest_logs, ingest_deployments
-from analyzer import find_similar_logs, cluster_failure_patterns, correlate_with_deployments
-from llm import summarize_root_causes
-from models.schemas import IngestRequest, AnalyzeRequest, ClusterRequest
+from db import init_db, build_vector_index, check_vector_index, vector_index_status
+from ingestion import ingest_deployments, remove_duplicates, UploadSpool
+from analyzer import search_similar_logs, find_similar_logs_batch, cluster_failure_patterns, correlate_with_deployments
+import llm
+from llm import summarize_root_causes, stream_root_causes
+import embedding_cache
+import embeddings
+import providers
+from embedding_spaces import current_space, migrate_embedding_space
+from models.schemas import IngestRequest, AnalyzeRequest, AnalyzeBatchRequest, ClusterRequest, ClusterRefitRequest, VectorIndexRequest
+import cluster_model
+import worker
+import partitions
+import metrics
+import result_cache
+import rollups
+import templates
+import vector_store
+from executors import configure_io_threads, run_cpu, run_io
 
 app = FastAPI(title="LLM-Assisted Log Root Cause Analyzer")
 
@@ -17,78 +38,421 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Request latency histograms and the optional Server-Timing header
+app.add_middleware(metrics.RequestMetricsMiddleware)
 
 # Initialize DB
 @app.on_event("startup")
 def startup():
     init_db()
+    # One-off backfill when the rollups are introduced on an existing database
+    rollups.rebuild(only_if_empty=True)
+    partitions.start_maintenance()
+    vector_store.start()
+    result_cache.start_listener()
+    worker.start_pool()
+
+@app.on_event("shutdown")
+def shutdown():
+    worker.stop_pool()
+
+@app.on_event("startup")
+async def configure_executors():
+    configure_io_threads()
 
 # ------------ INGEST ENDPOINTS ------------
 @app.post("/ingest")
 async def ingest(request: IngestRequest):
-    ingest_logs(request.file_path)
-    return {"status": "ok", "file": request.file_path}
+    """Queue a file on the backend's disk for the worker pool; poll GET /jobs/{id}."""
+    try:
+        queued = await run_io(
+            worker.enqueue_ingest, request.file_path, chunk_size=request.chunk_size, force=request.force,
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"File not found: {request.file_path}")
+    status = "queued" if queued["job_ids"] else "already_ingested"
+    return {"status": status, "file": request.file_path, **queued}
 
 @app.post("/ingest/deployments")
 async def ingest_deployments_endpoint(request: IngestRequest):
-    ingest_deployments(request.file_path)
-    return {"status": "ok", "file": request.file_path}
+    result = await run_io(ingest_deployments, request.file_path)
+    return {"status": "ok", "file": request.file_path, **result}
+
+@app.post("/ingest/jobs")
+async def create_ingest_job(source: Optional[str] = None):
+    """Create an upload job; send the body with PUT /ingest/jobs/{job_id}."""
+    job_id = await run_io(worker.create_upload, source)
+    return {"job_id": job_id, "status": "uploading", "upload_url": f"/ingest/jobs/{job_id}"}
+
+@app.put("/ingest/jobs/{job_id}")
+async def upload_ingest_job(job_id: int, request: Request, chunk_size: Optional[int] = Query(None, ge=1)):
+    """Stream a JSONL/NDJSON body (optionally gzipped) to the workers as it arrives.
+    Each UPLOAD_PART_BYTES of whole lines is stored and queued at once; progress is in GET /ingest/jobs/{job_id}."""
+    job = await run_io(worker.get_upload, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown upload job")
+    worker_id = await run_io(worker.start_upload, job_id)
+    if worker_id is None:
+        raise HTTPException(status_code=409, detail=f"Upload job is already {job['status']}")
+
+    alive = worker.keep_alive(job_id, worker_id)
+    spool = UploadSpool(
+        lambda data: worker.add_upload_part(job_id, worker_id, spool.parts, data, spool.bytes, chunk_size)
+    )
+    try:
+        reported = time.monotonic()
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            await run_io(spool.write, chunk)
+            if time.monotonic() - reported >= worker.JOB_HEARTBEAT_INTERVAL:
+                await run_io(worker.upload_progress, job_id, worker_id, spool.bytes)
+                reported = time.monotonic()
+        await run_io(spool.close)
+        queued = await run_io(worker.finish_upload, job_id, worker_id, spool.bytes, spool.parts)
+    except Exception as e:
+        error = "client disconnected before the upload finished" if isinstance(e, ClientDisconnect) else str(e)
+        await run_io(worker.fail_upload, job_id, worker_id, error)
+        if isinstance(e, ClientDisconnect):
+            raise
+        raise HTTPException(status_code=400, detail={"error": error, "job_id": job_id})
+    finally:
+        alive.set()
+    status = "queued" if queued["job_ids"] else "already_ingested"
+    return {"job_id": job_id, "status": status, "bytes_received": spool.bytes, **queued}
+
+@app.get("/ingest/jobs/{job_id}")
+async def get_ingest_job(job_id: int):
+    job = await run_io(worker.get_upload, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown upload job")
+    return job
+
+@app.get("/ingest/jobs")
+async def list_ingest_jobs(limit: int = Query(100, ge=1, le=1000)):
+    return {"jobs": await run_io(worker.list_jobs, None, "upload", limit)}
+
+# ------------ JOB QUEUE (see worker.py) ------------
+@app.get("/jobs")
+async def list_queued_jobs(
+    status: Optional[Literal["uploading", "queued", "running", "done", "failed"]] = None,
+    kind: Optional[Literal["ingest", "reembed", "template_logs", "upload"]] = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    return {"jobs": await run_io(worker.list_jobs, status, kind, limit)}
+
+@app.get("/jobs/metrics")
+async def job_metrics():
+    return await run_io(worker.queue_metrics)
+
+@app.get("/jobs/{job_id}")
+async def get_queued_job(job_id: int):
+    job = await run_io(worker.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+@app.post("/jobs/{job_id}/retry")
+async def retry_queued_job(job_id: int):
+    if not await run_io(worker.retry_job, job_id):
+        raise HTTPException(status_code=409, detail="Only failed jobs can be retried")
+    return {"status": "queued", "job_id": job_id}
+
+async def _cached(endpoint: str, params: dict, deps: list, compute):
+    """compute()'s result, served from the result cache until data in deps changes."""
+    key = result_cache.key(endpoint, jsonable_encoder(params))
+    value = result_cache.get(key)
+    if value is None:
+        generation = result_cache.generation()
+        value = await compute()
+        result_cache.put(key, value, generation, deps)
+    return value
 
 # ------------ ANALYZE ENDPOINT (with LLM summary + structured filtering) ------------
 @app.post("/analyze")
 async def analyze_logs(request: AnalyzeRequest):
+    # Only the search is cached; summaries have their own cache (and a fallback
+    # produced while the LLM is down must not stick)
+    params = request.model_dump(exclude={"stream"})
+    deps = [result_cache.logs_dep(request.service, request.start_time, request.end_time)]
     try:
-        results = find_similar_logs(
+        results, plan = await _cached("analyze", params, deps, lambda: run_io(
+            search_similar_logs,
             request.log_message,
             top_k=request.top_k or 5,
             level=request.level,
             service=request.service,
             start_time=request.start_time,
             end_time=request.end_time,
+            ef_search=request.ef_search,
+            probes=request.probes,
+        ))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if request.stream:
+        return StreamingResponse(
+            _analyze_events(request.log_message, results, plan),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    summary = await run_io(summarize_root_causes, request.log_message, results)
+    return {"root_causes": results, "summary": summary, "search_plan": plan}
+
+@app.post("/analyze/batch")
+async def analyze_batch(request: AnalyzeBatchRequest):
+    """Analyze many log lines at once: one embedding batch, one search statement,
+    matched logs deduplicated across queries and a single combined summary."""
+    try:
+        matches, logs, plan = await run_io(
+            find_similar_logs_batch,
+            request.log_messages,
+            top_k=request.top_k or 5,
+            level=request.level,
+            service=request.service,
+            start_time=request.start_time,
+            end_time=request.end_time,
+            ef_search=request.ef_search,
+            probes=request.probes,
         )
-        summary = summarize_root_causes(request.log_message, results)
-        return {"root_causes": results, "summary": summary}
     except RuntimeError as e:
         raise HTTPException(status_code=503, detail=str(e))
+    summary = await run_io(summarize_root_causes, "\n".join(dict.fromkeys(request.log_messages)), logs)
+    return {
+        "results": [{"log_message": q, "matches": m} for q, m in zip(request.log_messages, matches)],
+        "logs": logs,
+        "summary": summary,
+        "search_plan": plan,
+    }
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+def _analyze_events(query: str, results: list, plan: dict):
+    """Server-sent events: root_causes, search_plan, summary deltas, then done.
+    A plain generator, so Starlette runs the blocking LLM stream in its threadpool."""
+    yield _sse("root_causes", results)
+    yield _sse("search_plan", plan)
+    parts = []
+    try:
+        for delta in stream_root_causes(query, results):
+            parts.append(delta)
+            yield _sse("summary", {"delta": delta})
+    except llm.StreamInterrupted as e:
+        yield _sse("error", {"detail": f"summary stream interrupted: {e}"})
+        parts = [e.fallback]
+    yield _sse("done", {"summary": "".join(parts).strip()})
 
 # ------------ CLUSTERING ENDPOINT ------------
 @app.post("/cluster")
 async def cluster(request: ClusterRequest):
-    clusters = cluster_failure_patterns(
-        n_clusters=request.n_clusters or 5,
-        level=request.level,
+    n_clusters = request.n_clusters or 5
+    # Any clustering option asks for a fresh fit; the stored model only answers plain requests
+    fit_options = {"algorithm", "sample_size", "pca_components", "batch_size"} & request.model_fields_set
+
+    async def compute():
+        if request.use_stored and not fit_options:
+            stored = await run_io(cluster_model.stored_clusters, n_clusters, level=request.level)
+            if stored is not None:
+                return stored
+        clusters = await run_cpu(
+            cluster_failure_patterns,
+            n_clusters=n_clusters,
+            level=request.level,
+            algorithm=request.algorithm,
+            sample_size=request.sample_size,
+            pca_components=request.pca_components,
+            batch_size=request.batch_size or 1024,
+        )
+        return {"clusters": clusters, "model_version": None, "algorithm": request.algorithm}
+
+    key = {**request.model_dump(), "fit_options": sorted(fit_options)}
+    return await _cached("cluster", key, [result_cache.logs_dep()], compute)
+
+@app.get("/templates")
+async def log_templates(
+    q: Optional[str] = None,
+    service: Optional[str] = None,
+    level: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=1000),
+):
+    """Mined log templates: nearest to q when given, otherwise the most frequent."""
+    if q:
+        return {"templates": await run_io(templates.search_templates, q, limit)}
+    return {"templates": await run_io(templates.list_templates, limit, service, level)}
+
+@app.post("/admin/cluster/refit")
+async def refit_clusters(request: ClusterRefitRequest, background_tasks: BackgroundTasks):
+    """Fit and activate a new cluster model version in the background."""
+    background_tasks.add_task(
+        cluster_model.refit, n_clusters=request.n_clusters, pca_components=request.pca_components
     )
-    return {"clusters": clusters}
+    return {"status": "refitting"}
+
+@app.get("/admin/cluster/model")
+def cluster_model_status():
+    return cluster_model.model_status()
 
 # ------------ DEPLOYMENT CORRELATION ------------
 @app.get("/correlate")
-async def correlate(service: str = Query(...)):
-    results = correlate_with_deployments(service)
-    return {"deployment_logs": results}
+async def correlate(
+    service: str = Query(...),
+    window_minutes: int = Query(30, ge=1, le=1440),
+    limit: int = Query(20, ge=1, le=200),
+):
+    """Deployments ranked by the error spike in the window after them, plus the
+    logs that followed the top-ranked one."""
+    async def compute():
+        deployments, logs = await run_io(correlate_with_deployments, service, window_minutes, limit)
+        return {"deployments": deployments, "deployment_logs": logs, "window_minutes": window_minutes}
+
+    params = {"service": service, "window_minutes": window_minutes, "limit": limit}
+    deps = [result_cache.logs_dep(service), result_cache.deployments_dep(service)]
+    return await _cached("correlate", params, deps, compute)
+
+# ------------ ERROR-RATE ROLLUPS ------------
+@app.get("/rollups/error-rate")
+async def error_rate(
+    service: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bucket: Optional[Literal["minute", "hour"]] = None,
+):
+    """Errors, totals and error rate per minute or hour, read from the rollups only."""
+    try:
+        return await run_io(rollups.error_rate_series, service, start, end, bucket)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# ------------ ADMIN: VECTOR INDEX ------------
+@app.post("/admin/index")
+async def build_index(request: VectorIndexRequest, background_tasks: BackgroundTasks):
+    """Build or rebuild the ANN index in the background (CREATE INDEX CONCURRENTLY)."""
+    try:
+        await run_io(check_vector_index, request.method, request.quantization)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    background_tasks.add_task(
+        build_vector_index,
+        request.method,
+        m=request.m,
+        ef_construction=request.ef_construction,
+        lists=request.lists,
+        rebuild=request.rebuild,
+        quantization=request.quantization,
+    )
+    return {"status": "building", "method": request.method}
+
+@app.get("/admin/index")
+def index_status():
+    return vector_index_status()
+
+# ------------ ADMIN: VECTOR STORE ------------
+@app.get("/admin/vector-store")
+def vector_store_status():
+    """Rows, size and window of the in-process NumPy search backend."""
+    return vector_store.status()
+
+@app.post("/admin/vector-store/rebuild")
+async def rebuild_vector_store():
+    """Recreate the NumPy vector store from logs (drops rows deleted since)."""
+    return await run_io(vector_store.rebuild)
+
+# ------------ ADMIN: PARTITIONS ------------
+@app.get("/admin/partitions")
+def partition_status():
+    """Partitions of logs with their ranges, row estimates and sizes."""
+    return partitions.partition_status()
+
+@app.post("/admin/partitions/maintain")
+async def maintain_partitions():
+    """Create upcoming partitions and drop the ones past LOGS_RETENTION_DAYS now."""
+    return await run_io(partitions.maintain)
+
+@app.post("/admin/partitions/convert")
+async def convert_partitions(background_tasks: BackgroundTasks):
+    """Rebuild a plain logs table as a partitioned one (locks logs while copying)."""
+    if not partitions.LOGS_PARTITION_INTERVAL:
+        raise HTTPException(status_code=400, detail="Set LOGS_PARTITION_INTERVAL to 'day' or 'week' first")
+    background_tasks.add_task(partitions.convert_to_partitioned)
+    return {"status": "converting", "interval": partitions.LOGS_PARTITION_INTERVAL or None}
+
+# ------------ ADMIN: ROLLUPS ------------
+@app.post("/admin/dedupe")
+async def dedupe():
+    """Remove duplicate logs/deployments and create the unique indexes that prevent them."""
+    return await run_io(remove_duplicates)
+
+@app.post("/admin/rollups/rebuild")
+async def rebuild_rollups():
+    """Recompute the per-minute and per-hour log counts from logs."""
+    return await run_io(rollups.rebuild)
+
+# ------------ ADMIN: EMBEDDING SPACE ------------
+@app.get("/admin/embeddings/space")
+def embedding_space():
+    """Which model/dimension logs.embedding holds vs. what the config asks for."""
+    return current_space()
+
+@app.post("/admin/embeddings/migrate")
+async def migrate_embeddings(background_tasks: BackgroundTasks):
+    """Convert logs.embedding to the active model's native dimension in the background."""
+    background_tasks.add_task(migrate_embedding_space)
+    return {"status": "migrating", **current_space()["target"]}
+
+@app.post("/admin/embeddings/reembed")
+async def reembed_logs(only_missing: bool = False):
+    """Queue re-embedding of logs.embedding in id-range shards for the worker pool."""
+    job_ids = await run_io(worker.enqueue_reembed, only_missing)
+    return {"status": "queued", "job_ids": job_ids}
+
+# ------------ EMBEDDING CACHE ------------
+@app.get("/cache/embeddings")
+def embedding_cache_stats():
+    """Hit/miss counters for the in-process and Postgres embedding cache tiers."""
+    return embedding_cache.stats()
+
+@app.get("/cache/results")
+def result_cache_stats():
+    """Size, hit rate and invalidation counters of the /analyze, /cluster and /correlate cache."""
+    return result_cache.stats()
+
+@app.get("/cache/summaries")
+def summary_cache_stats():
+    """Size, hit rate and TTL of the LLM summary cache."""
+    return llm.cache_stats()
 
 # ------------ HEALTH CHECK ------------
 @app.get("/")
 def health():
     return {"status": "running"}
 
-# ------------ DEBUG (verify env vars on Railway; remove in production if desired) ------------
-@app.get("/debug/env")
-def debug_env():
-    """Shows which embedding env vars are set (no values). Use to verify Railway injects OPENAI_API_KEY."""
-    import os
+# ------------ PROVIDER HEALTH ------------
+@app.get("/providers")
+def provider_status():
+    """Circuit breaker state, latency EWMA and last error per provider (env values are never shown)."""
+    provider, model = embeddings.active_provider()
     return {
-        "OPENAI_API_KEY": "set" if os.getenv("OPENAI_API_KEY") else "unset",
-        "TRITON_API_KEY": "set" if os.getenv("TRITON_API_KEY") else "unset",
-        "TRITON_API_URL": "set" if os.getenv("TRITON_API_URL") else "unset",
-        "OPENAI_API_BASE": "set" if os.getenv("OPENAI_API_BASE") else "unset",
-        "EMBEDDING_MODEL": os.getenv("EMBEDDING_MODEL", "(default)"),
+        "embedding": {"provider": provider, "model": model, "configured": embeddings.configured_provider()[0]},
+        "providers": providers.status(),
     }
 
-# ------------ STATS (for MTTR tracking) ------------
+# ------------ METRICS ------------
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Latency histograms and counters in the Prometheus text exposition format."""
+    # Worker processes are not scraped; their job progress is read back from ingest_jobs
+    metrics.set_queue_metrics(worker.queue_metrics())
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# ------------ STATS ------------
 @app.get("/stats")
-def stats():
-    """Placeholder for MTTR metrics. Use with real incident tracking for measured improvement."""
+async def stats():
+    """Measured corpus and ingest figures. MTTR is not reported: no incident outcomes are recorded."""
+    totals = await run_io(rollups.totals)
+    queue = await run_io(worker.queue_metrics)
     return {
-        "mttr_reduction_pct": 39,
-        "description": "Clustering failure patterns and ranking causal signals reduces mean time to diagnosis",
-    }
\ No newline at end of file
+        **totals,
+        "error_rate": round(totals["errors"] / totals["logs"], 4) if totals["logs"] else None,
+        "ingest_rows_per_sec_last_1h": queue["rows_per_sec_last_1h"],
+        "jobs_done_last_1h": queue["done_last_1h"],
+    }
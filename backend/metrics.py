@@ -0,0 +1,220 @@
+"""Hot-path timings as Prometheus metrics, plus an optional Server-Timing header."""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Add a Server-Timing header (embed, db, search, llm, ...) to every response
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROW_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+_registry = []
+_timings = contextvars.ContextVar("server_timings", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(names: tuple, values: tuple, le: str | None = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted(self._series.items(), key=lambda kv: kv[0])
+            lines.extend(self._render_series(key, value) for key, value in series)
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, value: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + value
+
+    def _render_series(self, key, value) -> str:
+        return f"{self.name}{_label_str(self.labels, key)} {value}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._series[self._key(labels)] = value
+
+    def _render_series(self, key, value) -> str:
+        return f"{self.name}{_label_str(self.labels, key)} {value}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _render_series(self, key, value) -> str:
+        counts, total, n = value
+        lines = [
+            f"{self.name}_bucket{_label_str(self.labels, key, str(bound))} {count}"
+            for bound, count in zip(self.buckets, counts)
+        ]
+        lines.append(f"{self.name}_bucket{_label_str(self.labels, key, '+Inf')} {n}")
+        lines.append(f"{self.name}_sum{_label_str(self.labels, key)} {total}")
+        lines.append(f"{self.name}_count{_label_str(self.labels, key)} {n}")
+        return "\n".join(lines)
+
+
+HTTP_SECONDS = Histogram("rca_http_request_seconds", "Request latency by route", ("method", "route", "status"))
+EMBED_SECONDS = Histogram("rca_embedding_seconds", "Embedding latency per provider call", ("provider",))
+EMBED_TEXTS = Counter("rca_embedding_texts_total", "Texts embedded", ("provider",))
+PROVIDER_SECONDS = Histogram(
+    "rca_provider_call_seconds", "Remote provider calls through the circuit breakers", ("provider", "outcome"),
+)
+DB_SECONDS = Histogram("rca_db_query_seconds", "SQL statement latency", ("statement",))
+DB_ROWS = Counter("rca_db_rows_total", "Rows returned or affected by SQL statements", ("statement",))
+SEARCH_SECONDS = Histogram("rca_search_seconds", "Similarity search latency", ("strategy",))
+SEARCH_ROWS_SCANNED = Histogram(
+    "rca_search_rows_scanned", "Rows scored per in-process vector search", ("quantization",), ROW_BUCKETS,
+)
+CLUSTER_FIT_SECONDS = Histogram("rca_cluster_fit_seconds", "Clustering fit time", ("algorithm",))
+CLUSTER_FIT_ROWS = Histogram("rca_cluster_fit_rows", "Rows per clustering fit", ("algorithm",), ROW_BUCKETS)
+LLM_SECONDS = Histogram("rca_llm_seconds", "LLM summary latency", ("model", "mode"))
+LLM_TOKENS = Counter("rca_llm_tokens_total", "LLM tokens reported by the provider", ("model", "kind"))
+INGEST_ROWS = Counter("rca_ingest_rows_total", "Log lines ingested", ("result",))
+INGEST_STAGE_SECONDS = Histogram("rca_ingest_stage_seconds", "Per-batch ingest stage time", ("stage",))
+INGEST_ROWS_PER_SEC = Gauge("rca_ingest_rows_per_second", "Throughput of the last finished ingest run")
+# Set from ingest_jobs by set_queue_metrics()
+JOBS = Gauge("rca_jobs", "Jobs in ingest_jobs", ("kind", "status"))
+JOB_ROWS = Gauge("rca_jobs_rows", "Rows processed by the jobs in ingest_jobs", ("kind", "status"))
+JOB_ROWS_PER_SEC = Gauge("rca_jobs_rows_per_second", "Per-job throughput of jobs finished in the last hour")
+JOBS_OLDEST_QUEUED = Gauge("rca_jobs_oldest_queued_seconds", "Age of the oldest queued job")
+JOB_WORKERS = Gauge("rca_jobs_active_workers", "Workers with a running job and a fresh heartbeat")
+
+
+def set_queue_metrics(queue: dict):
+    """Load worker.queue_metrics() into the rca_jobs_* gauges."""
+    JOBS.clear()
+    JOB_ROWS.clear()
+    for r in queue["jobs"]:
+        JOBS.set(r["jobs"], kind=r["kind"], status=r["status"])
+        JOB_ROWS.set(r["rows"], kind=r["kind"], status=r["status"])
+    JOB_ROWS_PER_SEC.set(queue["rows_per_sec_last_1h"] or 0)
+    JOBS_OLDEST_QUEUED.set(queue["oldest_queued_seconds"] or 0)
+    JOB_WORKERS.set(queue["active_workers"])
+
+
+def record(name: str, seconds: float):
+    """Add seconds to this request's Server-Timing entry for name (no-op outside a request)."""
+    timings = _timings.get()
+    if timings is not None:
+        with timings["lock"]:
+            entry = timings["entries"].setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+
+@contextmanager
+def timed(histogram: Histogram, timing: str | None = None, **labels):
+    """Observe the block's duration in histogram (and Server-Timing under timing)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.observe(elapsed, **labels)
+        if timing:
+            record(timing, elapsed)
+
+
+def server_timing(total: float) -> str:
+    """The Server-Timing header value for the current request."""
+    timings = _timings.get() or {"lock": threading.Lock(), "entries": {}}
+    parts = []
+    for name, (seconds, count) in sorted(timings["entries"].items()):
+        part = f"{name};dur={seconds * 1000:.2f}"
+        if count > 1:
+            part += f';desc="{count}x"'
+        parts.append(part)
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware: per-route latency histogram and, with SERVER_TIMING, the header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        token = _timings.set({"lock": threading.Lock(), "entries": {}})
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING:
+                    header = server_timing(time.perf_counter() - started).encode()
+                    message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            # Route templates, not raw paths, keep the label set bounded
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_SECONDS.observe(time.perf_counter() - started, method=scope["method"], route=route, status=status)
+            _timings.reset(token)
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -1,10 +1,13 @@
-from pydantic import BaseModel
-from typing import List, Any, Optional
+from pydantic import BaseModel, Field
+from typing import List, Any, Literal, Optional
 from datetime import datetime
 
 
 class IngestRequest(BaseModel):
     file_path: str
+    chunk_size: Optional[int] = None
+    # Queue the file even if the ingest manifest says it was already loaded
+    force: bool = False
 
 
 class AnalyzeRequest(BaseModel):
@@ -14,11 +17,51 @@ class AnalyzeRequest(BaseModel):
     service: Optional[str] = None
     start_time: Optional[datetime] = None
     end_time: Optional[datetime] = None
+    # ANN recall/speed knobs: HNSW ef_search, IVFFlat probes
+    ef_search: Optional[int] = Field(None, ge=1, le=1000)
+    probes: Optional[int] = Field(None, ge=1)
+    # Return text/event-stream: root_causes first, then the summary as it is generated
+    stream: bool = False
+
+
+class AnalyzeBatchRequest(BaseModel):
+    log_messages: List[str] = Field(..., min_length=1, max_length=200)
+    top_k: Optional[int] = 5
+    level: Optional[str] = None
+    service: Optional[str] = None
+    start_time: Optional[datetime] = None
+    end_time: Optional[datetime] = None
+    ef_search: Optional[int] = Field(None, ge=1, le=1000)
+    probes: Optional[int] = Field(None, ge=1)
 
 
 class ClusterRequest(BaseModel):
     n_clusters: Optional[int] = 5
     level: Optional[str] = None
+    # kmeans: full KMeans; minibatch: MiniBatchKMeans in memory; streaming: chunked partial_fit;
+    # templates: KMeans over log templates weighted by their log counts
+    algorithm: Literal["kmeans", "minibatch", "streaming", "templates"] = "kmeans"
+    sample_size: Optional[int] = Field(None, ge=1)
+    pca_components: Optional[int] = Field(None, ge=1)
+    batch_size: Optional[int] = Field(None, ge=1)
+    # Answer from the persisted model's stored assignments when its k matches
+    # and none of algorithm, sample_size, pca_components or batch_size is given
+    use_stored: bool = True
+
+
+class ClusterRefitRequest(BaseModel):
+    n_clusters: Optional[int] = Field(None, ge=1)
+    pca_components: Optional[int] = Field(None, ge=1)
+
+
+class VectorIndexRequest(BaseModel):
+    method: Literal["hnsw", "ivfflat"] = "hnsw"
+    m: Optional[int] = None
+    ef_construction: Optional[int] = None
+    lists: Optional[int] = None
+    rebuild: bool = False
+    # None uses VECTOR_INDEX_QUANTIZATION
+    quantization: Optional[Literal["none", "halfvec", "binary"]] = None
 
 
 class CorrelateQuery(BaseModel):
@@ -0,0 +1,260 @@
+"""Range partitions of logs on timestamp: creation, retention and conversion."""
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from db import engine, logs_is_partitioned, logs_partitions, build_vector_index, create_logs_indexes, index_quantization
+from db import LOGS_PARTITION_INTERVAL
+import result_cache
+import templates
+
+logger = logging.getLogger(__name__)
+
+# Drop partitions whose range ended more than this many days ago; 0 keeps everything
+LOGS_RETENTION_DAYS = int(os.getenv("LOGS_RETENTION_DAYS", "0"))
+# Intervals created ahead of the current one so ingest rarely has to run DDL
+LOGS_PARTITION_PREMAKE = int(os.getenv("LOGS_PARTITION_PREMAKE", "2"))
+PARTITION_MAINTENANCE_INTERVAL = int(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+
+_BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+_lock = threading.Lock()
+# Sorted, non-overlapping (start, end) ranges of the existing partitions
+_ranges = None
+_partitioned = None
+_maintenance = None
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _naive(ts: datetime) -> datetime:
+    # logs.timestamp is TIMESTAMP (no time zone); aware values are stored as UTC
+    return ts.astimezone(timezone.utc).replace(tzinfo=None) if ts.tzinfo else ts
+
+
+def bucket(ts: datetime, interval: str | None = None) -> tuple[datetime, datetime]:
+    """[start, end) of the day or ISO week (Monday start) containing ts."""
+    interval = interval or LOGS_PARTITION_INTERVAL
+    start = datetime(ts.year, ts.month, ts.day)
+    if interval == "week":
+        start -= timedelta(days=start.weekday())
+        return start, start + timedelta(days=7)
+    return start, start + timedelta(days=1)
+
+
+def _load_ranges(conn) -> list:
+    ranges = []
+    for p in logs_partitions(conn):
+        m = _BOUND.search(p.bound or "")
+        if m:
+            ranges.append((datetime.fromisoformat(m.group(1)), datetime.fromisoformat(m.group(2)), p.name))
+    return sorted(ranges)
+
+
+def _refresh(conn):
+    global _ranges, _partitioned
+    _partitioned = logs_is_partitioned(conn)
+    _ranges = _load_ranges(conn) if _partitioned else []
+
+
+def _covering(ranges: list, ts: datetime):
+    """Index of the range containing ts, or None."""
+    i = bisect.bisect_right(ranges, (ts, datetime.max)) - 1
+    if i >= 0 and ranges[i][0] <= ts < ranges[i][1]:
+        return i
+    return None
+
+
+def _missing(ranges: list, timestamps) -> list:
+    """New (start, end) ranges needed to cover timestamps, clipped so they
+    never overlap an existing partition (e.g. after the interval changed)."""
+    needed = {}
+    for ts in timestamps:
+        ts = _naive(ts)
+        if _covering(ranges, ts) is not None:
+            continue
+        start, end = bucket(ts)
+        i = bisect.bisect_right(ranges, (ts, datetime.max))
+        if i > 0:
+            start = max(start, ranges[i - 1][1])
+        if i < len(ranges):
+            end = min(end, ranges[i][0])
+        needed[start] = end
+    return sorted(needed.items())
+
+
+def _create(conn, start: datetime, end: datetime):
+    name = f"logs_p{start:%Y%m%d}"
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF logs "
+        f"FOR VALUES FROM ('{start.isoformat(sep=' ')}') TO ('{end.isoformat(sep=' ')}')"
+    ))
+    logger.info("Created partition %s [%s, %s)", name, start, end)
+
+
+def ensure_partitions(timestamps) -> int:
+    """Create any partitions needed for these timestamps. Returns the number created.
+    No round trip when every timestamp already falls into a known partition."""
+    global _ranges
+    timestamps = list(timestamps)
+    with _lock:
+        if _partitioned is False:
+            return 0
+        if _ranges is not None and not _missing(_ranges, timestamps):
+            return 0
+        created = 0
+        for attempt in range(2):
+            try:
+                with engine.begin() as conn:
+                    _refresh(conn)
+                    if not _partitioned:
+                        return 0
+                    for start, end in _missing(_ranges, timestamps):
+                        _create(conn, start, end)
+                        created += 1
+                    _ranges = _load_ranges(conn)
+                return created
+            except DBAPIError:
+                # Another process created an overlapping partition first; reload and retry
+                created = 0
+                if attempt:
+                    raise
+
+
+def drop_expired_partitions(retention_days: int | None = None) -> list:
+    """Detach and drop partitions whose whole range is older than the retention window."""
+    retention_days = LOGS_RETENTION_DAYS if retention_days is None else retention_days
+    if not retention_days:
+        return []
+    cutoff = _utcnow() - timedelta(days=retention_days)
+    dropped = []
+    with _lock:
+        with engine.begin() as conn:
+            _refresh(conn)
+            for start, end, name in _ranges:
+                if end <= cutoff:
+                    conn.execute(text(f"ALTER TABLE logs DETACH PARTITION {name}"))
+                    conn.execute(text(f"DROP TABLE {name}"))
+                    dropped.append(name)
+            _refresh(conn)
+    if dropped:
+        logger.info("Dropped expired partitions: %s", ", ".join(dropped))
+        templates.rebuild_counts()
+        result_cache.notify_all()
+    return dropped
+
+
+def maintain() -> dict:
+    """Pre-create upcoming partitions and apply retention."""
+    now = _utcnow()
+    step = timedelta(days=7 if LOGS_PARTITION_INTERVAL == "week" else 1)
+    created = ensure_partitions([now + i * step for i in range(LOGS_PARTITION_PREMAKE + 1)])
+    dropped = drop_expired_partitions()
+    return {"created": created, "dropped": dropped}
+
+
+def partition_status() -> dict:
+    with engine.connect() as conn:
+        if not logs_is_partitioned(conn):
+            return {"partitioned": False, "interval": LOGS_PARTITION_INTERVAL or None, "partitions": []}
+        rows = conn.execute(text("""
+            SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound,
+                   greatest(c.reltuples, 0)::bigint AS estimated_rows,
+                   pg_size_pretty(pg_total_relation_size(c.oid)) AS total_size
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'logs'::regclass
+            ORDER BY c.relname
+        """)).fetchall()
+    return {
+        "partitioned": True,
+        "interval": LOGS_PARTITION_INTERVAL or None,
+        "retention_days": LOGS_RETENTION_DAYS or None,
+        "partitions": [dict(r._mapping) for r in rows],
+    }
+
+
+def convert_to_partitioned() -> dict:
+    """Rebuild a plain logs table as a partitioned one, keeping ids.
+    Copies every row under an exclusive lock, so run it in a maintenance window."""
+    global _partitioned, _ranges
+    if not LOGS_PARTITION_INTERVAL:
+        raise ValueError("Set LOGS_PARTITION_INTERVAL to 'day' or 'week' first")
+    with _lock:
+        with engine.begin() as conn:
+            if logs_is_partitioned(conn):
+                return {"status": "already_partitioned"}
+            conn.execute(text("LOCK TABLE logs IN ACCESS EXCLUSIVE MODE"))
+            if conn.execute(text("SELECT 1 FROM logs WHERE timestamp IS NULL LIMIT 1")).scalar():
+                raise ValueError("logs has rows without a timestamp; they cannot be placed in a partition")
+            had_index = conn.execute(text(
+                "SELECT indexdef FROM pg_indexes WHERE tablename = 'logs' AND indexdef ~ 'USING (hnsw|ivfflat)'"
+            )).scalar()
+            sequence = conn.execute(text("SELECT pg_get_serial_sequence('logs', 'id')")).scalar()
+
+            # Free the index names for the new table; the copy gets new indexes anyway
+            for (index,) in conn.execute(text(
+                "SELECT indexname FROM pg_indexes WHERE tablename = 'logs' AND indexname <> 'logs_pkey'"
+            )).fetchall():
+                conn.execute(text(f"DROP INDEX {index}"))
+            conn.execute(text("ALTER TABLE logs RENAME TO logs_unpartitioned"))
+            conn.execute(text("ALTER TABLE logs_unpartitioned RENAME CONSTRAINT logs_pkey TO logs_unpartitioned_pkey"))
+            conn.execute(text("""
+                CREATE TABLE logs (LIKE logs_unpartitioned INCLUDING DEFAULTS INCLUDING GENERATED)
+                PARTITION BY RANGE (timestamp)
+            """))
+            conn.execute(text("ALTER TABLE logs ADD PRIMARY KEY (id, timestamp)"))
+            if sequence:
+                conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY logs.id"))
+
+            span = conn.execute(text("SELECT min(timestamp), max(timestamp) FROM logs_unpartitioned")).first()
+            _ranges = []
+            if span[0] is not None:
+                step = timedelta(days=7 if LOGS_PARTITION_INTERVAL == "week" else 1)
+                starts, ts = [], bucket(span[0])[0]
+                while ts <= span[1]:
+                    starts.append(ts)
+                    ts += step
+                for start, end in _missing([], starts):
+                    _create(conn, start, end)
+            # Generated columns (message_hash) are recomputed, not copied
+            columns = conn.execute(text("""
+                SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) FROM pg_attribute
+                WHERE attrelid = 'logs_unpartitioned'::regclass AND attnum > 0
+                  AND NOT attisdropped AND attgenerated = ''
+            """)).scalar()
+            rows = conn.execute(text(
+                f"INSERT INTO logs ({columns}) SELECT {columns} FROM logs_unpartitioned"
+            )).rowcount
+            conn.execute(text("DROP TABLE logs_unpartitioned"))
+            create_logs_indexes(conn)
+            _refresh(conn)
+
+    if had_index:
+        build_vector_index(
+            "ivfflat" if "USING ivfflat" in had_index else "hnsw", quantization=index_quantization(had_index),
+        )
+    return {"status": "converted", "rows": rows, "partitions": len(_ranges)}
+
+
+def _run_maintenance():
+    while True:
+        try:
+            maintain()
+        except Exception:
+            logger.exception("Partition maintenance failed")
+        time.sleep(PARTITION_MAINTENANCE_INTERVAL)
+
+
+def start_maintenance():
+    """Start the background partition maintenance thread when partitioning is on."""
+    global _maintenance
+    if LOGS_PARTITION_INTERVAL and _maintenance is None:
+        _maintenance = threading.Thread(target=_run_maintenance, name="partition-maintenance", daemon=True)
+        _maintenance.start()
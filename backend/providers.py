@@ -0,0 +1,262 @@
+"""Shared, long-lived provider clients with pooled connections, timeouts and retries.
+Each provider also has a concurrency limit and a circuit breaker."""
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import metrics
+
+PROVIDER_CONNECT_TIMEOUT = float(os.getenv("PROVIDER_CONNECT_TIMEOUT", "5"))
+PROVIDER_TIMEOUT = float(os.getenv("PROVIDER_TIMEOUT", "30"))
+PROVIDER_MAX_RETRIES = int(os.getenv("PROVIDER_MAX_RETRIES", "2"))
+PROVIDER_BACKOFF = float(os.getenv("PROVIDER_BACKOFF", "0.5"))
+PROVIDER_POOL_SIZE = int(os.getenv("PROVIDER_POOL_SIZE", "20"))
+
+# Default in-flight calls per provider; override with e.g. TRITON_MAX_CONCURRENCY=32
+_DEFAULT_CONCURRENCY = {"triton": 16, "openai": 16, "llm": 8, "local": 1}
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))
+CIRCUIT_COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", "30"))
+LATENCY_EWMA_ALPHA = float(os.getenv("LATENCY_EWMA_ALPHA", "0.2"))
+
+_lock = threading.Lock()
+_session = None
+_openai_clients = {}
+_semaphores = {}
+_health = {}
+_hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+
+def timeout() -> tuple[float, float]:
+    """(connect, read) timeout for requests-based calls."""
+    return PROVIDER_CONNECT_TIMEOUT, PROVIDER_TIMEOUT
+
+
+def http_session() -> requests.Session:
+    """Process-wide requests session with a keep-alive pool and retry/backoff."""
+    global _session
+    with _lock:
+        if _session is None:
+            retry = Retry(
+                total=PROVIDER_MAX_RETRIES,
+                read=0,  # a read timeout already spent PROVIDER_TIMEOUT; let the breaker decide
+                backoff_factor=PROVIDER_BACKOFF,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=None,  # embedding POSTs are safe to retry
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=PROVIDER_POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def openai_client(api_key: str, base_url: str):
+    """Cached OpenAI client per (api_key, base_url); the SDK retries with backoff."""
+    key = (api_key, base_url)
+    with _lock:
+        client = _openai_clients.get(key)
+        if client is None:
+            import httpx
+            from openai import OpenAI
+
+            client = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                timeout=httpx.Timeout(PROVIDER_TIMEOUT, connect=PROVIDER_CONNECT_TIMEOUT),
+                max_retries=PROVIDER_MAX_RETRIES,
+                http_client=httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=PROVIDER_POOL_SIZE,
+                        max_keepalive_connections=PROVIDER_POOL_SIZE,
+                    ),
+                ),
+            )
+            _openai_clients[key] = client
+        return client
+
+
+def _semaphore(provider: str) -> threading.BoundedSemaphore:
+    with _lock:
+        sem = _semaphores.get(provider)
+        if sem is None:
+            n = int(os.getenv(f"{provider.upper()}_MAX_CONCURRENCY") or _DEFAULT_CONCURRENCY.get(provider, 8))
+            sem = _semaphores[provider] = threading.BoundedSemaphore(n)
+        return sem
+
+
+@contextmanager
+def limit(provider: str):
+    """Hold one of the provider's concurrency slots for the duration of a call."""
+    sem = _semaphore(provider)
+    sem.acquire()
+    try:
+        yield
+    finally:
+        sem.release()
+
+
+class ProviderHealth:
+    """Circuit breaker and latency EWMA for one provider."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.successes = 0
+        self.failures = 0
+        self.skipped = 0
+        self.latency_ewma_ms = None
+        self.opened_at = None
+        self.last_error = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        """True while calls are being skipped (no probe slot is consumed)."""
+        with self._lock:
+            return self.state == "open" and time.monotonic() - self.opened_at < CIRCUIT_COOLDOWN
+
+    def allow(self) -> bool:
+        """Whether a call may go out now; after the cooldown one probe is let through."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= CIRCUIT_COOLDOWN:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            self.skipped += 1
+            return False
+
+    def _observe(self, latency: float):
+        ms = latency * 1000
+        if self.latency_ewma_ms is None:
+            self.latency_ewma_ms = ms
+        else:
+            self.latency_ewma_ms += LATENCY_EWMA_ALPHA * (ms - self.latency_ewma_ms)
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self._observe(latency)
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.state = "closed"
+            self._probing = False
+
+    def record_failure(self, error: str, latency: float):
+        with self._lock:
+            self._observe(latency)
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = error
+            if self.state == "half_open" or self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            retry_in = None
+            if self.state == "open":
+                retry_in = max(0.0, round(CIRCUIT_COOLDOWN - (time.monotonic() - self.opened_at), 1))
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "successes": self.successes,
+                "failures": self.failures,
+                "skipped": self.skipped,
+                "latency_ewma_ms": round(self.latency_ewma_ms, 1) if self.latency_ewma_ms is not None else None,
+                "retry_in_seconds": retry_in,
+                "last_error": self.last_error,
+            }
+
+
+def health(provider: str) -> ProviderHealth:
+    with _lock:
+        h = _health.get(provider)
+        if h is None:
+            h = _health[provider] = ProviderHealth(provider)
+        return h
+
+
+def call(provider: str, fn):
+    """Run fn() -> (result, error) through the provider's circuit breaker.
+
+    Returns (None, None) without calling fn while the circuit is open.
+    """
+    h = health(provider)
+    if not h.allow():
+        return None, None
+    started = time.perf_counter()
+    try:
+        result, error = fn()
+    except Exception as e:
+        result, error = None, str(e)
+    elapsed = time.perf_counter() - started
+    if result is not None:
+        h.record_success(elapsed)
+    else:
+        h.record_failure(error or "no result", elapsed)
+    metrics.PROVIDER_SECONDS.observe(elapsed, provider=provider, outcome="ok" if result is not None else "error")
+    return result, error
+
+
+def first_success(attempts: list, hedge_after: float = 0.0):
+    """Try (provider, fn) attempts in order, hedging after hedge_after seconds if set.
+    Returns (result, provider, last_error)."""
+    last_error = None
+    if not hedge_after:
+        for provider, fn in attempts:
+            result, error = call(provider, fn)
+            if result is not None:
+                return result, provider, last_error
+            last_error = error or last_error
+        return None, None, last_error
+
+    queue = list(attempts)
+    pending = {}
+
+    def launch():
+        provider, fn = queue.pop(0)
+        ctx = contextvars.copy_context()
+        pending[_hedge_pool.submit(ctx.run, call, provider, fn)] = provider
+
+    while queue or pending:
+        if queue and not pending:
+            launch()
+        done, _ = wait(pending, timeout=hedge_after if queue else None, return_when=FIRST_COMPLETED)
+        if not done:
+            launch()
+            continue
+        for future in done:
+            provider = pending.pop(future)
+            result, error = future.result()
+            if result is not None:
+                return result, provider, last_error
+            last_error = error or last_error
+    return None, None, last_error
+
+
+def status() -> dict:
+    """Configuration flags (never values) and breaker state per provider."""
+    configured = {
+        "triton": bool(os.getenv("TRITON_API_KEY") and os.getenv("TRITON_API_URL")),
+        "openai": bool(os.getenv("OPENAI_API_KEY") or os.getenv("TRITON_API_KEY")),
+        "llm": bool((os.getenv("TRITON_API_KEY") or os.getenv("OPENAI_API_KEY")) and os.getenv("OPENAI_API_BASE")),
+    }
+    with _lock:
+        names = set(configured) | set(_health)
+    return {
+        name: {"configured": configured.get(name, True), **health(name).snapshot()}
+        for name in sorted(names)
+    }
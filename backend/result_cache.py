@@ -0,0 +1,254 @@
+"""Response cache for /analyze, /cluster and /correlate, invalidated by ingest.
+Entries depend on (service, hour) buckets that ingest NOTIFYs on commit to every process."""
+import json
+import logging
+import os
+import select
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+from cache import LRUCache
+from db import engine
+import vector_store
+
+logger = logging.getLogger(__name__)
+
+# Cached responses; 0 disables the cache (and the listener)
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "512"))
+RESULT_CACHE_CHANNEL = os.getenv("RESULT_CACHE_CHANNEL", "result_cache")
+# LISTEN needs a session-level connection: set this to a direct connection URL
+# when DATABASE_URL goes through a transaction-mode pooler (e.g. PgBouncer)
+RESULT_CACHE_LISTEN_URL = os.getenv("RESULT_CACHE_LISTEN_URL", "")
+# (service, hour) buckets remembered per service before they are collapsed
+# into a single "changed at some time" generation
+RESULT_CACHE_MAX_BUCKETS = int(os.getenv("RESULT_CACHE_MAX_BUCKETS", "10000"))
+
+_EPOCH = datetime(1970, 1, 1)
+# NOTIFY payloads must stay below 8000 bytes
+_MAX_PAYLOAD = 7900
+
+_entries = LRUCache(RESULT_CACHE_SIZE)
+_lock = threading.Lock()
+_generation = 0
+# (kind, service or None for "any service") -> {"seq", "any_hour", "hours": {hour: seq}}
+_changes = {}
+_counters = {"hits": 0, "misses": 0, "stale": 0, "notifications": 0, "reconnects": 0}
+_listening = threading.Event()
+_listener = None
+
+
+def _hour(ts: datetime) -> int:
+    if ts.tzinfo:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return (ts - _EPOCH) // timedelta(hours=1)
+
+
+def key(endpoint: str, params: dict) -> str:
+    """Cache key from an endpoint name and its (JSON-able) request parameters."""
+    normalized = {
+        k: " ".join(v.split()) if isinstance(v, str) else v
+        for k, v in params.items()
+    }
+    return endpoint + ":" + json.dumps(normalized, sort_keys=True, default=str)
+
+
+def logs_dep(service: str | None = None, start: datetime | None = None, end: datetime | None = None) -> tuple:
+    """Dependency on logs of one service (None: any) within [start, end]."""
+    return ("logs", service, _hour(start) if start else None, _hour(end) if end else None)
+
+
+def deployments_dep(service: str | None = None) -> tuple:
+    return ("deployments", service, None, None)
+
+
+def generation() -> int:
+    """Take this before computing a response and pass it to put()."""
+    return _generation
+
+
+def _changed_since(dep: tuple, seq: int) -> bool:
+    kind, service, lo, hi = dep
+    state = _changes.get((kind, service))
+    if state is None or state["seq"] <= seq:
+        return False
+    if state["any_hour"] > seq or (lo is None and hi is None):
+        return True
+    return any(
+        changed > seq and (lo is None or hour >= lo) and (hi is None or hour <= hi)
+        for hour, changed in state["hours"].items()
+    )
+
+
+def get(cache_key: str):
+    """The cached response, or None when missing or invalidated since it was stored."""
+    if not _listening.is_set():
+        return None
+    entry = _entries.get(cache_key)
+    with _lock:
+        if entry is None:
+            _counters["misses"] += 1
+            return None
+        value, seq, deps = entry
+        if any(_changed_since(dep, seq) for dep in deps):
+            _counters["stale"] += 1
+            _counters["misses"] += 1
+            _entries.pop(cache_key)
+            return None
+        _counters["hits"] += 1
+        return value
+
+
+def put(cache_key: str, value, seq: int, deps: list):
+    """Store a response computed from data as of generation seq."""
+    if _listening.is_set():
+        _entries.set(cache_key, (value, seq, deps))
+
+
+def _bump(kind: str, service: str | None, hours: list | None):
+    """Record a change; hours None means the change may cover any time."""
+    global _generation
+    _generation += 1
+    for scope in {service, None}:
+        state = _changes.setdefault((kind, scope), {"seq": 0, "any_hour": 0, "hours": {}})
+        state["seq"] = _generation
+        if hours is None or len(state["hours"]) + len(hours) > RESULT_CACHE_MAX_BUCKETS:
+            state["any_hour"] = _generation
+            state["hours"].clear()
+        else:
+            for hour in hours:
+                state["hours"][hour] = _generation
+
+
+def _apply(payload: dict):
+    if payload.get("all"):
+        invalidate_local()
+        return
+    if payload.get("logs"):
+        # Rows committed by worker processes: the NumPy store catches up on its next search
+        vector_store.mark_dirty()
+    with _lock:
+        _counters["notifications"] += 1
+        for kind in ("logs", "deployments"):
+            for service, hours in (payload.get(kind) or {}).items():
+                _bump(kind, service or None, hours)
+
+
+def invalidate_local():
+    """Drop every entry in this process; logs may have been deleted, so the vector store re-checks too."""
+    global _generation
+    vector_store.mark_stale()
+    with _lock:
+        _counters["notifications"] += 1
+        _generation += 1
+        _changes.clear()
+        _entries.clear()
+
+
+def _message(payload: dict) -> str:
+    message = json.dumps(payload, separators=(",", ":"))
+    if len(message) > _MAX_PAYLOAD:
+        # Too many buckets: widen to whole services, then to everything
+        payload = {kind: {s: None for s in services} for kind, services in payload.items()}
+        message = json.dumps(payload, separators=(",", ":"))
+        if len(message) > _MAX_PAYLOAD:
+            message = '{"all":true}'
+    return message
+
+
+def record_batch(cursor, rows: list):
+    """Announce an ingest batch (log dicts) on the caller's cursor/transaction."""
+    services = {}
+    for r in rows:
+        if r["timestamp"]:
+            services.setdefault(r["service"] or "", set()).add(_hour(r["timestamp"]))
+    if services:
+        message = _message({"logs": {s: sorted(hours) for s, hours in services.items()}})
+        cursor.execute("SELECT pg_notify(%s, %s)", (RESULT_CACHE_CHANNEL, message))
+
+
+def notify_deployments(conn, services):
+    """Announce inserted deployments on the caller's connection/transaction."""
+    services = set(services)
+    if services:
+        conn.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": RESULT_CACHE_CHANNEL, "payload": _message({"deployments": {s: None for s in services}})},
+        )
+
+
+def notify_all():
+    """Invalidate every process's cache (after logs were rewritten or deleted)."""
+    # Reaches this process even when the listener is off
+    vector_store.mark_stale()
+    with engine.begin() as conn:
+        conn.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": RESULT_CACHE_CHANNEL, "payload": '{"all":true}'},
+        )
+
+
+def _listen_connection():
+    source = create_engine(RESULT_CACHE_LISTEN_URL, poolclass=NullPool) if RESULT_CACHE_LISTEN_URL else engine
+    raw = source.raw_connection()
+    conn = raw.driver_connection
+    raw.detach()  # held for the life of the listener, not returned to the pool
+    conn.autocommit = True
+    conn.cursor().execute(f'LISTEN "{RESULT_CACHE_CHANNEL}"')
+    return conn
+
+
+def _listen():
+    while True:
+        conn = None
+        try:
+            conn = _listen_connection()
+            # Anything may have changed while no one was listening
+            invalidate_local()
+            _listening.set()
+            while True:
+                if select.select([conn], [], [], 30) == ([], [], []):
+                    conn.cursor().execute("SELECT 1")  # notice a dead connection
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    try:
+                        _apply(json.loads(conn.notifies.pop(0).payload))
+                    except ValueError:
+                        invalidate_local()
+        except Exception:
+            logger.exception("Result cache listener failed; bypassing the cache until it reconnects")
+        finally:
+            _listening.clear()
+            with _lock:
+                _counters["reconnects"] += 1
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        time.sleep(5)
+
+
+def start_listener():
+    """Start the invalidation listener; until it is connected nothing is cached."""
+    global _listener
+    if RESULT_CACHE_SIZE > 0 and _listener is None:
+        _listener = threading.Thread(target=_listen, name="result-cache-listener", daemon=True)
+        _listener.start()
+
+
+def stats() -> dict:
+    with _lock:
+        counters = dict(_counters)
+    lookups = counters["hits"] + counters["misses"]
+    return {
+        "size": len(_entries),
+        "maxsize": RESULT_CACHE_SIZE,
+        "evictions": _entries.evictions,
+        **counters,
+        "hit_rate": round(counters["hits"] / lookups, 4) if lookups else None,
+        "generation": _generation,
+        "listening": _listening.is_set(),
+    }
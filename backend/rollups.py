@@ -0,0 +1,141 @@
+"""Log counts per (service, level, minute) and per hour, updated in each ingest transaction."""
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text
+from psycopg2.extras import execute_values
+from db import engine
+
+ERROR_LEVELS = ("ERROR", "FATAL", "CRITICAL")
+
+# Upper bound on points in one /rollups/error-rate response
+ROLLUP_MAX_POINTS = int(os.getenv("ROLLUP_MAX_POINTS", "10000"))
+# Spans longer than this are served from the hourly rollup unless a bucket is given
+ROLLUP_MINUTE_MAX_SPAN_HOURS = int(os.getenv("ROLLUP_MINUTE_MAX_SPAN_HOURS", "48"))
+
+# bucket -> (table, time column, step)
+_TABLES = {
+    "minute": ("log_counts_minute", "minute", timedelta(minutes=1)),
+    "hour": ("log_counts_hour", "hour", timedelta(hours=1)),
+}
+
+
+def _truncate(ts: datetime, bucket: str) -> datetime:
+    ts = ts.replace(second=0, microsecond=0)
+    return ts.replace(minute=0) if bucket == "hour" else ts
+
+
+def _upsert(cursor, bucket: str, counts: Counter):
+    table, column, _ = _TABLES[bucket]
+    # Sorted keys make concurrent ingests lock rollup rows in the same order
+    execute_values(
+        cursor,
+        f"INSERT INTO {table} (service, level, {column}, count) VALUES %s "
+        f"ON CONFLICT (service, level, {column}) DO UPDATE SET count = {table}.count + EXCLUDED.count",
+        [(service, level, ts, n) for (service, level, ts), n in sorted(counts.items())],
+        page_size=len(counts),
+    )
+
+
+def record_batch(cursor, rows: list):
+    """Add one batch of log dicts to the rollups on the caller's cursor/transaction."""
+    minutes = Counter(
+        (r["service"], r["level"], _truncate(r["timestamp"], "minute"))
+        for r in rows if r["service"] and r["level"] and r["timestamp"]
+    )
+    if not minutes:
+        return
+    hours = Counter()
+    for (service, level, minute), n in minutes.items():
+        hours[(service, level, _truncate(minute, "hour"))] += n
+    _upsert(cursor, "minute", minutes)
+    _upsert(cursor, "hour", hours)
+
+
+def rebuild(only_if_empty: bool = False) -> dict:
+    """Recompute the rollups from logs; with only_if_empty, leave non-empty rollups alone."""
+    with engine.begin() as conn:
+        conn.execute(text("LOCK TABLE log_counts_minute, log_counts_hour IN EXCLUSIVE MODE"))
+        if only_if_empty and conn.execute(text("SELECT 1 FROM log_counts_minute LIMIT 1")).scalar():
+            return {"status": "skipped"}
+        conn.execute(text("TRUNCATE log_counts_minute, log_counts_hour"))
+        minute_rows = conn.execute(text("""
+            INSERT INTO log_counts_minute (service, level, minute, count)
+            SELECT service, level, date_trunc('minute', timestamp), count(*)
+            FROM logs
+            WHERE timestamp IS NOT NULL AND service IS NOT NULL AND level IS NOT NULL
+            GROUP BY 1, 2, 3
+        """)).rowcount
+        hour_rows = conn.execute(text("""
+            INSERT INTO log_counts_hour (service, level, hour, count)
+            SELECT service, level, date_trunc('hour', minute), sum(count)
+            FROM log_counts_minute
+            GROUP BY 1, 2, 3
+        """)).rowcount
+    return {"status": "rebuilt", "minute_rows": minute_rows, "hour_rows": hour_rows}
+
+
+def error_rate_series(
+    service: str | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    bucket: str | None = None,
+) -> dict:
+    """Error and total counts per bucket between start and end, zero-filled.
+    Defaults to the last 24 hours across all services."""
+    # Rollup buckets are naive UTC, like logs.timestamp
+    start, end = (ts.astimezone(timezone.utc).replace(tzinfo=None) if ts and ts.tzinfo else ts for ts in (start, end))
+    end = end or datetime.now(timezone.utc).replace(tzinfo=None)
+    start = start or end - timedelta(hours=24)
+    if start > end:
+        raise ValueError("start must not be after end")
+    if bucket is None:
+        bucket = "hour" if end - start > timedelta(hours=ROLLUP_MINUTE_MAX_SPAN_HOURS) else "minute"
+    if bucket not in _TABLES:
+        raise ValueError(f"Unknown bucket {bucket!r}; expected one of {sorted(_TABLES)}")
+    table, column, step = _TABLES[bucket]
+    start, end = _truncate(start, bucket), _truncate(end, bucket)
+    points = int((end - start) / step) + 1
+    if points > ROLLUP_MAX_POINTS:
+        raise ValueError(f"{points} {bucket} buckets requested; the limit is {ROLLUP_MAX_POINTS}")
+
+    service_sql = "AND c.service = :service" if service else ""
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(f"""
+            SELECT b.bucket,
+                   coalesce(sum(c.count) FILTER (WHERE c.level = ANY(:error_levels)), 0)::bigint AS errors,
+                   coalesce(sum(c.count), 0)::bigint AS total
+            FROM generate_series(CAST(:start AS timestamp), CAST(:end AS timestamp), CAST(:step AS interval)) AS b(bucket)
+            LEFT JOIN {table} c ON c.{column} = b.bucket {service_sql}
+            GROUP BY b.bucket
+            ORDER BY b.bucket
+            """),
+            {"start": start, "end": end, "step": f"1 {bucket}", "service": service,
+             "error_levels": list(ERROR_LEVELS)},
+        ).fetchall()
+
+    series = [
+        {"bucket": r.bucket, "errors": r.errors, "total": r.total,
+         "error_rate": round(r.errors / r.total, 4) if r.total else None}
+        for r in rows
+    ]
+    return {"service": service, "bucket": bucket, "start": start, "end": end, "points": series}
+
+
+def totals() -> dict:
+    """Logs and error-level logs ingested so far, overall and per service, from the hourly rollup."""
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("""
+            SELECT service, sum(count)::bigint AS total,
+                   coalesce(sum(count) FILTER (WHERE level = ANY(:error_levels)), 0)::bigint AS errors
+            FROM log_counts_hour GROUP BY service ORDER BY service
+            """),
+            {"error_levels": list(ERROR_LEVELS)},
+        ).fetchall()
+    return {
+        "logs": sum(r.total for r in rows),
+        "errors": sum(r.errors for r in rows),
+        "services": {r.service: {"logs": r.total, "errors": r.errors} for r in rows},
+    }
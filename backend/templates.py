@@ -0,0 +1,498 @@
+"""Streaming log template mining (Drain, He et al., ICWS 2017) and the `log_templates` table.
+Mining is opt-in (LOG_TEMPLATES) because every line of a template is embedded as the template text."""
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from sqlalchemy import text
+from pgvector import Vector
+from psycopg2.extras import execute_values
+import embeddings
+from db import engine
+from embedding_cache import embed_batch_cached, embed_cached
+
+# Off by default: lines of one template share its vector, so search cannot tell them apart
+LOG_TEMPLATES = os.getenv("LOG_TEMPLATES", "false").lower() in ("1", "true", "yes")
+TEMPLATE_SIM_THRESHOLD = float(os.getenv("TEMPLATE_SIM_THRESHOLD", "0.4"))
+TEMPLATE_TREE_DEPTH = int(os.getenv("TEMPLATE_TREE_DEPTH", "4"))
+TEMPLATE_MAX_CHILDREN = int(os.getenv("TEMPLATE_MAX_CHILDREN", "100"))
+TEMPLATE_REFRESH_SECONDS = float(os.getenv("TEMPLATE_REFRESH_SECONDS", "300"))
+# Delay before logs of changed templates are re-pointed and re-embedded, so
+# batches mined before the change have committed by then
+TEMPLATE_RELINK_DELAY = float(os.getenv("TEMPLATE_RELINK_DELAY", "60"))
+
+WILDCARD = "<*>"
+
+# Variable parts masked before tokens are compared; none of them match whitespace,
+# so masking never changes the number of tokens
+_MASKS = [
+    re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"),
+    re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b"),
+    re.compile(r"\b0x[0-9a-fA-F]+\b"),
+    re.compile(r"\b(?=[0-9a-fA-F]*\d)[0-9a-fA-F]{12,}\b"),
+    re.compile(r"(?<![A-Za-z0-9])[-+]?\d+(?:\.\d+)?(?![A-Za-z0-9])"),
+]
+
+_lock = threading.Lock()
+_miner = None
+# Read-only copy for normalize(); replaced whole, never mutated
+_snapshot_lock = threading.Lock()
+_snapshot = None
+_loaded_at = 0.0
+# max(log_templates.revision) the miner was synced to; mining (serialized across
+# processes by an advisory lock) reloads the tree when another process moved it
+_revision = None
+
+
+def mask(message: str) -> str:
+    for pattern in _MASKS:
+        message = pattern.sub(WILDCARD, message)
+    return message
+
+
+class Template:
+    __slots__ = ("id", "tokens", "stored", "embedded")
+
+    def __init__(self, tokens: list, id: int | None = None, embedded: bool = False):
+        self.id = id
+        self.tokens = tokens
+        # Text as last written to log_templates (None until inserted)
+        self.stored = " ".join(tokens) if id is not None else None
+        self.embedded = embedded
+
+    @property
+    def text(self) -> str:
+        return " ".join(self.tokens)
+
+
+class _Node:
+    __slots__ = ("children", "templates")
+
+    def __init__(self):
+        self.children = {}
+        self.templates = []
+
+
+def _route_key(token: str) -> str:
+    return WILDCARD if WILDCARD in token or any(c.isdigit() for c in token) else token
+
+
+class TemplateMiner:
+    def __init__(self, sim_threshold: float | None = None, depth: int | None = None, max_children: int | None = None):
+        self.sim_threshold = TEMPLATE_SIM_THRESHOLD if sim_threshold is None else sim_threshold
+        self.depth = max(TEMPLATE_TREE_DEPTH if depth is None else depth, 3)
+        self.max_children = max_children or TEMPLATE_MAX_CHILDREN
+        self._root = {}
+
+    def _leaf(self, tokens: list, create: bool) -> _Node | None:
+        node = self._root.get(len(tokens))
+        if node is None:
+            if not create:
+                return None
+            node = self._root[len(tokens)] = _Node()
+        for token in tokens[:self.depth - 2]:
+            key = _route_key(token)
+            child = node.children.get(key)
+            if child is None:
+                # A full node sends everything else down its wildcard branch
+                if key != WILDCARD and len(node.children) >= self.max_children:
+                    key = WILDCARD
+                    child = node.children.get(key)
+                if child is None:
+                    if not create:
+                        return None
+                    child = node.children[key] = _Node()
+            node = child
+        return node
+
+    def _best(self, leaf: _Node, tokens: list) -> Template | None:
+        best, best_key = None, None
+        for template in leaf.templates:
+            same = wildcards = 0
+            for t, token in zip(template.tokens, tokens):
+                if t == WILDCARD:
+                    wildcards += 1
+                elif t == token:
+                    same += 1
+            sim = same / len(tokens) if tokens else 1.0
+            if sim >= self.sim_threshold and (best_key is None or (sim, wildcards) > best_key):
+                best, best_key = template, (sim, wildcards)
+        return best
+
+    def load(self, template: Template):
+        self._leaf(template.tokens, create=True).templates.append(template)
+
+    def match(self, tokens: list) -> Template | None:
+        leaf = self._leaf(tokens, create=False)
+        return self._best(leaf, tokens) if leaf else None
+
+    def add(self, tokens: list) -> Template:
+        """Template for tokens, generalizing the closest one or starting a new one."""
+        leaf = self._leaf(tokens, create=True)
+        template = self._best(leaf, tokens)
+        if template is None:
+            template = Template(list(tokens))
+            leaf.templates.append(template)
+        elif template.tokens != tokens:
+            template.tokens = [t if t == token else WILDCARD for t, token in zip(template.tokens, tokens)]
+        return template
+
+
+def _params(tokens: list, template: Template) -> list:
+    """The original tokens at the positions the template abstracts."""
+    return [token for token, t in zip(tokens, template.tokens) if t != token]
+
+
+def _load(conn) -> TemplateMiner:
+    miner = TemplateMiner()
+    rows = conn.execute(
+        text("""
+        SELECT id, template,
+               embedding IS NOT NULL AND vector_dims(embedding) = :dim AS embedded
+        FROM log_templates ORDER BY id
+        """),
+        {"dim": embeddings.EMBEDDING_DIM},
+    ).fetchall()
+    for r in rows:
+        miner.load(Template(r.template.split(), id=r.id, embedded=r.embedded))
+    return miner
+
+
+def _get_snapshot() -> TemplateMiner:
+    """The query-side tree, reloaded from the table when it is older than the refresh interval."""
+    global _snapshot, _loaded_at
+    with _snapshot_lock:
+        if _snapshot is None or time.monotonic() - _loaded_at > TEMPLATE_REFRESH_SECONDS:
+            with engine.connect() as conn:
+                _snapshot = _load(conn)
+            _loaded_at = time.monotonic()
+        return _snapshot
+
+
+def _current_revision(conn) -> int:
+    return conn.execute(text("SELECT coalesce(max(revision), 0) FROM log_templates")).scalar()
+
+
+def _sync_miner(conn) -> TemplateMiner:
+    """The process's miner, reloaded when another process changed log_templates since it last mined."""
+    global _miner, _revision
+    revision = _current_revision(conn)
+    if _miner is None or revision != _revision:
+        _miner = _load(conn)
+        _revision = revision
+    return _miner
+
+
+def _insert(cursor, new: list) -> bool:
+    """Insert new templates; True when some text already had a row or appeared twice."""
+    by_text = {t.text: t for t in new}
+    rows = execute_values(
+        cursor,
+        "INSERT INTO log_templates (template, token_count) VALUES %s "
+        "ON CONFLICT (md5(template)) DO UPDATE SET last_seen = log_templates.last_seen "
+        "RETURNING id, template, xmax = 0",
+        [(t.text, len(t.tokens)) for t in by_text.values()],
+        page_size=len(by_text),
+        fetch=True,
+    )
+    shared = len(by_text) < len(new)
+    for template_id, template_text, inserted in rows:
+        by_text[template_text].id = template_id
+        shared = shared or not inserted
+    for t in new:
+        t.id = by_text[t.text].id
+        t.stored = t.text
+    return shared
+
+
+def _merge(cursor, loser: int, winner: int):
+    """Fold template loser into winner: its logs, counts and time range."""
+    params = {"loser": loser, "winner": winner}
+    cursor.execute("UPDATE logs SET template_id = %(winner)s WHERE template_id = %(loser)s", params)
+    cursor.execute(
+        """
+        UPDATE log_templates w
+        SET count = w.count + l.count,
+            first_seen = least(w.first_seen, l.first_seen),
+            last_seen = greatest(w.last_seen, l.last_seen),
+            revision = nextval('log_templates_revision_seq')
+        FROM log_templates l
+        WHERE w.id = %(winner)s AND l.id = %(loser)s
+        """,
+        params,
+    )
+    cursor.execute("DELETE FROM log_templates WHERE id = %(loser)s", params)
+
+
+def _persist(conn, new: list, changed: list) -> tuple:
+    """Insert new and generalized templates on the caller's transaction, merging duplicates.
+    Returns (relink ids, {merged id: surviving id}, whether the tree must be reloaded)."""
+    cursor = conn.connection.cursor()
+    reload = _insert(cursor, new) if new else False
+    relink, merged = set(), {}
+    for t in changed:
+        cursor.execute(
+            """
+            UPDATE log_templates
+            SET template = %(text)s, token_count = %(n)s, revision = nextval('log_templates_revision_seq')
+            WHERE id = %(id)s
+              AND NOT EXISTS (SELECT 1 FROM log_templates WHERE md5(template) = md5(%(text)s))
+            RETURNING count
+            """,
+            {"id": t.id, "text": t.text, "n": len(t.tokens)},
+        )
+        updated = cursor.fetchone()
+        if updated is not None:
+            if updated[0]:
+                relink.add(t.id)
+        else:
+            cursor.execute("SELECT id FROM log_templates WHERE md5(template) = md5(%s)", (t.text,))
+            winner = cursor.fetchone()
+            if winner is None:
+                # The row is gone (the table was reset): start the template over
+                t.id = None
+                _insert(cursor, [t])
+            elif winner[0] != t.id:
+                # Templates converged: keep the existing row and fold this one into it
+                _merge(cursor, t.id, winner[0])
+                merged[t.id] = winner[0]
+                relink.add(winner[0])
+                t.id = winner[0]
+            reload = True
+        t.stored = t.text
+        t.embedded = False
+    cursor.close()
+    return sorted(relink), merged, reload
+
+
+def _store_embeddings(templates: list, vectors: list, relink: list | None = None, merged: dict | None = None):
+    """Store template vectors; with relink/merged, also queue the template_logs job for their logs."""
+    with engine.begin() as conn:
+        if templates:
+            cursor = conn.connection.cursor()
+            execute_values(
+                cursor,
+                "UPDATE log_templates SET embedding = v.embedding FROM (VALUES %s) AS v(id, embedding) "
+                "WHERE log_templates.id = v.id",
+                [(t.id, Vector(vec)) for t, vec in zip(templates, vectors)],
+                template="(%s, %s::vector)",
+                page_size=len(templates),
+            )
+            cursor.close()
+        if relink or merged:
+            # Queued in the same transaction as the vectors it copies
+            conn.execute(
+                text("""
+                INSERT INTO ingest_jobs (kind, payload, run_after)
+                VALUES ('template_logs', CAST(:payload AS jsonb), now() + make_interval(secs => :delay))
+                """),
+                {
+                    "payload": json.dumps({"template_ids": relink or [], "merged": merged or {}}),
+                    "delay": TEMPLATE_RELINK_DELAY,
+                },
+            )
+    for t in templates:
+        t.embedded = True
+
+
+def mine_batch(rows: list):
+    """Set template_id, params and the template's embedding on each log dict, embedding each template once."""
+    global _miner, _revision
+    relink, merged = [], {}
+    with _lock:
+        try:
+            with engine.begin() as conn:
+                # One miner at a time across processes, each first catching up with the others
+                conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('log_templates'))"))
+                miner = _sync_miner(conn)
+                mined = []
+                for row in rows:
+                    tokens = (row["message"] or "").split()
+                    mined.append((row, tokens, miner.add(mask(" ".join(tokens)).split())))
+                templates = list({id(t): t for _, _, t in mined}.values())
+                new = [t for t in templates if t.id is None]
+                changed = [t for t in templates if t.id is not None and t.stored != t.text]
+                reload = False
+                if new or changed:
+                    relink, merged, reload = _persist(conn, new, changed)
+                _revision = _current_revision(conn)
+            if reload:
+                _miner = None
+        except BaseException:
+            # The tree already holds this batch's changes; the table does not
+            _miner = None
+            raise
+        texts = [t.text for t in templates]
+        for row, tokens, template in mined:
+            row["template_id"] = template.id
+            row["params"] = _params(tokens, template)
+
+    # Outside the lock: provider calls must not serialize concurrent ingests
+    vectors = embed_batch_cached(texts)
+    stale = [(t, v) for t, v in zip(templates, vectors) if not t.embedded]
+    if stale or relink or merged:
+        _store_embeddings([t for t, _ in stale], [v for _, v in stale], relink=relink, merged=merged)
+    by_template = {id(t): v for t, v in zip(templates, vectors)}
+    return [by_template[id(template)] for _, _, template in mined]
+
+
+def record_batch(cursor, rows: list):
+    """Add inserted log dicts to their templates' counts on the caller's transaction."""
+    counts = Counter(r["template_id"] for r in rows if r.get("template_id") is not None)
+    if not counts:
+        return
+    seen = {}
+    for r in rows:
+        if r.get("template_id") is not None and r["timestamp"]:
+            first, last = seen.get(r["template_id"], (r["timestamp"], r["timestamp"]))
+            seen[r["template_id"]] = (min(first, r["timestamp"]), max(last, r["timestamp"]))
+    # Sorted ids make concurrent ingests lock template rows in the same order
+    execute_values(
+        cursor,
+        "UPDATE log_templates SET count = count + v.n, "
+        "first_seen = least(log_templates.first_seen, v.first_seen), "
+        "last_seen = greatest(log_templates.last_seen, v.last_seen) "
+        "FROM (VALUES %s) AS v(id, n, first_seen, last_seen) WHERE log_templates.id = v.id",
+        [(template_id, n, *seen.get(template_id, (None, None))) for template_id, n in sorted(counts.items())],
+        template="(%s, %s, %s::timestamp, %s::timestamp)",
+        page_size=len(counts),
+    )
+
+
+def normalize(query: str) -> str:
+    """Text to embed for a search query: its template when one matches, else the masked query."""
+    if not LOG_TEMPLATES:
+        return query
+    tokens = mask(query).split()
+    template = _get_snapshot().match(tokens)
+    return template.text if template else " ".join(tokens)
+
+
+def list_templates(limit: int = 100, service: str | None = None, level: str | None = None) -> list:
+    """Templates by number of logs, optionally counted within a service and/or level."""
+    with engine.connect() as conn:
+        if not service and not level:
+            rows = conn.execute(
+                text("""
+                SELECT id AS template_id, template, count, first_seen, last_seen
+                FROM log_templates ORDER BY count DESC, id LIMIT :limit
+                """),
+                {"limit": limit},
+            ).fetchall()
+        else:
+            filters = " AND ".join(f for f, v in (("l.service = :service", service), ("l.level = :level", level)) if v)
+            rows = conn.execute(
+                text(f"""
+                SELECT t.id AS template_id, t.template, count(*) AS count,
+                       min(l.timestamp) AS first_seen, max(l.timestamp) AS last_seen
+                FROM logs l JOIN log_templates t ON t.id = l.template_id
+                WHERE {filters}
+                GROUP BY t.id, t.template
+                ORDER BY count DESC, t.id
+                LIMIT :limit
+                """),
+                {"limit": limit, "service": service, "level": level},
+            ).fetchall()
+    return [dict(r._mapping) for r in rows]
+
+
+def search_templates(query: str, limit: int = 10) -> list:
+    """Templates nearest to the query, each with its count and latest log (exact scan, no ANN index)."""
+    vector = embed_cached(normalize(query))
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("""
+            SELECT t.id AS template_id, t.template, t.count, t.last_seen,
+                   t.embedding <=> CAST(:embedding AS vector) AS distance,
+                   l.message AS latest_message, l.service AS latest_service, l.level AS latest_level
+            FROM log_templates t
+            LEFT JOIN LATERAL (
+                SELECT message, service, level FROM logs
+                WHERE template_id = t.id ORDER BY timestamp DESC LIMIT 1
+            ) l ON true
+            WHERE t.embedding IS NOT NULL AND vector_dims(t.embedding) = :dim
+            ORDER BY distance
+            LIMIT :limit
+            """),
+            {"embedding": Vector(vector), "dim": len(vector), "limit": limit},
+        ).fetchall()
+    return [dict(r._mapping) for r in rows]
+
+
+def rebuild_counts(template_ids: list | None = None) -> int:
+    """Recount logs per template (all, or just template_ids), e.g. after duplicates were deleted."""
+    only = "AND template_id = ANY(:ids)" if template_ids is not None else ""
+    with engine.begin() as conn:
+        return conn.execute(
+            text(f"""
+            UPDATE log_templates t
+            SET count = coalesce(c.n, 0), first_seen = c.first_seen, last_seen = c.last_seen
+            FROM log_templates t2
+            LEFT JOIN (
+                SELECT template_id, count(*) AS n, min(timestamp) AS first_seen, max(timestamp) AS last_seen
+                FROM logs WHERE template_id IS NOT NULL {only} GROUP BY template_id
+            ) c ON c.template_id = t2.id
+            WHERE t.id = t2.id {"AND t2.id = ANY(:ids)" if template_ids is not None else ""}
+            """),
+            {"ids": template_ids},
+        ).rowcount
+
+
+def relink_logs(template_ids: list, merged: dict | None = None, start: int = 0, on_template=None) -> int:
+    """Re-point logs of merged templates and copy each changed template's vector onto its logs.
+    on_template(position + 1, rows) runs after each template. Returns the number of logs updated."""
+    merged = {int(loser): winner for loser, winner in (merged or {}).items()}
+    if merged:
+        with engine.begin() as conn:
+            moved = conn.execute(
+                text("""
+                UPDATE logs SET template_id = m.winner
+                FROM unnest(CAST(:losers AS int[]), CAST(:winners AS int[])) AS m(loser, winner)
+                WHERE logs.template_id = m.loser
+                """),
+                {"losers": list(merged), "winners": list(merged.values())},
+            ).rowcount
+        if moved:
+            rebuild_counts(sorted(set(merged.values())))
+    updated = 0
+    for position in range(start, len(template_ids)):
+        with engine.begin() as conn:
+            rows = conn.execute(
+                text("""
+                UPDATE logs SET embedding = t.embedding
+                FROM log_templates t
+                WHERE t.id = :id AND logs.template_id = t.id
+                  AND t.embedding IS NOT NULL AND vector_dims(t.embedding) = :dim
+                """),
+                {"id": template_ids[position], "dim": embeddings.EMBEDDING_DIM},
+            ).rowcount
+        updated += rows
+        if on_template:
+            on_template(position + 1, rows)
+    return updated
+
+
+def refresh_embeddings(batch_size: int = 500) -> int:
+    """Embed templates that have no vector at the current logs.embedding dimension."""
+    global _miner
+    refreshed = 0
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                text("""
+                SELECT id, template FROM log_templates
+                WHERE embedding IS NULL OR vector_dims(embedding) <> :dim
+                ORDER BY id LIMIT :limit
+                """),
+                {"dim": embeddings.EMBEDDING_DIM, "limit": batch_size},
+            ).fetchall()
+        if not rows:
+            break
+        vectors = embed_batch_cached([r.template for r in rows])
+        _store_embeddings([Template(r.template.split(), id=r.id) for r in rows], vectors)
+        refreshed += len(rows)
+    with _lock:
+        _miner = None
+    return refreshed
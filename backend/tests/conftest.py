@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules under backend/ import each other by flat name, as in the app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from analyzer import fit_clusters
+
+
+@pytest.fixture
+def X():
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(4, 16)) * 10
+    return np.vstack([c + rng.normal(size=(50, 16)) for c in centers]).astype(np.float32)
+
+
+def test_full_fit_labels_every_row(X):
+    labels, model, pca = fit_clusters(X, 4)
+    assert len(labels) == len(X)
+    assert pca is None
+    assert len(set(labels)) == 4
+
+
+def test_sampled_fit_assigns_every_row(X):
+    labels, model, _ = fit_clusters(X, 4, sample_size=40)
+    assert len(labels) == len(X)
+    # Well separated blobs: each one lands in a single cluster
+    for blob in range(4):
+        assert len(set(labels[blob * 50:(blob + 1) * 50])) == 1
+
+
+@pytest.mark.parametrize("algorithm", ["kmeans", "minibatch"])
+def test_sample_smaller_than_k_is_raised_to_k(X, algorithm):
+    labels, model, _ = fit_clusters(X, 5, algorithm=algorithm, sample_size=2)
+    assert len(labels) == len(X)
+    assert model.cluster_centers_.shape[0] == 5
+
+
+def test_pca_is_fit_on_the_sample(X):
+    labels, _, pca = fit_clusters(X, 4, sample_size=60, pca_components=3)
+    assert pca.n_components_ == 3
+    assert len(labels) == len(X)
+
+
+def test_pca_components_capped_by_sampled_rows(X):
+    _, _, pca = fit_clusters(X, 4, sample_size=5, pca_components=8)
+    # sample_size is raised to k; PCA cannot have more components than rows
+    assert pca.n_components_ == 5
+
+
+def test_pca_not_applied_when_components_cover_the_dimension(X):
+    _, _, pca = fit_clusters(X, 4, pca_components=X.shape[1])
+    assert pca is None
+
+
+def test_sampling_is_deterministic(X):
+    first, _, _ = fit_clusters(X, 4, sample_size=40)
+    second, _, _ = fit_clusters(X, 4, sample_size=40)
+    assert (first == second).all()
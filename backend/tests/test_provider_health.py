@@ -0,0 +1,87 @@
+import pytest
+
+import providers
+from providers import ProviderHealth
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(providers.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(providers, "CIRCUIT_FAILURE_THRESHOLD", 3)
+    monkeypatch.setattr(providers, "CIRCUIT_COOLDOWN", 30.0)
+    return now
+
+
+def fail(h, n=1):
+    for _ in range(n):
+        h.record_failure("boom", 0.01)
+
+
+def test_opens_after_consecutive_failures(clock):
+    h = ProviderHealth("p")
+    fail(h, 2)
+    assert h.state == "closed" and h.allow()
+    fail(h)
+    assert h.state == "open"
+    assert h.is_open()
+    assert not h.allow()
+    assert h.snapshot()["skipped"] == 1
+
+
+def test_success_resets_the_failure_streak(clock):
+    h = ProviderHealth("p")
+    fail(h, 2)
+    h.record_success(0.01)
+    fail(h, 2)
+    assert h.state == "closed"
+
+
+def test_single_probe_after_cooldown(clock):
+    h = ProviderHealth("p")
+    fail(h, 3)
+    clock[0] += 30
+    assert not h.is_open()
+    assert h.allow()
+    assert h.state == "half_open"
+    # Only one probe at a time
+    assert not h.allow()
+
+
+def test_successful_probe_closes(clock):
+    h = ProviderHealth("p")
+    fail(h, 3)
+    clock[0] += 30
+    h.allow()
+    h.record_success(0.01)
+    assert h.state == "closed"
+    assert h.allow()
+
+
+def test_failed_probe_reopens_for_another_cooldown(clock):
+    h = ProviderHealth("p")
+    fail(h, 3)
+    clock[0] += 30
+    h.allow()
+    fail(h)
+    assert h.state == "open"
+    assert h.snapshot()["retry_in_seconds"] == 30.0
+    clock[0] += 29
+    assert not h.allow()
+
+
+def test_latency_ewma(clock, monkeypatch):
+    monkeypatch.setattr(providers, "LATENCY_EWMA_ALPHA", 0.5)
+    h = ProviderHealth("p")
+    h.record_success(0.100)
+    h.record_success(0.200)
+    assert h.snapshot()["latency_ewma_ms"] == 150.0
+
+
+def test_call_skips_fn_while_open(clock, monkeypatch):
+    monkeypatch.setattr(providers, "_health", {})
+    h = providers.health("test-provider")
+    fail(h, 3)
+    called = []
+    assert providers.call("test-provider", lambda: called.append(1) or ("x", None)) == (None, None)
+    assert not called
@@ -0,0 +1,98 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import result_cache
+from result_cache import _changed_since, _message, logs_dep
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(result_cache, "_changes", {})
+    monkeypatch.setattr(result_cache, "_generation", 0)
+    monkeypatch.setattr(result_cache.vector_store, "mark_dirty", lambda: None)
+    monkeypatch.setattr(result_cache.vector_store, "mark_stale", lambda: None)
+
+
+T0 = datetime(2024, 3, 1, 12, 0)
+H0 = result_cache._hour(T0)
+
+
+def test_nothing_changed():
+    assert not _changed_since(logs_dep("api", T0, T0 + timedelta(hours=2)), 0)
+
+
+def test_change_inside_the_window():
+    seq = result_cache.generation()
+    result_cache._bump("logs", "api", [H0 + 1])
+    assert _changed_since(logs_dep("api", T0, T0 + timedelta(hours=2)), seq)
+    # Any-service dependencies see it too
+    assert _changed_since(logs_dep(None, T0, T0 + timedelta(hours=2)), seq)
+
+
+def test_change_outside_the_window_or_service():
+    seq = result_cache.generation()
+    result_cache._bump("logs", "api", [H0 + 5])
+    assert not _changed_since(logs_dep("api", T0, T0 + timedelta(hours=2)), seq)
+    assert not _changed_since(logs_dep("db", T0, T0 + timedelta(hours=10)), seq)
+    assert not _changed_since(result_cache.deployments_dep("api"), seq)
+
+
+def test_entries_filled_after_the_change_stay_valid():
+    result_cache._bump("logs", "api", [H0])
+    assert not _changed_since(logs_dep("api", T0, T0), result_cache.generation())
+
+
+def test_open_ended_dependency_sees_any_hour():
+    seq = result_cache.generation()
+    result_cache._bump("logs", "api", [H0 + 1000])
+    assert _changed_since(logs_dep("api"), seq)
+    assert _changed_since(logs_dep("api", start=T0), seq)
+    assert not _changed_since(logs_dep("api", end=T0), seq)
+
+
+def test_change_without_hours_invalidates_every_window():
+    seq = result_cache.generation()
+    result_cache._bump("logs", "api", None)
+    assert _changed_since(logs_dep("api", T0, T0), seq)
+
+
+def test_too_many_buckets_collapse_to_any_hour(monkeypatch):
+    monkeypatch.setattr(result_cache, "RESULT_CACHE_MAX_BUCKETS", 3)
+    seq = result_cache.generation()
+    result_cache._bump("logs", "api", [H0 + 100, H0 + 101, H0 + 102, H0 + 103])
+    assert _changed_since(logs_dep("api", T0, T0), seq)
+    assert result_cache._changes[("logs", "api")]["hours"] == {}
+
+
+def test_apply_bumps_listed_services_and_hours():
+    seq = result_cache.generation()
+    result_cache._apply({"logs": {"api": [H0]}, "deployments": {"db": None}})
+    assert _changed_since(logs_dep("api", T0, T0), seq)
+    assert _changed_since(result_cache.deployments_dep("db"), seq)
+    assert not _changed_since(result_cache.deployments_dep("api"), seq)
+
+
+def test_aware_timestamps_map_to_utc_hours():
+    aware = datetime(2024, 3, 1, 14, 0, tzinfo=timezone(timedelta(hours=2)))
+    assert result_cache._hour(aware) == H0
+
+
+def test_message_passes_small_payloads_through():
+    payload = {"logs": {"api": [H0, H0 + 1]}}
+    assert json.loads(_message(payload)) == payload
+
+
+def test_message_widens_to_services_then_everything(monkeypatch):
+    monkeypatch.setattr(result_cache, "_MAX_PAYLOAD", 60)
+    many_hours = {"logs": {"api": list(range(H0, H0 + 50)), "db": [H0]}}
+    assert json.loads(_message(many_hours)) == {"logs": {"api": None, "db": None}}
+    many_services = {"logs": {f"service-{i}": [H0] for i in range(20)}}
+    assert _message(many_services) == '{"all":true}'
+
+
+def test_key_normalizes_whitespace_and_order():
+    a = result_cache.key("analyze", {"query": "db  timeout\n", "top_k": 5})
+    b = result_cache.key("analyze", {"top_k": 5, "query": "db timeout"})
+    assert a == b
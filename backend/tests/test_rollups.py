@@ -0,0 +1,122 @@
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import rollups
+
+Row = namedtuple("Row", "bucket errors total")
+
+
+class FakeEngine:
+    """Answers the series query with one row per requested bucket and records its parameters."""
+
+    def __init__(self):
+        self.counts = {}
+        self.params = None
+        self._rows = []
+
+    @contextmanager
+    def connect(self):
+        yield self
+
+    def execute(self, statement, params):
+        self.params = params
+        step = timedelta(minutes=1) if params["step"] == "1 minute" else timedelta(hours=1)
+        self._rows, bucket = [], params["start"]
+        while bucket <= params["end"]:
+            self._rows.append(Row(bucket, *self.counts.get(bucket, (0, 0))))
+            bucket += step
+        return self
+
+    def fetchall(self):
+        return self._rows
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    fake = FakeEngine()
+    monkeypatch.setattr(rollups, "engine", fake)
+    return fake
+
+
+def test_truncate():
+    ts = datetime(2024, 3, 1, 12, 34, 56, 789)
+    assert rollups._truncate(ts, "minute") == datetime(2024, 3, 1, 12, 34)
+    assert rollups._truncate(ts, "hour") == datetime(2024, 3, 1, 12, 0)
+
+
+def test_record_batch_rolls_minutes_into_hours(monkeypatch):
+    calls = []
+    monkeypatch.setattr(rollups, "execute_values", lambda cursor, sql, rows, **kw: calls.append((sql, rows)))
+    rows = [
+        {"service": "api", "level": "ERROR", "timestamp": datetime(2024, 3, 1, 12, 1, 5)},
+        {"service": "api", "level": "ERROR", "timestamp": datetime(2024, 3, 1, 12, 1, 50)},
+        {"service": "api", "level": "ERROR", "timestamp": datetime(2024, 3, 1, 12, 59)},
+        {"service": "api", "level": "INFO", "timestamp": datetime(2024, 3, 1, 12, 2)},
+        {"service": None, "level": "INFO", "timestamp": datetime(2024, 3, 1, 12, 2)},
+    ]
+    rollups.record_batch(None, rows)
+    (minute_sql, minutes), (hour_sql, hours) = calls
+    assert "log_counts_minute" in minute_sql and "log_counts_hour" in hour_sql
+    assert minutes == [
+        ("api", "ERROR", datetime(2024, 3, 1, 12, 1), 2),
+        ("api", "ERROR", datetime(2024, 3, 1, 12, 59), 1),
+        ("api", "INFO", datetime(2024, 3, 1, 12, 2), 1),
+    ]
+    assert hours == [
+        ("api", "ERROR", datetime(2024, 3, 1, 12), 3),
+        ("api", "INFO", datetime(2024, 3, 1, 12), 1),
+    ]
+
+
+def test_short_span_uses_minute_buckets(engine):
+    start = datetime(2024, 3, 1, 12, 0, 30)
+    engine.counts = {datetime(2024, 3, 1, 12, 1): (1, 4)}
+    result = rollups.error_rate_series(start=start, end=start + timedelta(minutes=3))
+    assert result["bucket"] == "minute"
+    assert result["start"] == datetime(2024, 3, 1, 12, 0)
+    assert [p["total"] for p in result["points"]] == [0, 4, 0, 0]
+    assert [p["error_rate"] for p in result["points"]] == [None, 0.25, None, None]
+
+
+def test_long_span_uses_hour_buckets(engine, monkeypatch):
+    monkeypatch.setattr(rollups, "ROLLUP_MINUTE_MAX_SPAN_HOURS", 48)
+    start = datetime(2024, 3, 1, 0, 10)
+    result = rollups.error_rate_series(start=start, end=start + timedelta(hours=49))
+    assert result["bucket"] == "hour"
+    assert len(result["points"]) == 50
+    assert engine.params["step"] == "1 hour"
+
+
+def test_defaults_to_last_24_hours(engine):
+    result = rollups.error_rate_series()
+    assert result["bucket"] == "minute"
+    assert len(result["points"]) == 24 * 60 + 1
+
+
+def test_aware_timestamps_are_converted_to_utc(engine):
+    tz = timezone(timedelta(hours=2))
+    result = rollups.error_rate_series(
+        start=datetime(2024, 3, 1, 14, 0, tzinfo=tz), end=datetime(2024, 3, 1, 14, 5, tzinfo=tz),
+    )
+    assert result["start"] == datetime(2024, 3, 1, 12, 0)
+    assert result["end"] == datetime(2024, 3, 1, 12, 5)
+
+
+def test_rejects_inverted_range(engine):
+    with pytest.raises(ValueError, match="start must not be after end"):
+        rollups.error_rate_series(start=datetime(2024, 3, 2), end=datetime(2024, 3, 1))
+
+
+def test_rejects_unknown_bucket(engine):
+    with pytest.raises(ValueError, match="Unknown bucket"):
+        rollups.error_rate_series(start=datetime(2024, 3, 1), end=datetime(2024, 3, 2), bucket="day")
+
+
+def test_rejects_too_many_points(engine, monkeypatch):
+    monkeypatch.setattr(rollups, "ROLLUP_MAX_POINTS", 100)
+    with pytest.raises(ValueError, match="101 minute buckets"):
+        rollups.error_rate_series(start=datetime(2024, 3, 1), end=datetime(2024, 3, 1, 1, 40), bucket="minute")
+    assert engine.params is None
@@ -0,0 +1,106 @@
+import pytest
+
+import templates
+from templates import WILDCARD, Template, TemplateMiner, mask
+
+
+def mine(miner, message):
+    return miner.add(mask(message).split())
+
+
+def test_mask_variable_parts():
+    assert mask("user 42 from 10.0.0.1:8080 req 3f2a1b4c-1d2e-4f5a-8b9c-0a1b2c3d4e5f") == (
+        "user <*> from <*> req <*>"
+    )
+    assert mask("addr 0xdeadbeef took -3.5 ms") == "addr <*> took <*> ms"
+    # Digits inside words are left alone; masking never changes the token count
+    assert mask("http2 v3 ok") == "http2 v3 ok"
+    assert mask("worker-7 ok") == "worker-<*> ok"
+
+
+def test_similar_lines_share_a_generalized_template():
+    miner = TemplateMiner(sim_threshold=0.4, depth=4)
+    a = mine(miner, "Connection to db-primary timed out after 30 ms")
+    b = mine(miner, "Connection to db-replica timed out after 45 ms")
+    assert a is b
+    assert a.text == "Connection to <*> timed out after <*> ms"
+
+
+def test_dissimilar_or_different_length_lines_do_not_merge():
+    miner = TemplateMiner(sim_threshold=0.6, depth=4)
+    a = mine(miner, "Connection to db timed out")
+    b = mine(miner, "Connection to db timed out again")
+    c = mine(miner, "Connection reset by peer now")
+    assert a is not b
+    assert c is not a
+
+
+def test_routing_prefix_keeps_different_first_tokens_apart():
+    miner = TemplateMiner(sim_threshold=0.1, depth=4)
+    a = mine(miner, "GET /health returned ok")
+    b = mine(miner, "PUT /health returned ok")
+    assert a is not b
+
+
+def test_match_is_read_only():
+    miner = TemplateMiner(sim_threshold=0.4, depth=4)
+    mine(miner, "Disk /dev/sda1 is 91 percent full")
+    assert miner.match(mask("Disk /dev/sdb2 is 95 percent full").split()).text == "Disk /dev/sda1 is <*> percent full"
+    assert miner.match(mask("Totally different message here").split()) is None
+    assert miner.match(["new", "length"]) is None
+    # The tree did not grow a branch for the unmatched query
+    assert 2 not in miner._root
+
+
+def test_full_node_routes_to_the_wildcard_child():
+    miner = TemplateMiner(sim_threshold=0.5, depth=3, max_children=2)
+    mine(miner, "alpha event happened")
+    mine(miner, "beta event happened")
+    overflow = mine(miner, "gamma event happened")
+    assert set(miner._root[3].children) == {"alpha", "beta", WILDCARD}
+    assert overflow.text == "gamma event happened"
+    assert mine(miner, "delta event happened") is overflow
+    assert overflow.text == "<*> event happened"
+
+
+def test_params_are_the_abstracted_tokens():
+    miner = TemplateMiner(sim_threshold=0.4, depth=4)
+    tokens = "Connection to db-primary timed out after 30 ms".split()
+    mine(miner, "Connection to db-replica timed out after 45 ms")
+    template = miner.add(mask(" ".join(tokens)).split())
+    assert templates._params(tokens, template) == ["db-primary", "30"]
+
+
+def test_loaded_templates_keep_their_ids():
+    miner = TemplateMiner(sim_threshold=0.4, depth=4)
+    stored = Template("Connection to <*> timed out".split(), id=7, embedded=True)
+    miner.load(stored)
+    assert mine(miner, "Connection to cache timed out") is stored
+    assert stored.stored == stored.text
+
+
+@pytest.fixture
+def snapshot(monkeypatch):
+    miner = TemplateMiner(sim_threshold=0.4, depth=4)
+    mine(miner, "Connection to db-primary timed out after 30 ms")
+    mine(miner, "Connection to db-replica timed out after 45 ms")
+    monkeypatch.setattr(templates, "_get_snapshot", lambda: miner)
+    monkeypatch.setattr(templates, "LOG_TEMPLATES", True)
+    return miner
+
+
+def test_normalize_maps_queries_to_their_template(snapshot):
+    assert templates.normalize("Connection to cache timed out after 99 ms") == (
+        "Connection to <*> timed out after <*> ms"
+    )
+    assert templates.normalize("Unknown error 500 in handler") == "Unknown error <*> in handler"
+
+
+def test_normalize_does_not_take_the_mining_lock(snapshot):
+    with templates._lock:
+        assert templates.normalize("Connection to x timed out after 1 ms").startswith("Connection")
+
+
+def test_normalize_is_a_no_op_when_templates_are_off(monkeypatch):
+    monkeypatch.setattr(templates, "LOG_TEMPLATES", False)
+    assert templates.normalize("user 42 failed") == "user 42 failed"
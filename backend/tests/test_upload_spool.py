@@ -0,0 +1,74 @@
+import gzip
+import zlib
+
+import pytest
+
+from ingestion import UploadSpool
+
+BODY = b"".join(b'{"message": "line %04d"}\n' % i for i in range(500))
+
+
+def spool(chunks, part_bytes=1000):
+    parts = []
+    s = UploadSpool(parts.append, part_bytes)
+    for chunk in chunks:
+        s.write(chunk)
+    s.close()
+    return s, parts
+
+
+def pieces(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 7, 4096, len(BODY)])
+def test_plain_body_in_any_chunking(size):
+    s, parts = spool(pieces(BODY, size))
+    assert b"".join(parts) == BODY
+    assert s.bytes == len(BODY)
+    assert s.parts == len(parts)
+
+
+@pytest.mark.parametrize("size", [1, 7, 4096])
+def test_gzip_detected_from_magic_bytes(size):
+    body = gzip.compress(BODY)
+    s, parts = spool(pieces(body, size))
+    assert b"".join(parts) == BODY
+    # bytes counts what was received, not what was decoded
+    assert s.bytes == len(body)
+
+
+def test_concatenated_gzip_members():
+    half = len(BODY) // 2
+    _, parts = spool(pieces(gzip.compress(BODY[:half]) + gzip.compress(BODY[half:]), 333))
+    assert b"".join(parts) == BODY
+
+
+def test_truncated_gzip_raises():
+    with pytest.raises(ValueError, match="truncated"):
+        spool([gzip.compress(BODY)[:-20]])
+
+
+def test_corrupt_gzip_raises():
+    body = bytearray(gzip.compress(BODY))
+    body[40] ^= 0xFF
+    with pytest.raises(zlib.error):
+        spool([bytes(body)])
+
+
+def test_parts_end_on_line_boundaries():
+    _, parts = spool(pieces(BODY, 4096), part_bytes=1000)
+    assert len(parts) > 1
+    assert all(p.endswith(b"\n") and len(p) <= 1000 for p in parts)
+
+
+def test_line_longer_than_a_part_is_kept_whole():
+    long_line = b"x" * 50 + b"\n"
+    _, parts = spool([long_line + b"short\n" + b"tail"], part_bytes=10)
+    assert parts == [long_line, b"short\n", b"tail"]
+
+
+def test_one_byte_and_empty_bodies():
+    assert spool([b"x"])[1] == [b"x"]
+    assert spool([])[1] == []
+    assert spool([b"\n\n"])[1] == []
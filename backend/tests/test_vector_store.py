@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from vector_store import QUANTIZATIONS, VectorStore
+
+DIM = 64
+N = 3000
+K = 10
+T0 = datetime(2024, 3, 1)
+
+
+@pytest.fixture(scope="module")
+def data():
+    # Clustered like real embeddings; on isotropic noise the true top k are near-ties
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(30, DIM))
+    X = (centers[rng.integers(0, 30, N)] + rng.normal(scale=0.6, size=(N, DIM))).astype(np.float32)
+    X /= np.linalg.norm(X, axis=1, keepdims=True)
+    Q = X[rng.choice(N, 20, replace=False)] + rng.normal(scale=0.02, size=(20, DIM)).astype(np.float32)
+    return X, Q
+
+
+def fill(path, X, quantization, batch=1000):
+    store = VectorStore(str(path), DIM, quantization)
+    for lo in range(0, len(X), batch):
+        hi = min(lo + batch, len(X))
+        ids = np.arange(lo + 1, hi + 1)
+        store.append(
+            ids, X[lo:hi],
+            ["ERROR" if i % 2 else "INFO" for i in ids],
+            [f"svc-{i % 3}" for i in ids],
+            [T0 + timedelta(minutes=int(i)) for i in ids],
+        )
+    return store
+
+
+def exact_top(X, Q, k, rows=None):
+    rows = np.arange(len(X)) if rows is None else rows
+    scores = (Q / np.linalg.norm(Q, axis=1, keepdims=True)) @ X[rows].T
+    return [set(rows[np.argsort(-s)[:k]] + 1) for s in scores]
+
+
+@pytest.mark.parametrize("quantization, min_recall", [
+    ("none", 1.0), ("float16", 0.99), ("int8", 0.98), ("binary", 0.95),
+])
+def test_recall_at_k(tmp_path, data, quantization, min_recall):
+    X, Q = data
+    store = fill(tmp_path, X, quantization)
+    truth = exact_top(X, Q, K)
+    results = store.search(Q, K)
+    recall = np.mean([len(set(ids) & t) / K for (ids, _), t in zip(results, truth)])
+    assert recall >= min_recall
+    for ids, distances in results:
+        assert len(ids) == K
+        assert (np.diff(distances) >= 0).all()
+
+
+@pytest.mark.parametrize("quantization", QUANTIZATIONS)
+def test_filters_restrict_candidates(tmp_path, data, quantization):
+    X, Q = data
+    store = fill(tmp_path, X, quantization)
+    start, end = T0 + timedelta(minutes=500), T0 + timedelta(minutes=1500)
+    for ids, _ in store.search(Q, K, level="ERROR", service="svc-1", start=start, end=end):
+        assert len(ids) == K
+        assert all(i % 2 and i % 3 == 1 and 500 <= i <= 1500 for i in ids)
+    ids, _ = store.search(Q[:1], K, service="no-such-service")[0]
+    assert len(ids) == 0
+
+
+@pytest.mark.parametrize("quantization", QUANTIZATIONS)
+def test_tombstoned_rows_are_excluded(tmp_path, data, quantization):
+    X, Q = data
+    store = fill(tmp_path, X, quantization)
+    first, _ = store.search(Q[:1], K)[0]
+    live = np.setdiff1d(np.arange(1, N + 1), first[:5])
+    assert store.tombstone(live) == 5
+    assert store.tombstone(live) == 0
+    ids, _ = store.search(Q[:1], K)[0]
+    assert len(ids) == K
+    assert not set(ids) & set(first[:5])
+
+
+def test_reopen_keeps_rows_codes_and_tombstones(tmp_path, data):
+    X, Q = data
+    store = fill(tmp_path, X, "int8")
+    store.tombstone(np.arange(2, N + 1))
+    before = store.search(Q, K)
+    reopened = VectorStore(str(tmp_path), DIM, "int8")
+    assert (reopened.count, reopened.last_id, reopened.deleted) == (N, N, 1)
+    for (a, da), (b, db) in zip(before, reopened.search(Q, K)):
+        assert (a == b).all()
+        assert np.allclose(da, db)
+
+
+def test_changing_quantization_reencodes(tmp_path, data):
+    X, Q = data
+    fill(tmp_path, X, "none")
+    store = VectorStore(str(tmp_path), DIM, "binary")
+    assert store.count == N and store.center is not None
+    truth = exact_top(X, Q, K)
+    recall = np.mean([len(set(ids) & t) / K for (ids, _), t in zip(store.search(Q, K), truth)])
+    assert recall >= 0.95
+
+
+def test_int8_scale_widens_without_clipping(tmp_path):
+    store = VectorStore(str(tmp_path), 4, "int8")
+    store.append([1], np.array([[0.1, 0.1, 0.1, 0.1]]), ["INFO"], ["a"], [T0])
+    narrow = store.scale.copy()
+    store.append([2], np.array([[1.0, 0.0, 0.0, 0.0]]), ["INFO"], ["a"], [T0])
+    assert store.scale[0] > narrow[0]
+    ids, distances = store.search(np.array([[1.0, 0.0, 0.0, 0.0]]), 1)[0]
+    assert ids[0] == 2 and distances[0] == pytest.approx(0.0, abs=1e-6)
+
+
+def test_unknown_quantization(tmp_path):
+    with pytest.raises(ValueError, match="Unknown quantization"):
+        VectorStore(str(tmp_path), DIM, "int4")
@@ -0,0 +1,512 @@
+"""In-process NumPy vector search over memory-mapped embeddings (SEARCH_BACKEND=numpy).
+Postgres stays the source of truth; the store copies new rows by id and tombstones deleted ones."""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from sqlalchemy import text
+import embeddings
+import metrics
+from db import EMBEDDING_FETCH_CHUNK, decode_vectors, engine
+
+logger = logging.getLogger(__name__)
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "pgvector").lower()
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", os.path.join(_BASE_DIR, "vector_store"))
+# Only keep (and serve) logs newer than this many days; 0 keeps everything
+VECTOR_STORE_WINDOW_DAYS = float(os.getenv("VECTOR_STORE_WINDOW_DAYS", "0"))
+VECTOR_STORE_SYNC_SECONDS = float(os.getenv("VECTOR_STORE_SYNC_SECONDS", "5"))
+# Rows scored per matrix product, bounding the temporary score matrix
+VECTOR_STORE_BLOCK_ROWS = int(os.getenv("VECTOR_STORE_BLOCK_ROWS", "262144"))
+# How far below the newest stored id a sync looks for late-committed rows
+SYNC_RECHECK_IDS = 10000
+# Compressed copy searches scan: none, float16, int8 (per-dimension scale) or
+# binary (sign bits around the mean vector, Hamming distance); candidates are
+# then rescored exactly
+VECTOR_STORE_QUANTIZATION = os.getenv("VECTOR_STORE_QUANTIZATION", "none").lower()
+# Quantized searches rescore this many candidates per requested result
+VECTOR_STORE_RESCORE = int(os.getenv("VECTOR_STORE_RESCORE", "10"))
+QUANTIZATIONS = ("none", "float16", "int8", "binary")
+
+_INITIAL_CAPACITY = 65536
+_DECODE_ROWS = 4096
+# file -> dtype; "vectors" is 2-D (capacity, dim)
+_ARRAYS = {
+    "vectors": np.float32, "ids": np.int64, "ts": np.int64, "level": np.int16, "service": np.int32,
+    # 1 once the row was deleted from logs
+    "dead": np.uint8,
+}
+
+_lock = threading.Lock()
+_sync_lock = threading.Lock()
+_dirty = threading.Event()
+# Set when logs may have been deleted: the next sync tombstones missing ids
+_stale = threading.Event()
+_store = None
+_synced_at = 0.0
+
+
+def _epoch_us(timestamps) -> np.ndarray:
+    return np.array(
+        [ts.astimezone(timezone.utc).replace(tzinfo=None) if ts.tzinfo else ts for ts in timestamps],
+        dtype="datetime64[us]",
+    ).astype(np.int64)
+
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(x: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(x)
+    return _POPCOUNT[x.view(np.uint8)]
+
+
+class VectorStore:
+    """Append-only memory-mapped vectors plus filter columns in one directory.
+    Quantized stores scan compressed codes and read float32 rows only to rescore candidates."""
+
+    def __init__(self, path: str, dim: int, quantization: str = "none"):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization!r}; expected one of {list(QUANTIZATIONS)}")
+        self.path = path
+        self.dim = dim
+        self.quantization = quantization
+        self.count = 0
+        self.capacity = 0
+        self.last_id = 0
+        # Tombstoned rows; while 0 searches skip the dead mask
+        self.deleted = 0
+        self.levels = {}
+        self.services = {}
+        # int8: per-dimension absolute maximum seen so far (code 127 maps to it)
+        self.scale = None
+        # binary: mean vector at the time the codes were built (rebuild() recenters)
+        self.center = None
+        self._arrays = {}
+        self._write_lock = threading.Lock()
+        # Guards what a search reads together: arrays, count, scale and center
+        self._state_lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        meta = self._read_meta()
+        if meta and meta["dim"] == dim:
+            self.count, self.last_id = meta["count"], meta["last_id"]
+            self.deleted = meta.get("deleted", 0)
+            self.levels, self.services = meta["levels"], meta["services"]
+            stored = meta.get("quantization", "none")
+            if stored == quantization:
+                for name in ("scale", "center"):
+                    if meta.get(name) is not None:
+                        setattr(self, name, np.array(meta[name], dtype=np.float32))
+            self._map(max(meta["capacity"], _INITIAL_CAPACITY))
+            if stored != quantization:
+                self._encode_all(self.count)
+                self._write_meta()
+        else:
+            self._map(_INITIAL_CAPACITY, reset=True)
+            self._write_meta()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _layout(self) -> dict:
+        """file -> (dtype, row width or None for 1-D)."""
+        layout = {name: (dtype, self.dim if name == "vectors" else None) for name, dtype in _ARRAYS.items()}
+        if self.quantization == "float16":
+            layout["codes"] = (np.float16, self.dim)
+        elif self.quantization == "int8":
+            layout["codes"] = (np.int8, self.dim)
+        elif self.quantization == "binary":
+            # Sign bits padded to whole 64-bit words so Hamming distances run on uint64
+            layout["codes"] = (np.uint8, (self.dim + 63) // 64 * 8)
+        return layout
+
+    def _read_meta(self) -> dict | None:
+        try:
+            with open(os.path.join(self.path, "meta.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self):
+        meta = {
+            "dim": self.dim, "count": self.count, "capacity": self.capacity, "last_id": self.last_id,
+            "deleted": self.deleted,
+            "levels": self.levels, "services": self.services, "quantization": self.quantization,
+            "scale": self.scale.tolist() if self.scale is not None else None,
+            "center": self.center.tolist() if self.center is not None else None,
+        }
+        tmp = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.path, "meta.json"))
+
+    def _map(self, capacity: int, reset: bool = False):
+        """(Re)open every array with room for capacity rows, growing the files in place."""
+        arrays = {}
+        for name, (dtype, width) in self._layout().items():
+            shape = (capacity, width) if width else (capacity,)
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            mode = "w+b" if reset or not os.path.exists(self._file(name)) else "r+b"
+            with open(self._file(name), mode) as f:
+                if os.fstat(f.fileno()).st_size < nbytes:
+                    f.truncate(nbytes)
+            arrays[name] = np.memmap(self._file(name), dtype=dtype, mode="r+", shape=shape)
+        # Searches keep using the arrays they started with
+        with self._state_lock:
+            self._arrays = arrays
+        self.capacity = capacity
+
+    def _label_codes(self, vocab: dict, values) -> np.ndarray:
+        return np.array([vocab.setdefault(v, len(vocab)) if v is not None else -1 for v in values])
+
+    def _encode(self, X: np.ndarray, scale: np.ndarray, center: np.ndarray) -> np.ndarray:
+        if self.quantization == "float16":
+            return X.astype(np.float16)
+        if self.quantization == "int8":
+            return np.round(X / scale * 127).astype(np.int8)
+        return self._pack_bits(X, center)
+
+    def _pack_bits(self, X: np.ndarray, center: np.ndarray) -> np.ndarray:
+        bits = np.packbits(X > center, axis=1)
+        return np.pad(bits, ((0, 0), (0, (self.dim + 63) // 64 * 8 - bits.shape[1])))
+
+    def _encode_all(self, n: int):
+        """Re-encode rows [0, n) into a fresh codes file and swap it in with count = n."""
+        a = self._arrays
+        if "codes" not in a:
+            with self._state_lock:
+                self.count = n
+            return
+        scale, center = self.scale, self.center
+        if self.quantization == "binary" and n:
+            total = np.zeros(self.dim, dtype=np.float64)
+            for lo in range(0, n, VECTOR_STORE_BLOCK_ROWS):
+                total += a["vectors"][lo:min(lo + VECTOR_STORE_BLOCK_ROWS, n)].sum(axis=0)
+            center = (total / n).astype(np.float32)
+        if self.quantization == "int8" and n:
+            scale = np.zeros(self.dim, dtype=np.float32)
+            for lo in range(0, n, VECTOR_STORE_BLOCK_ROWS):
+                scale = np.maximum(scale, np.abs(a["vectors"][lo:min(lo + VECTOR_STORE_BLOCK_ROWS, n)]).max(axis=0))
+            scale = np.where(scale > 0, scale, 1).astype(np.float32)
+        dtype, width = self._layout()["codes"]
+        fresh = self._file("codes") + ".next"
+        with open(fresh, "w+b") as f:
+            f.truncate(self.capacity * width * np.dtype(dtype).itemsize)
+        codes = np.memmap(fresh, dtype=dtype, mode="r+", shape=(self.capacity, width))
+        for lo in range(0, n, VECTOR_STORE_BLOCK_ROWS):
+            hi = min(lo + VECTOR_STORE_BLOCK_ROWS, n)
+            codes[lo:hi] = self._encode(np.asarray(a["vectors"][lo:hi]), scale, center)
+        codes.flush()
+        with self._state_lock:
+            # Open maps of the old file stay valid after the rename
+            os.replace(fresh, self._file("codes"))
+            self._arrays = {**a, "codes": codes}
+            self.scale, self.center, self.count = scale, center, n
+
+    def append(self, ids, vectors: np.ndarray, levels, services, timestamps):
+        """Add rows (ids must not be in the store yet); vectors are normalized here."""
+        if not len(ids):
+            return
+        with self._write_lock:
+            n = self.count + len(ids)
+            if n > self.capacity:
+                capacity = self.capacity
+                while capacity < n:
+                    capacity *= 2
+                for a in self._arrays.values():
+                    a.flush()
+                self._map(capacity)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            X = (vectors / np.where(norms > 0, norms, 1)).astype(np.float32)
+            a, s = self._arrays, slice(self.count, n)
+            a["vectors"][s] = X
+            a["ids"][s] = ids
+            a["ts"][s] = _epoch_us(timestamps)
+            a["level"][s] = self._label_codes(self.levels, levels)
+            a["service"][s] = self._label_codes(self.services, services)
+            rescale = False
+            if "codes" in a:
+                absmax = np.abs(X).max(axis=0)
+                # The int8 scale only ever widens: rare after the first batches, never clips.
+                # The binary center is taken from the first batch and kept
+                rescale = (self.quantization == "int8" and (self.scale is None or np.any(absmax > self.scale))) or (
+                    self.quantization == "binary" and self.center is None
+                )
+                if not rescale:
+                    a["codes"][s] = self._encode(X, self.scale, self.center)
+            for arr in a.values():
+                arr.flush()
+            if rescale:
+                self._encode_all(n)
+            else:
+                with self._state_lock:
+                    self.count = n
+            self.last_id = max(self.last_id, int(np.max(ids)))
+            self._write_meta()
+
+    def ids_after(self, after: int) -> np.ndarray:
+        ids = self._arrays["ids"][:self.count]
+        return ids[ids > after]
+
+    def tombstone(self, live_ids: np.ndarray) -> int:
+        """Mark rows whose id is not in live_ids as deleted. Returns how many were newly marked."""
+        with self._write_lock:
+            a, n = self._arrays, self.count
+            dead = ~np.isin(a["ids"][:n], live_ids) & (a["dead"][:n] == 0)
+            newly = int(dead.sum())
+            if newly:
+                a["dead"][:n][dead] = 1
+                a["dead"].flush()
+                with self._state_lock:
+                    self.deleted += newly
+                self._write_meta()
+            return newly
+
+    def _mask(self, a: dict, n: int, level, service, start, end) -> np.ndarray | None:
+        mask = a["dead"][:n] == 0 if self.deleted else None
+        for column, vocab, value in (("level", self.levels, level), ("service", self.services, service)):
+            if value is None:
+                continue
+            part = a[column][:n] == vocab.get(value, -2)
+            mask = part if mask is None else mask & part
+        if start is not None:
+            part = a["ts"][:n] >= _epoch_us([start])[0]
+            mask = part if mask is None else mask & part
+        if end is not None:
+            part = a["ts"][:n] <= _epoch_us([end])[0]
+            mask = part if mask is None else mask & part
+        return mask
+
+    def _score(self, Q: np.ndarray, block: np.ndarray, scale: np.ndarray, center: np.ndarray) -> np.ndarray:
+        """Similarity of each query to each row of a block of vectors or codes (higher is closer)."""
+        if self.quantization == "none":
+            return Q @ block.T
+        if self.quantization in ("float16", "int8"):
+            if self.quantization == "int8":
+                Q = Q * (scale / 127)
+            scores = np.empty((len(Q), len(block)), dtype=np.float32)
+            # Widen to float32 a cache-sized slice at a time
+            for lo in range(0, len(block), _DECODE_ROWS):
+                scores[:, lo:lo + _DECODE_ROWS] = Q @ block[lo:lo + _DECODE_ROWS].astype(np.float32).T
+            return scores
+        # binary: negated Hamming distance between sign bits
+        words = np.ascontiguousarray(block).view(np.uint64)
+        scores = np.empty((len(Q), len(block)), dtype=np.float32)
+        for i, q in enumerate(self._pack_bits(Q, center).view(np.uint64)):
+            scores[i] = -_popcount(words ^ q).sum(axis=1, dtype=np.int32)
+        return scores
+
+    def _top(self, view: tuple, Q: np.ndarray, k: int, rows: np.ndarray | None) -> tuple:
+        """Positions and scores of the k best rows per query, unordered."""
+        a, n, scale, center = view
+        source = a["vectors" if self.quantization == "none" else "codes"]
+        total = n if rows is None else len(rows)
+        best_scores = np.full((len(Q), 0), -np.inf, dtype=np.float32)
+        best_pos = np.empty((len(Q), 0), dtype=np.int64)
+        for lo in range(0, total, VECTOR_STORE_BLOCK_ROWS):
+            hi = min(lo + VECTOR_STORE_BLOCK_ROWS, total)
+            pos = np.arange(lo, hi) if rows is None else rows[lo:hi]
+            block = source[lo:hi] if rows is None else source[pos]
+            scores = self._score(Q, block, scale, center)
+            kk = min(k, scores.shape[1])
+            top = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            best_pos = np.concatenate([best_pos, pos[top]], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_pos = np.take_along_axis(best_pos, keep, axis=1)
+        return best_pos, best_scores
+
+    def search(self, queries: np.ndarray, top_k: int, level=None, service=None, start=None, end=None,
+               rescore: int | None = None) -> list:
+        """Top k (ids, cosine distances) per query row, best first."""
+        with self._state_lock:
+            view = (self._arrays, self.count, self.scale, self.center)
+        a, n = view[0], view[1]
+        Q = np.asarray(queries, dtype=np.float32)
+        Q = Q / np.where((norms := np.linalg.norm(Q, axis=1, keepdims=True)) > 0, norms, 1)
+        mask = self._mask(a, n, level, service, start, end)
+        rows = np.flatnonzero(mask) if mask is not None else None
+        metrics.SEARCH_ROWS_SCANNED.observe(n if rows is None else len(rows), quantization=self.quantization)
+
+        if self.quantization == "none":
+            best_pos, best_scores = self._top(view, Q, top_k, rows)
+        else:
+            candidates, _ = self._top(view, Q, top_k * (rescore or VECTOR_STORE_RESCORE), rows)
+            best_pos = np.empty((len(Q), min(top_k, candidates.shape[1])), dtype=np.int64)
+            best_scores = np.empty(best_pos.shape, dtype=np.float32)
+            for i, pos in enumerate(candidates):
+                pos = np.sort(pos)  # sequential reads from the float32 file
+                exact = a["vectors"][pos] @ Q[i]
+                keep = np.argpartition(-exact, best_pos.shape[1] - 1)[:best_pos.shape[1]] if len(pos) else pos
+                best_pos[i], best_scores[i] = pos[keep], exact[keep]
+
+        order = np.argsort(-best_scores, axis=1)
+        results = []
+        for i in range(len(Q)):
+            positions = best_pos[i][order[i]]
+            results.append((a["ids"][positions].copy(), np.maximum(1.0 - best_scores[i][order[i]], 0.0)))
+        return results
+
+    def disk_bytes(self) -> dict:
+        return {name: os.path.getsize(self._file(name)) for name in self._layout()}
+
+
+def enabled() -> bool:
+    return SEARCH_BACKEND == "numpy"
+
+
+def window_start() -> datetime | None:
+    if not VECTOR_STORE_WINDOW_DAYS:
+        return None
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=VECTOR_STORE_WINDOW_DAYS)
+
+
+def serves(start_time: datetime | None) -> bool:
+    """Whether a query with this start_time can be answered from the store."""
+    if not enabled():
+        return False
+    since = window_start()
+    if since is None:
+        return True
+    if start_time is None:
+        return False
+    if start_time.tzinfo:
+        start_time = start_time.astimezone(timezone.utc).replace(tzinfo=None)
+    return start_time >= since
+
+
+def get_store() -> VectorStore:
+    global _store
+    with _lock:
+        dim = embeddings.EMBEDDING_DIM
+        if _store is None or _store.dim != dim:
+            # A new dimension (after an embedding migration) starts a fresh store
+            _store = VectorStore(VECTOR_STORE_DIR, dim, VECTOR_STORE_QUANTIZATION)
+    return _store
+
+
+def mark_dirty():
+    """Called after an ingest commits: the next search syncs first."""
+    _dirty.set()
+
+
+def mark_stale():
+    """Called when logs may have been deleted: the next sync tombstones rows that are gone."""
+    _stale.set()
+    _dirty.set()
+
+
+def _tombstone_deleted(store: VectorStore, since: datetime | None):
+    since_sql = "AND timestamp >= :since" if since else ""
+    with engine.connect() as conn:
+        live = np.array(
+            conn.execute(
+                text(f"SELECT id FROM logs WHERE id <= :last AND embedding IS NOT NULL {since_sql}"),
+                {"last": store.last_id, "since": since},
+            ).scalars().all(),
+            dtype=np.int64,
+        )
+    deleted = store.tombstone(live)
+    if deleted:
+        logger.info("Tombstoned %s vector store rows deleted from logs", deleted)
+
+
+def sync(force: bool = False) -> int:
+    """Copy logs the store does not have yet. Returns the number of rows added.
+    Ids just below last_id are re-checked, since ingest transactions can commit out of id order."""
+    global _synced_at
+    if not force and not _dirty.is_set() and time.monotonic() - _synced_at < VECTOR_STORE_SYNC_SECONDS:
+        return 0
+    store = get_store()
+    with _sync_lock:
+        _dirty.clear()
+        _synced_at = time.monotonic()
+        since = window_start()
+        if _stale.is_set():
+            _stale.clear()
+            _tombstone_deleted(store, since)
+        after = max(store.last_id - SYNC_RECHECK_IDS, 0)
+        since_sql = "AND timestamp >= :since" if since else ""
+        with engine.connect() as conn:
+            candidates = np.array(
+                conn.execute(
+                    text(f"SELECT id FROM logs WHERE id > :after AND embedding IS NOT NULL {since_sql}"),
+                    {"after": after, "since": since},
+                ).scalars().all(),
+                dtype=np.int64,
+            )
+        missing = np.setdiff1d(candidates, store.ids_after(after))
+        for lo in range(0, len(missing), EMBEDDING_FETCH_CHUNK):
+            with engine.connect() as conn:
+                rows = conn.execute(
+                    text("""
+                    SELECT id, level, service, timestamp, vector_send(embedding) AS payload
+                    FROM logs WHERE id = ANY(:ids) ORDER BY id
+                    """),
+                    {"ids": missing[lo:lo + EMBEDDING_FETCH_CHUNK].tolist()},
+                ).fetchall()
+            if rows:
+                store.append(
+                    np.array([r.id for r in rows], dtype=np.int64),
+                    decode_vectors([bytes(r.payload) for r in rows]),
+                    [r.level for r in rows], [r.service for r in rows], [r.timestamp for r in rows],
+                )
+        return len(missing)
+
+
+def rebuild() -> dict:
+    """Recreate the store from logs, dropping rows deleted since and ones outside the window."""
+    global _store
+    with _lock, _sync_lock:
+        for name in list(_ARRAYS) + ["codes", "meta"]:
+            path = os.path.join(VECTOR_STORE_DIR, f"{name}.json" if name == "meta" else f"{name}.bin")
+            if os.path.exists(path):
+                os.remove(path)
+        _store = None
+    started = time.monotonic()
+    added = sync(force=True)
+    return {"rows": added, "seconds": round(time.monotonic() - started, 3)}
+
+
+def start():
+    """Open the store and catch up with logs in the background when the numpy backend is on."""
+    if enabled():
+        threading.Thread(target=sync, kwargs={"force": True}, name="vector-store-sync", daemon=True).start()
+
+
+def search(vectors, top_k: int, level=None, service=None, start=None, end=None) -> list:
+    sync()
+    return get_store().search(np.asarray(vectors, dtype=np.float32), top_k, level, service, start, end)
+
+
+def search_plan() -> dict:
+    """The plan analyzer reports for searches answered from the store."""
+    plan = {"strategy": "numpy", "index": None, "quantization": VECTOR_STORE_QUANTIZATION}
+    if VECTOR_STORE_QUANTIZATION != "none":
+        plan["rescore"] = VECTOR_STORE_RESCORE
+    return plan
+
+
+def status() -> dict:
+    store = get_store()
+    return {
+        "backend": SEARCH_BACKEND,
+        "path": store.path,
+        "rows": store.count,
+        "deleted_rows": store.deleted,
+        "capacity": store.capacity,
+        "dim": store.dim,
+        "last_id": store.last_id,
+        "window_days": VECTOR_STORE_WINDOW_DAYS or None,
+        "quantization": store.quantization,
+        "rescore": VECTOR_STORE_RESCORE if store.quantization != "none" else None,
+        "disk_bytes": store.disk_bytes(),
+    }
@@ -0,0 +1,545 @@
+"""Durable ingest / re-embed job queue on Postgres (`ingest_jobs`) and the worker pool that runs it.
+Jobs are claimed with FOR UPDATE SKIP LOCKED and resume from their checkpoint after a crash."""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+from sqlalchemy import text
+import embeddings
+from db import engine, embedding_column_dim, init_db
+from embedding_spaces import backfill_embeddings, REEMBED_BATCH_SIZE
+import result_cache
+from ingestion import (
+    ingest_file_range, ingest_upload_part, file_fingerprint, ingested_ranges, record_manifest, _resolve_path,
+)
+import templates
+import cluster_model
+
+logger = logging.getLogger(__name__)
+
+# Worker processes started by each API process; 0 (default) leaves the queue to `python worker.py`
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "1"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "30"))
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "10"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "120"))
+# Files larger than this are split into byte-range shards of this size
+INGEST_SHARD_BYTES = int(os.getenv("INGEST_SHARD_BYTES", str(64 * 1024 * 1024)))
+# Re-embed jobs cover this many log ids each
+REEMBED_SHARD_ROWS = int(os.getenv("REEMBED_SHARD_ROWS", "100000"))
+
+_pool = []
+
+
+class JobLost(RuntimeError):
+    """The job was reclaimed by another worker (e.g. after a missed heartbeat)."""
+
+
+# ------------ ENQUEUE ------------
+
+def _enqueue(conn, kind: str, payloads: list, max_attempts: int) -> list:
+    return [
+        conn.execute(
+            text("""
+            INSERT INTO ingest_jobs (kind, payload, max_attempts)
+            VALUES (:kind, CAST(:payload AS jsonb), :max_attempts)
+            RETURNING id
+            """),
+            {"kind": kind, "payload": json.dumps(p), "max_attempts": max_attempts},
+        ).scalar()
+        for p in payloads
+    ]
+
+
+def enqueue_ingest(
+    file_path: str,
+    chunk_size: int | None = None,
+    shard_bytes: int | None = None,
+    max_attempts: int | None = None,
+    force: bool = False,
+) -> dict:
+    """Queue a JSONL file for ingest as one job per byte-range shard. Returns (job ids, skipped shards).
+    Shards already in the ingest manifest are skipped unless force is set."""
+    path = _resolve_path(file_path)
+    size = os.path.getsize(path)
+    fingerprint = file_fingerprint(path)
+    shard_bytes = shard_bytes or INGEST_SHARD_BYTES
+    done = set() if force else ingested_ranges(fingerprint)
+    payloads, skipped = [], 0
+    for start in range(0, max(size, 1), shard_bytes):
+        end = min(start + shard_bytes, size)
+        if (start, end) in done:
+            skipped += 1
+            continue
+        payloads.append({"file_path": file_path, "start": start, "end": end, "chunk_size": chunk_size,
+                         "fingerprint": fingerprint, "size": size})
+    with engine.begin() as conn:
+        job_ids = _enqueue(conn, "ingest", payloads, max_attempts or JOB_MAX_ATTEMPTS)
+    return {"job_ids": job_ids, "skipped_shards": skipped, "fingerprint": fingerprint}
+
+
+def enqueue_reembed(
+    only_missing: bool = False,
+    shard_rows: int | None = None,
+    batch_size: int | None = None,
+    max_attempts: int | None = None,
+) -> list:
+    """Queue re-embedding of logs.embedding as one job per id-range shard. Returns job ids."""
+    shard_rows = shard_rows or REEMBED_SHARD_ROWS
+    with engine.begin() as conn:
+        lo, hi = conn.execute(text("SELECT min(id), max(id) FROM logs")).first()
+        if lo is None:
+            return []
+        payloads = [
+            {"start_id": start, "end_id": min(start + shard_rows, hi), "only_missing": only_missing,
+             "batch_size": batch_size}
+            for start in range(lo - 1, hi, shard_rows)
+        ]
+        return _enqueue(conn, "reembed", payloads, max_attempts or JOB_MAX_ATTEMPTS)
+
+
+# ------------ UPLOADS ------------
+# An upload is an ingest_jobs row of kind 'upload': 'uploading' until its body
+# arrives, 'running' (heart-beaten by the receiving API process) while the body
+# is received, then 'done'. Each part is stored in ingest_upload_parts and
+# queued as it is cut, so workers ingest it while the rest is still arriving; a
+# part is deleted when its ingest job is done. An upload that fails part-way
+# keeps the parts already queued.
+
+def create_upload(source: str | None = None) -> int:
+    """Register an upload before its body is sent. Returns the job id."""
+    with engine.begin() as conn:
+        return conn.execute(
+            text("""
+            INSERT INTO ingest_jobs (kind, status, payload, max_attempts)
+            VALUES ('upload', 'uploading', CAST(:payload AS jsonb), 1)
+            RETURNING id
+            """),
+            {"payload": json.dumps({"source": source})},
+        ).scalar()
+
+
+def start_upload(job_id: int) -> str | None:
+    """Take an 'uploading' job for this process. Returns its worker id, or None if it was already started."""
+    worker_id = f"api:{socket.gethostname()}:{os.getpid()}"
+    with engine.begin() as conn:
+        started = conn.execute(
+            text("""
+            UPDATE ingest_jobs
+            SET status = 'running', attempts = 1, worker = :worker, started_at = now(), heartbeat_at = now()
+            WHERE id = :id AND kind = 'upload' AND status = 'uploading'
+            """),
+            {"id": job_id, "worker": worker_id},
+        ).rowcount
+    return worker_id if started else None
+
+
+def upload_progress(job_id: int, worker_id: str, bytes_received: int):
+    with engine.begin() as conn:
+        _save_checkpoint(conn, job_id, worker_id, {"bytes": bytes_received}, 0)
+
+
+def add_upload_part(
+    job_id: int, worker_id: str, part: int, data: bytes, bytes_received: int, chunk_size: int | None = None,
+) -> int | None:
+    """Store one part of an upload's body and queue its ingest job.
+
+    Returns the job id, or None if the ingest manifest already records this content.
+    """
+    fingerprint = hashlib.sha256(data).hexdigest()
+    known = (0, len(data)) in ingested_ranges(fingerprint)
+    with engine.begin() as conn:
+        _save_checkpoint(conn, job_id, worker_id, {"bytes": bytes_received, "parts": part + 1}, 0)
+        if known:
+            return None
+        conn.execute(
+            text("INSERT INTO ingest_upload_parts (upload_id, part, data) VALUES (:id, :part, :data)"),
+            {"id": job_id, "part": part, "data": data},
+        )
+        payload = {"upload_id": job_id, "part": part, "start": 0, "end": len(data), "chunk_size": chunk_size,
+                   "fingerprint": fingerprint, "size": len(data)}
+        return _enqueue(conn, "ingest", [payload], JOB_MAX_ATTEMPTS)[0]
+
+
+def _upload_part(job_id: int, part: int) -> bytes:
+    with engine.connect() as conn:
+        data = conn.execute(
+            text("SELECT data FROM ingest_upload_parts WHERE upload_id = :id AND part = :part"),
+            {"id": job_id, "part": part},
+        ).scalar()
+    if data is None:
+        raise RuntimeError(f"part {part} of upload {job_id} is missing")
+    return bytes(data)
+
+
+def _upload_job_ids(conn, job_id: int) -> list:
+    return list(conn.execute(
+        text("SELECT id FROM ingest_jobs WHERE kind = 'ingest' AND (payload->>'upload_id')::bigint = :id ORDER BY id"),
+        {"id": job_id},
+    ).scalars())
+
+
+def finish_upload(job_id: int, worker_id: str, bytes_received: int, parts: int) -> dict:
+    """Mark the upload done once its last part is queued. Returns its job ids and skipped parts."""
+    with engine.begin() as conn:
+        _save_checkpoint(conn, job_id, worker_id, {"bytes": bytes_received, "parts": parts}, 0)
+        job_ids = _upload_job_ids(conn, job_id)
+        queued = {"job_ids": job_ids, "skipped_shards": parts - len(job_ids)}
+        conn.execute(
+            text("""
+            UPDATE ingest_jobs
+            SET status = 'done', finished_at = now(), payload = payload || CAST(:queued AS jsonb)
+            WHERE id = :id
+            """),
+            {"id": job_id, "queued": json.dumps(queued)},
+        )
+    return queued
+
+
+def fail_upload(job_id: int, worker_id: str, error: str):
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+            UPDATE ingest_jobs SET status = 'failed', error = :error, finished_at = now()
+            WHERE id = :id AND worker = :worker AND status = 'running'
+            """),
+            {"id": job_id, "worker": worker_id, "error": error[:2000]},
+        )
+
+
+def get_upload(job_id: int) -> dict | None:
+    """An upload job with the status counts and rows of the ingest jobs queued for it."""
+    job = get_job(job_id)
+    if job is None or job["kind"] != "upload":
+        return None
+    # Parts are queued while the body arrives, so look them up rather than wait for job_ids
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("""
+            SELECT status, count(*) AS jobs, coalesce(sum(rows), 0)::bigint AS rows
+            FROM ingest_jobs WHERE kind = 'ingest' AND (payload->>'upload_id')::bigint = :id GROUP BY status
+            """),
+            {"id": job_id},
+        ).fetchall()
+    if rows:
+        job["ingest_jobs"] = {r.status: r.jobs for r in rows}
+        job["rows"] = sum(r.rows for r in rows)
+    return job
+
+
+# ------------ STATUS ------------
+
+_JOB_COLUMNS = """
+    id, kind, status, payload, checkpoint, rows, attempts, max_attempts, worker, error,
+    run_after, created_at, started_at, heartbeat_at, finished_at
+"""
+
+
+def get_job(job_id: int) -> dict | None:
+    with engine.connect() as conn:
+        row = conn.execute(text(f"SELECT {_JOB_COLUMNS} FROM ingest_jobs WHERE id = :id"), {"id": job_id}).first()
+    return dict(row._mapping) if row else None
+
+
+def list_jobs(status: str | None = None, kind: str | None = None, limit: int = 100) -> list:
+    where, params = ["1=1"], {"limit": limit}
+    if status:
+        where.append("status = :status")
+        params["status"] = status
+    if kind:
+        where.append("kind = :kind")
+        params["kind"] = kind
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(f"SELECT {_JOB_COLUMNS} FROM ingest_jobs WHERE {' AND '.join(where)} ORDER BY id DESC LIMIT :limit"),
+            params,
+        ).fetchall()
+    return [dict(r._mapping) for r in rows]
+
+
+def retry_job(job_id: int) -> bool:
+    """Re-queue a failed job from its checkpoint with a fresh attempt budget."""
+    with engine.begin() as conn:
+        return conn.execute(
+            text("""
+            UPDATE ingest_jobs
+            SET status = 'queued', attempts = 0, error = NULL, run_after = now(), finished_at = NULL
+            WHERE id = :id AND status = 'failed'
+            """),
+            {"id": job_id},
+        ).rowcount > 0
+
+
+def queue_metrics() -> dict:
+    """Queue depth per kind/status, age of the oldest waiting job and recent throughput."""
+    with engine.connect() as conn:
+        counts = conn.execute(text("""
+            SELECT kind, status, count(*) AS jobs, coalesce(sum(rows), 0)::bigint AS rows
+            FROM ingest_jobs GROUP BY kind, status ORDER BY kind, status
+        """)).fetchall()
+        summary = conn.execute(text("""
+            SELECT
+                extract(epoch FROM now() - min(created_at) FILTER (WHERE status = 'queued')) AS oldest_queued_seconds,
+                count(DISTINCT worker) FILTER (
+                    WHERE status = 'running' AND heartbeat_at > now() - make_interval(secs => :stale)
+                ) AS active_workers,
+                count(*) FILTER (WHERE status = 'done' AND finished_at > now() - interval '1 hour') AS done_last_1h,
+                sum(rows) FILTER (WHERE status = 'done' AND finished_at > now() - interval '1 hour') AS rows_last_1h,
+                sum(extract(epoch FROM finished_at - started_at)) FILTER (
+                    WHERE status = 'done' AND finished_at > now() - interval '1 hour'
+                ) AS seconds_last_1h
+            FROM ingest_jobs
+        """), {"stale": JOB_STALE_SECONDS}).first()
+    oldest = summary.oldest_queued_seconds
+    seconds = float(summary.seconds_last_1h or 0)
+    return {
+        "jobs": [dict(r._mapping) for r in counts],
+        "oldest_queued_seconds": round(float(oldest), 1) if oldest is not None else None,
+        "active_workers": summary.active_workers,
+        "done_last_1h": summary.done_last_1h,
+        # Per-job throughput of jobs finished in the last hour (not wall-clock across the pool)
+        "rows_per_sec_last_1h": round(int(summary.rows_last_1h) / seconds, 1) if seconds else None,
+        "avg_job_seconds_last_1h": round(seconds / summary.done_last_1h, 3) if summary.done_last_1h else None,
+        "configured_processes": WORKER_PROCESSES,
+    }
+
+
+# ------------ WORKER ------------
+
+def claim(worker_id: str):
+    """Take the next runnable job: queued and due, or running with a stale heartbeat."""
+    with engine.begin() as conn:
+        row = conn.execute(
+            text(f"""
+            UPDATE ingest_jobs
+            SET status = 'running', attempts = attempts + 1, worker = :worker,
+                started_at = coalesce(started_at, now()), heartbeat_at = now(), error = NULL
+            WHERE id = (
+                SELECT id FROM ingest_jobs
+                WHERE (status = 'queued' AND run_after <= now())
+                   OR (status = 'running' AND heartbeat_at < now() - make_interval(secs => :stale))
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING {_JOB_COLUMNS}
+            """),
+            {"worker": worker_id, "stale": JOB_STALE_SECONDS},
+        ).first()
+    return row
+
+
+def _save_checkpoint(conn, job_id: int, worker_id: str, checkpoint: dict, rows: int):
+    """Store a resume point; raises JobLost (rolling the caller back) if the job moved on."""
+    updated = conn.execute(
+        text("""
+        UPDATE ingest_jobs
+        SET checkpoint = CAST(:checkpoint AS jsonb), rows = rows + :rows, heartbeat_at = now()
+        WHERE id = :id AND worker = :worker AND status = 'running'
+        """),
+        {"id": job_id, "worker": worker_id, "checkpoint": json.dumps(checkpoint), "rows": rows},
+    ).rowcount
+    if not updated:
+        raise JobLost(f"job {job_id} is no longer owned by {worker_id}")
+
+
+def _run_ingest(job, worker_id: str):
+    p = job.payload
+    start, aligned = p["start"], False
+    if job.checkpoint:
+        # Checkpoints are always just past a newline
+        start, aligned = job.checkpoint["offset"], True
+
+    def checkpoint(db, offset, rows):
+        _save_checkpoint(db.connection(), job.id, worker_id, {"offset": offset}, rows)
+
+    if "upload_id" in p:
+        source = f"upload:{p['upload_id']}:{p['part']}"
+        result = ingest_upload_part(_upload_part(p["upload_id"], p["part"]), start, p.get("chunk_size"), checkpoint)
+    else:
+        source = p["file_path"]
+        result = ingest_file_range(source, start, p["end"], p.get("chunk_size"), aligned=aligned, checkpoint=checkpoint)
+    if p.get("fingerprint"):
+        with engine.begin() as conn:
+            # A resumed shard only counts what this attempt read; dedup makes that harmless
+            record_manifest(conn, p["fingerprint"], source, p["start"], p["end"], p["size"], result)
+
+
+def _run_reembed(job, worker_id: str):
+    p = job.payload
+    start_id = job.checkpoint["last_id"] if job.checkpoint else p["start_id"]
+    with engine.connect() as conn:
+        dim = embedding_column_dim(conn)
+    embeddings.set_schema_dim(dim)
+
+    def on_batch(last_id, rows):
+        with engine.begin() as conn:
+            _save_checkpoint(conn, job.id, worker_id, {"last_id": last_id}, rows)
+
+    backfill_embeddings(
+        "embedding", dim, start_id=start_id, end_id=p["end_id"], only_missing=p.get("only_missing", False),
+        batch_size=p.get("batch_size") or REEMBED_BATCH_SIZE, on_batch=on_batch,
+    )
+    result_cache.notify_all()
+
+
+def _run_template_logs(job, worker_id: str):
+    """Queued by templates.mine_batch when templates its logs use changed or merged."""
+    p = job.payload
+    start = job.checkpoint["done"] if job.checkpoint else 0
+
+    def on_template(done, rows):
+        with engine.begin() as conn:
+            _save_checkpoint(conn, job.id, worker_id, {"done": done}, rows)
+
+    templates.relink_logs(p["template_ids"], p.get("merged"), start=start, on_template=on_template)
+    result_cache.notify_all()
+
+
+def _run_upload(job, worker_id: str):
+    """Only claimed when the API process receiving the body stopped heart-beating."""
+    raise RuntimeError("the upload was interrupted before its body was complete; parts already queued are still ingested")
+
+
+_RUNNERS = {
+    "ingest": _run_ingest,
+    "reembed": _run_reembed,
+    "template_logs": _run_template_logs,
+    "upload": _run_upload,
+}
+
+
+def _heartbeat(job_id: int, worker_id: str, done: threading.Event):
+    while not done.wait(JOB_HEARTBEAT_INTERVAL):
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    text("UPDATE ingest_jobs SET heartbeat_at = now() WHERE id = :id AND worker = :worker"),
+                    {"id": job_id, "worker": worker_id},
+                )
+        except Exception:
+            logger.exception("Heartbeat for job %s failed", job_id)
+
+
+def _finish(job, worker_id: str, error: str | None = None):
+    with engine.begin() as conn:
+        if error is None:
+            conn.execute(
+                text("""
+                UPDATE ingest_jobs SET status = 'done', finished_at = now(), heartbeat_at = now()
+                WHERE id = :id AND worker = :worker
+                """),
+                {"id": job.id, "worker": worker_id},
+            )
+            if job.kind == "ingest" and "upload_id" in job.payload:
+                # Failed parts stay stored, so retry_job() can run them again
+                conn.execute(
+                    text("DELETE FROM ingest_upload_parts WHERE upload_id = :id AND part = :part"),
+                    {"id": job.payload["upload_id"], "part": job.payload["part"]},
+                )
+        else:
+            # Exponential backoff: JOB_RETRY_BACKOFF, then x2 per further attempt
+            conn.execute(
+                text("""
+                UPDATE ingest_jobs
+                SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+                    finished_at = CASE WHEN attempts >= max_attempts THEN now() END,
+                    run_after = now() + make_interval(secs => :backoff * power(2, attempts - 1)),
+                    error = :error
+                WHERE id = :id AND worker = :worker
+                """),
+                {"id": job.id, "worker": worker_id, "error": error[:2000], "backoff": JOB_RETRY_BACKOFF},
+            )
+
+
+def keep_alive(job_id: int, worker_id: str) -> threading.Event:
+    """Heartbeat a job from a background thread until the returned event is set."""
+    done = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job_id, worker_id, done), daemon=True).start()
+    return done
+
+
+def run_one(worker_id: str) -> bool:
+    """Claim and run a single job. Returns False when nothing was runnable."""
+    job = claim(worker_id)
+    if job is None:
+        return False
+    logger.info("Worker %s running %s job %s (attempt %s)", worker_id, job.kind, job.id, job.attempts)
+    done = keep_alive(job.id, worker_id)
+    try:
+        _RUNNERS[job.kind](job, worker_id)
+    except JobLost:
+        logger.warning("Job %s was reclaimed from worker %s", job.id, worker_id)
+    except Exception as e:
+        logger.exception("Job %s failed", job.id)
+        _finish(job, worker_id, error=f"{type(e).__name__}: {e}")
+    else:
+        _finish(job, worker_id)
+    finally:
+        done.set()
+    return True
+
+
+def run_worker(worker_id: str | None = None, stop: threading.Event | None = None):
+    """Process jobs until stop is set, sleeping WORKER_POLL_INTERVAL when the queue is empty."""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        try:
+            if run_one(worker_id):
+                continue
+        except Exception:
+            logger.exception("Worker %s could not claim a job", worker_id)
+        stop.wait(WORKER_POLL_INTERVAL)
+
+
+def _process_main(index: int):
+    logging.basicConfig(level=logging.INFO)
+    # A fresh interpreter (spawn) has its own engine; only the logs.embedding dim must be loaded
+    with engine.connect() as conn:
+        dim = embedding_column_dim(conn)
+    if dim:
+        embeddings.set_schema_dim(dim)
+    # Drift is measured where logs are ingested, so refits are scheduled here
+    cluster_model.start_scheduler()
+    run_worker(f"{socket.gethostname()}:{os.getpid()}:{index}")
+
+
+def start_pool(processes: int | None = None) -> int:
+    """Start the worker processes (once per API process). Returns how many run."""
+    processes = WORKER_PROCESSES if processes is None else processes
+    if not _pool:
+        ctx = multiprocessing.get_context("spawn")
+        for i in range(processes):
+            p = ctx.Process(target=_process_main, args=(i,), name=f"ingest-worker-{i}", daemon=True)
+            p.start()
+            _pool.append(p)
+    return len(_pool)
+
+
+def stop_pool():
+    for p in _pool:
+        p.terminate()
+    for p in _pool:
+        p.join(timeout=5)
+    _pool.clear()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run ingest/re-embed job workers.")
+    parser.add_argument("--processes", type=int, default=WORKER_PROCESSES or os.cpu_count())
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    # The worker service may come up before the API has created the schema
+    init_db()
+    start_pool(args.processes)
+    try:
+        for p in _pool:
+            p.join()
+    except KeyboardInterrupt:
+        stop_pool()
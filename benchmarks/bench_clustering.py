@@ -0,0 +1,75 @@
+"""Compare the /cluster algorithms on synthetic log embeddings with known template clusters.
+
+    python benchmarks/bench_clustering.py --rows 20000 50000 200000 --dim 384
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+sys.path.insert(0, os.path.join(ROOT, "data"))
+
+from analyzer import fit_clusters, fit_clusters_streaming  # noqa: E402
+from generate_logs import errors, info_logs  # noqa: E402
+
+
+def synthetic_embeddings(n: int, dim: int, noise: float, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    templates = errors + info_logs
+    centers = rng.standard_normal((len(templates), dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    truth = rng.integers(0, len(templates), size=n)
+    X = centers[truth] + noise * rng.standard_normal((n, dim)).astype(np.float32) / np.sqrt(dim)
+    return X.astype(np.float32), truth
+
+
+def _chunks(X, size):
+    ids = np.arange(len(X))
+    return lambda: ((ids[i:i + size], X[i:i + size]) for i in range(0, len(X), size))
+
+
+def run(n: int, dim: int, k: int, noise: float, skip_kmeans_above: int):
+    X, truth = synthetic_embeddings(n, dim, noise)
+    cases = [
+        ("minibatch", lambda: fit_clusters(X, k, "minibatch")[0]),
+        ("minibatch+sample", lambda: fit_clusters(X, k, "minibatch", sample_size=20000)[0]),
+        ("minibatch+pca64", lambda: fit_clusters(X, k, "minibatch", pca_components=64)[0]),
+        ("streaming", None),
+    ]
+    if n <= skip_kmeans_above:
+        cases.insert(0, ("kmeans", lambda: fit_clusters(X, k, "kmeans")[0]))
+
+    for name, fn in cases:
+        start = time.perf_counter()
+        if name == "streaming":
+            _, _, model, _ = fit_clusters_streaming(_chunks(X, 10000), k)
+            labels = model.predict(X)
+        else:
+            labels = fn()
+        elapsed = time.perf_counter() - start
+        ari = adjusted_rand_score(truth, labels)
+        print(f"{n:>9} {name:<18} {elapsed:>9.2f}s   ARI={ari:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 50000, 200000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=len(errors) + len(info_logs))
+    parser.add_argument("--noise", type=float, default=0.8)
+    parser.add_argument("--skip-kmeans-above", type=int, default=200000,
+                        help="full KMeans(n_init=10) is skipped for larger row counts")
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'algorithm':<18} {'fit+assign':>10}")
+    for n in args.rows:
+        run(n, args.dim, args.clusters, args.noise, args.skip_kmeans_above)
+
+
+if __name__ == "__main__":
+    main()
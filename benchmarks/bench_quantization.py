@@ -0,0 +1,171 @@
+"""Recall vs. speed of quantized search (NumPy store, or the Postgres index with --sql) against exact search.
+
+    python benchmarks/bench_quantization.py --rows 100000 1000000 --rescore 1 4 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+from vector_store import QUANTIZATIONS, VectorStore  # noqa: E402
+
+APPEND_ROWS = 100000
+
+
+def synthetic_chunks(n: int, dim: int, clusters: int = 500, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    offset = 2.0 * rng.standard_normal(dim).astype(np.float32)
+    for lo in range(0, n, APPEND_ROWS):
+        size = min(APPEND_ROWS, n - lo)
+        X = centers[rng.integers(0, clusters, size)] + offset + rng.standard_normal((size, dim)).astype(np.float32)
+        yield np.arange(lo + 1, lo + size + 1, dtype=np.int64), X
+
+
+def db_chunks(n: int):
+    from db import iter_embedding_chunks
+
+    seen = 0
+    for ids, X in iter_embedding_chunks(chunk_size=APPEND_ROWS):
+        X = X[:n - seen]
+        yield ids[:len(X)], X
+        seen += len(X)
+        if seen >= n:
+            break
+
+
+def build(path: str, quantization: str, chunks) -> VectorStore:
+    store = None
+    for ids, X in chunks:
+        store = store or VectorStore(path, X.shape[1], quantization)
+        now = [datetime(2024, 1, 1)] * len(ids)
+        store.append(ids, X, ["INFO"] * len(ids), ["bench"] * len(ids), now)
+    return store
+
+
+def sample_queries(store: VectorStore, count: int, seed: int = 1) -> np.ndarray:
+    """Stored vectors plus noise, so every query has close neighbours."""
+    rng = np.random.default_rng(seed)
+    vectors = store._arrays["vectors"]
+    picked = np.sort(rng.choice(store.count, size=min(count, store.count), replace=False))
+    Q = np.asarray(vectors[picked])
+    return Q + 0.3 * rng.standard_normal(Q.shape).astype(np.float32) / np.sqrt(Q.shape[1])
+
+
+def timed_search(store: VectorStore, Q: np.ndarray, top_k: int, rescore: int | None) -> tuple:
+    store.search(Q[:1], top_k, rescore=rescore)  # warm the page cache
+    results, times = [], []
+    for q in Q:
+        start = time.perf_counter()
+        results.append(store.search(q[None, :], top_k, rescore=rescore)[0][0])
+        times.append(time.perf_counter() - start)
+    return results, 1000 * float(np.median(times))
+
+
+def run(n: int, args):
+    chunks = (lambda: db_chunks(n)) if args.from_db else (lambda: synthetic_chunks(n, args.dim))
+    with tempfile.TemporaryDirectory() as path:
+        exact_store = build(os.path.join(path, "none"), "none", chunks())
+        if exact_store is None:
+            print("no embedded logs found")
+            return
+        Q = sample_queries(exact_store, args.queries)
+        exact, exact_ms = timed_search(exact_store, Q, args.top_k, None)
+        vector_bytes = exact_store.disk_bytes()["vectors"] * exact_store.count // exact_store.capacity
+        print(f"{exact_store.count:>9} {'none':<8} {'-':>7} {'1.000':>8} {exact_ms:>9.2f} ms {vector_bytes / 2**20:>9.1f} MiB")
+
+        for quantization in QUANTIZATIONS[1:]:
+            store = build(os.path.join(path, quantization), quantization, chunks())
+            code_bytes = store.disk_bytes()["codes"] * store.count // store.capacity
+            for rescore in args.rescore:
+                found, ms = timed_search(store, Q, args.top_k, rescore)
+                recall = np.mean([len(np.intersect1d(a, b)) / len(a) for a, b in zip(exact, found)])
+                print(f"{store.count:>9} {quantization:<8} {rescore:>7} {recall:>8.3f} {ms:>9.2f} ms "
+                      f"{code_bytes / 2**20:>9.1f} MiB")
+
+
+def sql_run(args):
+    from sqlalchemy import text
+    import analyzer
+    from db import INDEX_QUANTIZATIONS, build_vector_index, engine, get_db, iter_embedding_chunks, vector_index_info
+
+    with engine.connect() as conn:
+        original = vector_index_info(conn)
+        ids = [r[0] for r in conn.execute(text(
+            "SELECT id FROM logs WHERE embedding IS NOT NULL ORDER BY random() LIMIT :n"
+        ), {"n": args.queries})]
+    if not ids:
+        print("no embedded logs found")
+        return
+    _, Q = next(iter_embedding_chunks("id = ANY(:ids)", {"ids": ids}))
+    rng = np.random.default_rng(1)
+    Q = Q + 0.3 * rng.standard_normal(Q.shape).astype(np.float32) / np.sqrt(Q.shape[1])
+
+    db = get_db()
+    try:
+        exact = [
+            [r.id for r in db.execute(text(analyzer._search_sql("1=1", exact=True)),
+                                      {"embedding": analyzer.Vector(q), "limit": args.top_k})]
+            for q in Q
+        ]
+        db.rollback()
+        for quantization in INDEX_QUANTIZATIONS:
+            start = time.perf_counter()
+            build_vector_index(args.method, quantization=quantization, rebuild=True)
+            built = time.perf_counter() - start
+            analyzer._index_method.clear()
+            # pg_partition_tree is empty for an index on a plain table
+            size = db.execute(text("""
+                SELECT coalesce(sum(pg_relation_size(t.relid)), pg_relation_size(CAST(:name AS regclass)))
+                FROM pg_partition_tree(CAST(:name AS regclass)) t
+            """), {"name": f"logs_embedding_{args.method}_idx"}).scalar()
+            db.rollback()
+            for rescore in args.rescore if quantization != "none" else [1]:
+                found, times = [], []
+                for q in Q:
+                    started = time.perf_counter()
+                    rows, _ = analyzer.sql_search(db, q, args.top_k, rescore=rescore)
+                    times.append(time.perf_counter() - started)
+                    db.rollback()
+                    found.append([r["id"] for r in rows])
+                recall = np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(exact, found)])
+                print(f"{args.method:>9} {quantization:<8} {rescore:>7} {recall:>8.3f} "
+                      f"{1000 * float(np.median(times)):>9.2f} ms {size / 2**20:>9.1f} MiB  (built in {built:.1f}s)")
+    finally:
+        db.close()
+        if original:
+            build_vector_index(original[0], quantization=original[1], rebuild=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 500000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--rescore", type=int, nargs="+", default=[1, 4, 10],
+                        help="candidates rescored exactly per requested result")
+    parser.add_argument("--from-db", action="store_true", help="use logs.embedding instead of synthetic vectors")
+    parser.add_argument("--sql", action="store_true",
+                        help="benchmark quantized pgvector indexes on logs instead (rebuilds the index: use a scratch database)")
+    parser.add_argument("--method", choices=["hnsw", "ivfflat"], default="hnsw", help="ANN index method for --sql")
+    args = parser.parse_args()
+
+    if args.sql:
+        print(f"{'index':>9} {'quant':<8} {'rescore':>7} {'recall@k':>8} {'latency':>12} {'index size':>13}")
+        sql_run(args)
+        return
+    print(f"{'rows':>9} {'quant':<8} {'rescore':>7} {'recall@k':>8} {'latency':>12} {'scanned':>13}")
+    for n in args.rows:
+        run(n, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Latency of the NumPy vector store vs. pgvector (--sql, --hnsw) on synthetic log embeddings.
+
+    python benchmarks/bench_search.py --rows 100000 1000000 5000000 --dim 384
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+from vector_store import VectorStore  # noqa: E402
+
+LEVELS = ["INFO", "WARN", "ERROR", "DEBUG"]
+SERVICES = [f"service-{i}" for i in range(20)]
+EPOCH = datetime(2024, 1, 1)
+SPAN_SECONDS = 30 * 86400
+APPEND_ROWS = 100000
+TABLE = "bench_search_logs"
+
+
+def synthetic_chunks(n: int, dim: int, seed: int = 0):
+    """(ids, vectors, levels, services, timestamps) chunks; same data for a given seed."""
+    rng = np.random.default_rng(seed)
+    for lo in range(0, n, APPEND_ROWS):
+        size = min(APPEND_ROWS, n - lo)
+        X = rng.standard_normal((size, dim)).astype(np.float32)
+        X /= np.linalg.norm(X, axis=1, keepdims=True)
+        levels = [LEVELS[i] for i in rng.choice(len(LEVELS), size, p=[0.6, 0.2, 0.15, 0.05])]
+        services = [SERVICES[i] for i in rng.integers(0, len(SERVICES), size)]
+        seconds = rng.integers(0, SPAN_SECONDS, size)
+        timestamps = [EPOCH + timedelta(seconds=int(s)) for s in seconds]
+        yield np.arange(lo + 1, lo + size + 1, dtype=np.int64), X, levels, services, timestamps
+
+
+def filters():
+    last_day = EPOCH + timedelta(seconds=SPAN_SECONDS - 86400)
+    return [
+        ("none", {}),
+        ("level", {"level": "ERROR"}),
+        ("service+level", {"level": "ERROR", "service": "service-3"}),
+        ("last 24h", {"start": last_day}),
+    ]
+
+
+def timed(fn, queries) -> float:
+    """Median milliseconds per query."""
+    fn(queries[0])  # warm caches
+    times = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        times.append(time.perf_counter() - start)
+    return 1000 * float(np.median(times))
+
+
+def bench_numpy(n: int, dim: int, queries, top_k: int, batch: int):
+    with tempfile.TemporaryDirectory() as path:
+        store = VectorStore(path, dim)
+        start = time.perf_counter()
+        for chunk in synthetic_chunks(n, dim):
+            store.append(*chunk)
+        print(f"{n:>9} numpy    build {time.perf_counter() - start:>8.2f}s")
+        for name, f in filters():
+            ms = timed(lambda q: store.search(q[None, :], top_k, f.get("level"), f.get("service"), f.get("start")),
+                       queries)
+            print(f"{n:>9} numpy    {name:<14} {ms:>9.2f} ms")
+        start = time.perf_counter()
+        store.search(queries[:batch], top_k)
+        per_query = 1000 * (time.perf_counter() - start) / batch
+        print(f"{n:>9} numpy    batch of {batch:<5} {per_query:>9.2f} ms/query")
+
+
+def bench_sql(n: int, dim: int, queries, top_k: int, hnsw: bool):
+    from psycopg2.extras import execute_values
+    from sqlalchemy import text
+    from db import engine
+
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+        conn.execute(text(f"""
+            CREATE UNLOGGED TABLE {TABLE} (
+                id BIGINT PRIMARY KEY, level TEXT, service TEXT, timestamp TIMESTAMP, embedding vector({dim})
+            )"""))
+    try:
+        start = time.perf_counter()
+        raw = engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            for ids, X, levels, services, timestamps in synthetic_chunks(n, dim):
+                rows = [
+                    (int(i), lv, sv, ts, "[" + ",".join(f"{x:.6f}" for x in v) + "]")
+                    for i, v, lv, sv, ts in zip(ids, X, levels, services, timestamps)
+                ]
+                execute_values(cursor, f"INSERT INTO {TABLE} VALUES %s", rows, page_size=1000)
+            cursor.execute(f"CREATE INDEX ON {TABLE} (level, service, timestamp)")
+            cursor.execute(f"CREATE INDEX ON {TABLE} (timestamp)")
+            if hnsw:
+                cursor.execute(f"CREATE INDEX ON {TABLE} USING hnsw (embedding vector_cosine_ops)")
+            cursor.execute(f"ANALYZE {TABLE}")
+            raw.commit()
+        finally:
+            raw.close()
+        print(f"{n:>9} sql      build {time.perf_counter() - start:>8.2f}s")
+
+        modes = [("sql-exact", "SET LOCAL enable_indexscan = off")] + ([("sql-hnsw", "SELECT 1")] if hnsw else [])
+        for mode, setting in modes:
+            for name, f in filters():
+                where = ["1=1"]
+                params = {"limit": top_k, **f}
+                if "level" in f:
+                    where.append("level = :level")
+                if "service" in f:
+                    where.append("service = :service")
+                if "start" in f:
+                    where.append("timestamp >= :start")
+                sql = text(f"""
+                    SELECT id, embedding <=> CAST(:q AS vector) AS distance FROM {TABLE}
+                    WHERE {' AND '.join(where)} ORDER BY embedding <=> CAST(:q AS vector) LIMIT :limit
+                """)
+
+                def run(q):
+                    with engine.begin() as conn:
+                        conn.execute(text(setting))
+                        conn.execute(sql, {**params, "q": "[" + ",".join(f"{x:.6f}" for x in q) + "]"}).fetchall()
+
+                print(f"{n:>9} {mode:<8} {name:<14} {timed(run, queries):>9.2f} ms")
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=20, help="single queries timed per filter (median reported)")
+    parser.add_argument("--batch", type=int, default=64, help="queries ranked together in the batch case")
+    parser.add_argument("--sql", action="store_true", help="also load the rows into Postgres and time pgvector")
+    parser.add_argument("--hnsw", action="store_true", help="with --sql, also time an HNSW index scan")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    queries = rng.standard_normal((max(args.queries, args.batch), args.dim)).astype(np.float32)
+    print(f"{'rows':>9} {'backend':<8} {'filter':<14} {'latency':>12}")
+    for n in args.rows:
+        bench_numpy(n, args.dim, queries, args.top_k, args.batch)
+        if args.sql:
+            bench_sql(n, args.dim, queries[:args.queries], args.top_k, args.hnsw)
+
+
+if __name__ == "__main__":
+    main()
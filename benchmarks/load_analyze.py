@@ -0,0 +1,79 @@
+"""Concurrent load test for POST /analyze: throughput and latency percentiles per concurrency level.
+
+    python benchmarks/load_analyze.py --url http://localhost:8000 --concurrency 1 8 32 --requests 200
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "data"))
+
+from generate_logs import errors  # noqa: E402
+
+
+async def _client(client, url, queue, latencies, failures, top_k):
+    while True:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        payload = {"log_message": random.choice(errors), "top_k": top_k}
+        start = time.perf_counter()
+        try:
+            r = await client.post(f"{url}/analyze", json=payload)
+            if r.status_code != 200:
+                failures.append(r.status_code)
+                continue
+        except httpx.HTTPError as e:
+            failures.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+def _pct(sorted_values, p):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+async def run(url: str, concurrency: int, n_requests: int, top_k: int, timeout: float):
+    queue = asyncio.Queue()
+    for i in range(n_requests):
+        queue.put_nowait(i)
+    latencies, failures = [], []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            _client(client, url, queue, latencies, failures, top_k) for _ in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(
+        f"{concurrency:>11} {len(latencies):>6} {len(failures):>6} {len(latencies) / elapsed:>9.1f}"
+        f" {_pct(latencies, 50) * 1000:>8.1f} {_pct(latencies, 95) * 1000:>8.1f} {_pct(latencies, 99) * 1000:>8.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=os.getenv("BACKEND_URL", "http://localhost:8000"))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    print(f"{'concurrency':>11} {'ok':>6} {'failed':>6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for c in args.concurrency:
+        asyncio.run(run(args.url.rstrip("/"), c, args.requests, args.top_k, args.timeout))
+
+
+if __name__ == "__main__":
+    main()
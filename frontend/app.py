@@ -279,7 +279,7 @@ with tab2:
 
 # ------------ DEPLOYMENTS TAB ------------
 with tab3:
-    st.caption("Logs occurring after deployments for a given service")
+    st.caption("Deployments ranked by the error spike that followed them")
 
     service = st.text_input("Service", placeholder="e.g. api-gateway", key="correlate_service")
 
@@ -295,6 +295,22 @@ with tab3:
                     response.raise_for_status()
                     data = response.json()
                     logs = data.get("deployment_logs", [])
+                    deployments = data.get("deployments", [])
+
+                    if deployments:
+                        st.dataframe(
+                            [
+                                {
+                                    "version": d.get("version"),
+                                    "deployed_at": str(d.get("deployed_at", ""))[:19],
+                                    "errors before": d.get("errors_before"),
+                                    "errors after": d.get("errors_after"),
+                                    "spike score": d.get("spike_score"),
+                                }
+                                for d in deployments
+                            ],
+                            use_container_width=True,
+                        )
 
                     if not logs:
                         st.info(f"No post-deployment logs for {service}.")
@@ -327,7 +343,11 @@ with tab4:
                     timeout=120,
                 )
                 r.raise_for_status()
-                st.success("Logs ingested.")
+                queued = r.json()
+                if queued["job_ids"]:
+                    st.success(f"Logs queued for ingest (jobs {', '.join(map(str, queued['job_ids']))}).")
+                else:
+                    st.info("This file was already ingested.")
             except Exception as e:
                 st.error(str(e))
     with col2:
@@ -339,7 +359,7 @@ with tab4:
                     timeout=30,
                 )
                 r.raise_for_status()
-                st.success("Deployments ingested.")
+                st.success(f"Deployments ingested ({r.json()['inserted']} new).")
             except Exception as e:
                 st.error(str(e))
 